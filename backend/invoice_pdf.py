@@ -0,0 +1,247 @@
+"""Server-side invoice PDF rendering.
+
+Kept free of app state (database, settings, clients) so it can be imported
+cheaply by process-pool workers. ``render_invoice_pdf`` takes the plain dict
+built by ``server.invoice_pdf_document`` and returns the PDF bytes; the layout
+follows the invoice PDF the frontend generates with jsPDF.
+"""
+import base64
+import binascii
+import io
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader, simpleSplit
+from reportlab.pdfgen import canvas
+
+# Bump when the layout changes so cached PDFs are re-rendered
+RENDERER_VERSION = 1
+
+BRAND_COLOR = (200 / 255, 100 / 255, 50 / 255)
+TEXT_COLOR = (60 / 255, 60 / 255, 60 / 255)
+MUTED_COLOR = (120 / 255, 120 / 255, 120 / 255)
+PANEL_COLOR = (245 / 255, 245 / 255, 245 / 255)
+STRIPE_COLOR = (250 / 255, 250 / 255, 250 / 255)
+WHITE = (1, 1, 1)
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+MARGIN = 20 * mm
+ROW_HEIGHT = 8 * mm
+FOOTER_Y = 17 * mm
+# Qty is centred; Unit Price and Amount are right-aligned
+QTY_CENTER = PAGE_WIDTH - 10 * mm - 92.5 * mm
+PRICE_RIGHT = PAGE_WIDTH - 10 * mm - 44 * mm
+AMOUNT_RIGHT = PAGE_WIDTH - 10 * mm - 4 * mm
+
+
+def money(value) -> str:
+    return f"${(value or 0):,.2f}"
+
+
+def decode_logo(data_url: str):
+    """Return an ImageReader for a ``data:image/...;base64,`` URL, or None if unusable"""
+    if not data_url or not data_url.startswith("data:image/") or "," not in data_url:
+        return None
+    try:
+        raw = base64.b64decode(data_url.split(",", 1)[1], validate=False)
+        return ImageReader(io.BytesIO(raw))
+    except (binascii.Error, ValueError, OSError):
+        return None
+
+
+def top(y_from_top: float) -> float:
+    """Convert a distance from the top of the page into a reportlab y coordinate"""
+    return PAGE_HEIGHT - y_from_top
+
+
+def draw_header(pdf: canvas.Canvas, document: dict):
+    business = document["business"]
+    pdf.setFillColorRGB(*BRAND_COLOR)
+    pdf.rect(0, top(35 * mm), PAGE_WIDTH, 35 * mm, stroke=0, fill=1)
+
+    text_x = MARGIN
+    logo = decode_logo(business.get("logo_data_url", ""))
+    if logo:
+        pdf.drawImage(logo, MARGIN, top(31 * mm), width=27 * mm, height=27 * mm,
+                      preserveAspectRatio=True, anchor="w", mask="auto")
+        text_x = MARGIN + 31 * mm
+
+    pdf.setFillColorRGB(*WHITE)
+    pdf.setFont("Helvetica-Bold", 22)
+    pdf.drawString(text_x, top(22 * mm), business.get("name") or "Business")
+    if business.get("abn"):
+        pdf.setFont("Helvetica", 10)
+        pdf.drawString(text_x, top(30 * mm), f"ABN: {business['abn']}")
+
+    pdf.setFont("Helvetica-Bold", 24)
+    pdf.drawRightString(PAGE_WIDTH - MARGIN, top(22 * mm), "TAX INVOICE" if business.get("gst_enabled") else "INVOICE")
+
+
+def draw_details(pdf: canvas.Canvas, document: dict):
+    invoice = document["invoice"]
+    details_x = PAGE_WIDTH - 70 * mm
+    rows = [("Invoice No:", invoice["invoice_number"], True), ("Date:", invoice["date"], False)]
+    if invoice.get("due_date"):
+        rows.append(("Due Date:", invoice["due_date"], False))
+
+    pdf.setFillColorRGB(*TEXT_COLOR)
+    for index, (label, value, bold) in enumerate(rows):
+        y = top((50 + index * 8) * mm)
+        pdf.setFont("Helvetica", 10)
+        pdf.drawString(details_x, y, label)
+        pdf.setFont("Helvetica-Bold" if bold else "Helvetica", 10)
+        pdf.drawString(details_x + 35 * mm, y, value or "")
+
+
+def draw_bill_to(pdf: canvas.Canvas, document: dict) -> float:
+    """Draw the BILL TO panel and return its bottom edge (distance from the top)"""
+    client = document["client"]
+    address_lines = simpleSplit(client.get("address") or "", "Helvetica", 10, 80 * mm)
+    contact_lines = [line for line in (client.get("phone"), client.get("email")) if line]
+
+    content_height = 8 + 6 + 5 * (len(address_lines) + len(contact_lines))
+    box_height = max(35, content_height + 10)
+    pdf.setFillColorRGB(*PANEL_COLOR)
+    pdf.rect(MARGIN, top((45 + box_height) * mm), 90 * mm, box_height * mm, stroke=0, fill=1)
+
+    pdf.setFillColorRGB(*BRAND_COLOR)
+    pdf.setFont("Helvetica-Bold", 11)
+    pdf.drawString(25 * mm, top(53 * mm), "BILL TO")
+
+    pdf.setFillColorRGB(*TEXT_COLOR)
+    pdf.setFont("Helvetica-Bold", 10)
+    pdf.drawString(25 * mm, top(61 * mm), client.get("name") or "Customer")
+    pdf.setFont("Helvetica", 10)
+    y = 67
+    for line in address_lines + contact_lines:
+        pdf.drawString(25 * mm, top(y * mm), line)
+        y += 5
+    return 45 + box_height
+
+
+def draw_table_header(pdf: canvas.Canvas, y: float) -> float:
+    pdf.setFillColorRGB(*BRAND_COLOR)
+    pdf.rect(MARGIN, y - ROW_HEIGHT, PAGE_WIDTH - 30 * mm, ROW_HEIGHT, stroke=0, fill=1)
+    pdf.setFillColorRGB(*WHITE)
+    pdf.setFont("Helvetica-Bold", 10)
+    baseline = y - ROW_HEIGHT + 2.8 * mm
+    pdf.drawString(MARGIN + 4 * mm, baseline, "Description")
+    pdf.drawCentredString(QTY_CENTER, baseline, "Qty")
+    pdf.drawRightString(PRICE_RIGHT, baseline, "Unit Price")
+    pdf.drawRightString(AMOUNT_RIGHT, baseline, "Amount")
+    return y - ROW_HEIGHT
+
+
+def draw_items(pdf: canvas.Canvas, document: dict, start_from_top: float) -> float:
+    """Draw line items and totals, breaking onto new pages as needed; return the final y"""
+    y = draw_table_header(pdf, top(start_from_top * mm))
+    description_width = QTY_CENTER - MARGIN - 20 * mm
+
+    for index, item in enumerate(document["invoice"]["items"]):
+        lines = simpleSplit(item.get("name") or "", "Helvetica", 10, description_width) or [""]
+        height = ROW_HEIGHT + (len(lines) - 1) * 4.5 * mm
+        if y - height < FOOTER_Y + 15 * mm:
+            pdf.showPage()
+            y = draw_table_header(pdf, top(MARGIN))
+        if index % 2:
+            pdf.setFillColorRGB(*STRIPE_COLOR)
+            pdf.rect(MARGIN, y - height, PAGE_WIDTH - 30 * mm, height, stroke=0, fill=1)
+        pdf.setFillColorRGB(*TEXT_COLOR)
+        pdf.setFont("Helvetica", 10)
+        baseline = y - 5.3 * mm
+        for offset, line in enumerate(lines):
+            pdf.drawString(MARGIN + 4 * mm, baseline - offset * 4.5 * mm, line)
+        pdf.drawCentredString(QTY_CENTER, baseline, str(item.get("quantity", 1)))
+        pdf.drawRightString(PRICE_RIGHT, baseline, money(item.get("unit_price")))
+        pdf.drawRightString(AMOUNT_RIGHT, baseline, money(item.get("total")))
+        y -= height
+
+    invoice = document["invoice"]
+    totals = []
+    if invoice.get("discount"):
+        totals.append(("Discount:", f"-{money(invoice['discount'])}"))
+    if document["business"].get("gst_enabled") and invoice.get("gst_amount"):
+        totals.append(("GST (incl.):", money(invoice["gst_amount"])))
+
+    y -= 2 * mm
+    if y - ROW_HEIGHT * (len(totals) + 1) < FOOTER_Y + 15 * mm:
+        pdf.showPage()
+        y = top(MARGIN)
+    for label, value in totals:
+        pdf.setFillColorRGB(*TEXT_COLOR)
+        pdf.setFont("Helvetica-Bold", 10)
+        pdf.drawRightString(PRICE_RIGHT, y - 5.3 * mm, label)
+        pdf.drawRightString(AMOUNT_RIGHT, y - 5.3 * mm, value)
+        y -= ROW_HEIGHT
+
+    pdf.setFillColorRGB(*BRAND_COLOR)
+    pdf.rect(PRICE_RIGHT - 36 * mm, y - ROW_HEIGHT, AMOUNT_RIGHT + 4 * mm - (PRICE_RIGHT - 36 * mm), ROW_HEIGHT, stroke=0, fill=1)
+    pdf.setFillColorRGB(*WHITE)
+    pdf.setFont("Helvetica-Bold", 11)
+    pdf.drawRightString(PRICE_RIGHT, y - 5.3 * mm, "TOTAL:")
+    pdf.drawRightString(AMOUNT_RIGHT, y - 5.3 * mm, money(invoice.get("total")))
+    return y - ROW_HEIGHT
+
+
+def draw_block(pdf: canvas.Canvas, y: float, title: str, lines: list) -> float:
+    """Draw a titled paragraph below y, starting a new page if it does not fit"""
+    if y - (len(lines) + 1) * 5 * mm < FOOTER_Y + 10 * mm:
+        pdf.showPage()
+        y = top(MARGIN)
+    pdf.setFillColorRGB(*TEXT_COLOR)
+    pdf.setFont("Helvetica-Bold", 10)
+    pdf.drawString(MARGIN, y, title)
+    pdf.setFont("Helvetica", 10)
+    for line in lines:
+        y -= 5 * mm
+        pdf.drawString(MARGIN, y, line)
+    return y - 10 * mm
+
+
+def draw_footer(pdf: canvas.Canvas, document: dict):
+    business = document["business"]
+    pdf.setStrokeColorRGB(*BRAND_COLOR)
+    pdf.setLineWidth(0.5 * mm)
+    pdf.line(MARGIN, FOOTER_Y + 5 * mm, PAGE_WIDTH - MARGIN, FOOTER_Y + 5 * mm)
+    pdf.setFillColorRGB(*MUTED_COLOR)
+    pdf.setFont("Helvetica", 9)
+    pdf.drawCentredString(PAGE_WIDTH / 2, FOOTER_Y, "Thank you for your business!")
+    contact = " | ".join(value for value in (business.get("phone"), business.get("email")) if value)
+    if contact:
+        pdf.drawCentredString(PAGE_WIDTH / 2, FOOTER_Y - 5 * mm, contact)
+
+
+def render_invoice_pdf(document: dict) -> bytes:
+    """Render an invoice document (see ``server.invoice_pdf_document``) to PDF bytes"""
+    output = io.BytesIO()
+    invoice = document["invoice"]
+    pdf = canvas.Canvas(output, pagesize=A4, pageCompression=1, invariant=1)
+    pdf.setTitle(f"Invoice {invoice['invoice_number']}")
+    pdf.setAuthor(document["business"].get("name") or "")
+
+    draw_header(pdf, document)
+    draw_details(pdf, document)
+    bill_to_bottom = draw_bill_to(pdf, document)
+    y = draw_items(pdf, document, max(90, bill_to_bottom + 5)) - 15 * mm
+
+    if invoice.get("notes"):
+        y = draw_block(pdf, y, "Notes:", simpleSplit(invoice["notes"], "Helvetica", 10, PAGE_WIDTH - 2 * MARGIN))
+
+    business = document["business"]
+    payment = []
+    if business.get("bank_name"):
+        payment.append(f"Bank: {business['bank_name']}")
+    if business.get("account_name"):
+        payment.append(f"Account name: {business['account_name']}")
+    if business.get("bsb") or business.get("account_number"):
+        payment.append(f"BSB: {business.get('bsb', '')}   Account: {business.get('account_number', '')}")
+    if business.get("pay_id"):
+        payment.append(f"PayID: {business['pay_id']}")
+    if payment:
+        draw_block(pdf, y, "Payment details:", payment)
+
+    # Like the client-side PDF, the footer closes the last page
+    draw_footer(pdf, document)
+    pdf.showPage()
+    pdf.save()
+    return output.getvalue()
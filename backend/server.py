@@ -1,19 +1,32 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, BackgroundTasks, Query
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, BackgroundTasks, Query, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, StreamingResponse, Response
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import InsertOne, UpdateOne, UpdateMany, DeleteMany, ReplaceOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional
+from typing import Dict, List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
 import asyncio
+import time
+import functools
+from abc import ABC, abstractmethod
+import hashlib
+import secrets
+import zlib
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
@@ -22,7 +35,16 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
 import json
+import io
+import re
+import base64
+import csv
+import zipfile
+import pytz
+from invoice_pdf import render_invoice_pdf, RENDERER_VERSION as INVOICE_PDF_RENDERER_VERSION
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -35,6 +57,17 @@ db = client[os.environ['DB_NAME']]
 # Supabase configuration for backups
 SUPABASE_URL = os.environ.get('SUPABASE_URL', '')
 SUPABASE_KEY = os.environ.get('SUPABASE_KEY', '')
+BACKUP_COMPACTION_HOURS = int(os.environ.get('BACKUP_COMPACTION_HOURS', '24'))
+BACKUP_WATERMARK_OVERLAP_SECONDS = 5
+BACKUP_FLUSH_INTERVAL_SECONDS = float(os.environ.get('BACKUP_FLUSH_INTERVAL_SECONDS', '60'))
+BACKUP_MAX_CONCURRENCY = int(os.environ.get('BACKUP_MAX_CONCURRENCY', '4'))
+BACKUP_STORAGE = os.environ.get('BACKUP_STORAGE', 'supabase')  # "supabase" or "local"
+BACKUP_LOCAL_DIR = os.environ.get('BACKUP_LOCAL_DIR', str(ROOT_DIR / 'backups'))
+BACKUP_BUCKET = os.environ.get('BACKUP_BUCKET', 'maya-backups')
+BACKUP_CHUNK_DOCS = int(os.environ.get('BACKUP_CHUNK_DOCS', '1000'))
+RESTORE_CONCURRENCY = int(os.environ.get('RESTORE_CONCURRENCY', '8'))
+SUPABASE_IO_MAX_WORKERS = int(os.environ.get('SUPABASE_IO_MAX_WORKERS', '4'))
+SUPABASE_IO_TIMEOUT_SECONDS = float(os.environ.get('SUPABASE_IO_TIMEOUT_SECONDS', '30'))
 supabase_client = None
 
 if SUPABASE_URL and SUPABASE_KEY:
@@ -50,11 +83,51 @@ GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID', '')
 GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET', '')
 GOOGLE_REDIRECT_URI = os.environ.get('GOOGLE_REDIRECT_URI', '')
 GOOGLE_SCOPES = ['https://www.googleapis.com/auth/calendar']
+GOOGLE_IO_MAX_WORKERS = int(os.environ.get('GOOGLE_IO_MAX_WORKERS', '8'))
+GOOGLE_IO_TIMEOUT_SECONDS = float(os.environ.get('GOOGLE_IO_TIMEOUT_SECONDS', '20'))
+GOOGLE_SERVICE_CACHE_SIZE = int(os.environ.get('GOOGLE_SERVICE_CACHE_SIZE', '256'))
+GOOGLE_CREDENTIAL_TTL_SECONDS = int(os.environ.get('GOOGLE_CREDENTIAL_TTL_SECONDS', '3600'))
+GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS = int(os.environ.get('GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS', '300'))
+GOOGLE_IMPORT_PAGE_SIZE = int(os.environ.get('GOOGLE_IMPORT_PAGE_SIZE', '250'))
+GOOGLE_SYNC_DEBOUNCE_SECONDS = float(os.environ.get('GOOGLE_SYNC_DEBOUNCE_SECONDS', '3'))
+GOOGLE_SYNC_MAX_DELAY_SECONDS = float(os.environ.get('GOOGLE_SYNC_MAX_DELAY_SECONDS', '15'))
+# Public HTTPS address of /api/calendar/webhook; push notifications are disabled when empty
+GOOGLE_WEBHOOK_URL = os.environ.get('GOOGLE_WEBHOOK_URL', '')
+GOOGLE_CHANNEL_TTL_SECONDS = int(os.environ.get('GOOGLE_CHANNEL_TTL_SECONDS', str(7 * 24 * 3600)))
+GOOGLE_CHANNEL_RENEW_BEFORE_SECONDS = int(os.environ.get('GOOGLE_CHANNEL_RENEW_BEFORE_SECONDS', str(24 * 3600)))
+GOOGLE_BATCH_SIZE = 50  # Calendar API limit per batch request
+SYNC_JOB_CHUNK_SIZE = int(os.environ.get('SYNC_JOB_CHUNK_SIZE', '100'))
+SYNC_JOB_LEASE_SECONDS = int(os.environ.get('SYNC_JOB_LEASE_SECONDS', '300'))
+
+# Invoices
+OVERDUE_SWEEP_MINUTES = int(os.environ.get('OVERDUE_SWEEP_MINUTES', '15'))
+INVOICE_EVENT_MAX_ATTEMPTS = int(os.environ.get('INVOICE_EVENT_MAX_ATTEMPTS', '5'))
+INVOICE_EVENT_RETRY_SECONDS = int(os.environ.get('INVOICE_EVENT_RETRY_SECONDS', '60'))  # doubled after each failure
+INVOICE_PDF_WORKERS = int(os.environ.get('INVOICE_PDF_WORKERS', '2'))
+INVOICE_PDF_BATCH_SIZE = int(os.environ.get('INVOICE_PDF_BATCH_SIZE', '20'))  # PDFs rendered before each cache write
 
 # JWT Configuration
 SECRET_KEY = os.environ.get('JWT_SECRET', 'maya-groom-pro-secret-key-2024')
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 24
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get('REFRESH_TOKEN_EXPIRE_DAYS', '30'))
+
+# Login / password-reset throttling (sliding window per client IP and per email)
+AUTH_RATE_WINDOW_SECONDS = int(os.environ.get('AUTH_RATE_WINDOW_SECONDS', '300'))
+AUTH_RATE_LIMIT_PER_IP = int(os.environ.get('AUTH_RATE_LIMIT_PER_IP', '30'))
+AUTH_RATE_LIMIT_PER_EMAIL = int(os.environ.get('AUTH_RATE_LIMIT_PER_EMAIL', '10'))
+AUTH_RATE_LIMIT_SHARED = os.environ.get('AUTH_RATE_LIMIT_SHARED', 'false').lower() == 'true'  # Share counts across workers via Mongo
+# Only enable behind a reverse proxy; clients can put anything in X-Forwarded-For
+TRUST_FORWARDED_FOR = os.environ.get('TRUST_FORWARDED_FOR', 'false').lower() == 'true'
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '1'))  # Proxies in front of the app that append to X-Forwarded-For
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '4'))
+
+# Accounts allowed to read process-wide operational metrics (comma-separated emails)
+ADMIN_EMAILS = {e.strip().lower() for e in os.environ.get('ADMIN_EMAILS', '').split(',') if e.strip()}
+
+# Identifies this process when it holds a lease on a background job
+WORKER_ID = str(uuid.uuid4())
 
 app = FastAPI(title="Maya Groom Pro API")
 api_router = APIRouter(prefix="/api")
@@ -79,6 +152,11 @@ class UserLogin(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
+    refresh_token: Optional[str] = None
+    expires_in: int = ACCESS_TOKEN_EXPIRE_HOURS * 3600
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 # Default SMS Templates
 DEFAULT_SMS_TEMPLATES = {
@@ -116,6 +194,11 @@ DEFAULT_SMS_TEMPLATES = {
         "name": "24-Hour Reminder",
         "template": "Hi {client_name}! Just a reminder: {pet_names} appointment tomorrow at {time} at {business_name}. See you soon!",
         "enabled": True
+    },
+    "invoice_overdue": {
+        "name": "Invoice Overdue",
+        "template": "Hi {client_name}, invoice {invoice_number} from {business_name} for ${amount} was due on {due_date}. Please contact us at {business_phone} if you have any questions.",
+        "enabled": False
     }
 }
 
@@ -416,6 +499,7 @@ class InvoiceItem(BaseModel):
     quantity: int = 1
     unit_price: float
     total: float
+    service_id: Optional[str] = None  # Set for services billed from an appointment (used by reports)
 
 class InvoiceCreate(BaseModel):
     appointment_id: Optional[str] = None
@@ -446,6 +530,22 @@ class Invoice(BaseModel):
     paid_date: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class InvoiceStatusTotals(BaseModel):
+    count: int = 0
+    total: float = 0.0
+
+class InvoiceTotals(BaseModel):
+    count: int = 0
+    total: float = 0.0
+    gst: float = 0.0
+    outstanding: float = 0.0
+    by_status: Dict[str, InvoiceStatusTotals] = Field(default_factory=dict)
+
+class InvoicePage(BaseModel):
+    invoices: List[Invoice]
+    next_cursor: Optional[str] = None
+    totals: Optional[InvoiceTotals] = None  # First page only
+
 class InvoiceUpdate(BaseModel):
     items: Optional[List[InvoiceItem]] = None
     notes: Optional[str] = None
@@ -453,12 +553,25 @@ class InvoiceUpdate(BaseModel):
     due_date: Optional[datetime] = None
     paid_date: Optional[datetime] = None
 
+class BatchInvoiceRequest(BaseModel):
+    date: Optional[str] = None  # YYYY-MM-DD: completed appointments on this day
+    appointment_ids: Optional[List[str]] = None
+
+# Backup Models
+class RestoreRequest(BaseModel):
+    collections: Optional[List[str]] = None  # Defaults to every backed-up collection
+    prune: bool = False  # Also delete documents created since the backup (otherwise only reported)
+
 # ==================== AUTH HELPERS ====================
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the event loop
+# while bounding how many CPU-heavy hashes run at once
+password_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
 
-def verify_password(password: str, hashed: str) -> bool:
+def hash_password_sync(password: str) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
+
+def verify_password_sync(password: str, hashed: str) -> bool:
     try:
         # MongoDB stores hashes as strings, bcrypt expects bytes
         # Simply encode both the password and the stored hash
@@ -466,23 +579,260 @@ def verify_password(password: str, hashed: str) -> bool:
     except Exception:
         return False
 
+async def hash_password(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_hash_executor, hash_password_sync, password)
+
+async def verify_password(password: str, hashed: str) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_hash_executor, verify_password_sync, password, hashed)
+
+def password_needs_rehash(hashed: str) -> bool:
+    """True when a stored hash was made with a different cost factor than BCRYPT_ROUNDS"""
+    try:
+        return int(hashed.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+async def rehash_password(user_id: str, password: str, old_hash: str):
+    """Upgrade a stored hash to the current cost factor, unless the password changed meanwhile"""
+    try:
+        new_hash = await hash_password(password)
+        await db.users.update_one({"id": user_id, "password_hash": old_hash}, {"$set": {"password_hash": new_hash}})
+    except Exception as e:
+        logger.error(f"Password rehash failed for user {user_id}: {e}")
+
 def create_access_token(user_id: str) -> str:
     expire = datetime.now(timezone.utc) + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
     payload = {"sub": user_id, "exp": expire}
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
+def hash_refresh_token(token: str) -> str:
+    # Refresh tokens are long random strings, so a fast hash is enough (no bcrypt needed)
+    return hashlib.sha256(token.encode()).hexdigest()
+
+async def create_refresh_token(user_id: str, family_id: str = None) -> str:
+    """Store a new refresh token; rotations of one login share a family so reuse can revoke them all"""
+    token = secrets.token_urlsafe(48)
+    now = datetime.now(timezone.utc)
+    await db.refresh_tokens.insert_one({
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "family_id": family_id or str(uuid.uuid4()),
+        "token_hash": hash_refresh_token(token),
+        "used": False,
+        "created_at": now.isoformat(),
+        # A BSON date rather than an ISO string so the TTL index can expire it
+        "expires_at": now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    })
+    return token
+
+async def issue_tokens(user_id: str, family_id: str = None) -> Token:
+    return Token(
+        access_token=create_access_token(user_id),
+        refresh_token=await create_refresh_token(user_id, family_id)
+    )
+
+async def revoke_refresh_tokens(user_id: str):
+    await db.refresh_tokens.delete_many({"user_id": user_id})
+
+async def ensure_auth_indexes():
+    try:
+        await db.refresh_tokens.create_index("token_hash", unique=True)
+        await db.refresh_tokens.create_index("expires_at", expireAfterSeconds=0)
+        if AUTH_RATE_LIMIT_SHARED:
+            await db.auth_rate_buckets.create_index("key")
+            await db.auth_rate_buckets.create_index("expires_at", expireAfterSeconds=0)
+    except Exception as e:
+        logger.warning(f"Could not create auth indexes: {e}")
+
+class SlidingWindowLimiter:
+    """Counts attempts per key over a sliding window and rejects keys over their limit.
+
+    Checks are cheap (no bcrypt, at most a couple of indexed queries), so they
+    run before any password work. Counts live in process memory, or, when
+    shared across workers, in per-window buckets in the auth_rate_buckets
+    collection: each attempt is one atomic $inc on the current window's bucket,
+    and the sliding count weighs the previous bucket by how much of it still
+    overlaps the window.
+    """
+
+    def __init__(self, window_seconds: int, shared: bool = False):
+        self.window_seconds = window_seconds
+        self.shared = shared
+        self._attempts = {}  # key -> deque of monotonic timestamps
+        self._last_sweep = time.monotonic()
+        self.metrics = {"allowed": 0, "rejected": {}}
+
+    def _sweep(self, now: float):
+        # Drop idle keys now and then so memory stays bounded under spraying
+        if now - self._last_sweep < self.window_seconds:
+            return
+        self._last_sweep = now
+        cutoff = now - self.window_seconds
+        for key in [k for k, q in self._attempts.items() if not q or q[-1] <= cutoff]:
+            del self._attempts[key]
+
+    def _reject(self, key: str, retry_after: float):
+        scope = key.split(":", 1)[0]
+        self.metrics["rejected"][scope] = self.metrics["rejected"].get(scope, 0) + 1
+        raise HTTPException(
+            status_code=429,
+            detail="Too many attempts. Please try again later.",
+            headers={"Retry-After": str(max(1, int(retry_after) + 1))}
+        )
+
+    def _bucket_id(self, key: str, window: int) -> str:
+        return f"{key}|{window}"
+
+    async def _bump(self, key: str, window: int, amount: int) -> int:
+        """Atomically add to a key's bucket for one window and return its new count"""
+        expires_at = datetime.fromtimestamp((window + 2) * self.window_seconds, timezone.utc)
+        bucket = await db.auth_rate_buckets.find_one_and_update(
+            {"_id": self._bucket_id(key, window)},
+            {"$inc": {"count": amount}, "$setOnInsert": {"key": key, "expires_at": expires_at}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return bucket["count"]
+
+    async def _hit_shared(self, limits: dict):
+        now = datetime.now(timezone.utc).timestamp()
+        window = int(now // self.window_seconds)
+        # Share of the previous window that still falls inside the sliding one
+        overlap = 1 - (now - window * self.window_seconds) / self.window_seconds
+        previous = {
+            bucket["key"]: bucket["count"]
+            async for bucket in db.auth_rate_buckets.find(
+                {"_id": {"$in": [self._bucket_id(key, window - 1) for key in limits]}},
+                {"_id": 0, "key": 1, "count": 1}
+            )
+        }
+        counted = []
+        for key, limit in limits.items():
+            # Counting and checking in one $inc means concurrent attempts can't
+            # all slip in under the limit; a rejected attempt is taken back
+            count = await self._bump(key, window, 1)
+            counted.append(key)
+            if previous.get(key, 0) * overlap + count > limit:
+                for counted_key in counted:
+                    await self._bump(counted_key, window, -1)
+                self._reject(key, (window + 1) * self.window_seconds - now)
+
+    async def _hit_local(self, limits: dict):
+        now = time.monotonic()
+        for key, limit in limits.items():
+            attempts = self._attempts.get(key)
+            while attempts and attempts[0] <= now - self.window_seconds:
+                attempts.popleft()
+            if attempts and len(attempts) >= limit:
+                self._reject(key, attempts[0] + self.window_seconds - now)
+        self._sweep(now)
+        for key in limits:
+            self._attempts.setdefault(key, deque()).append(now)
+
+    async def hit(self, limits: dict):
+        """Record an attempt for each {key: limit}, or raise 429 if any key is over its limit"""
+        if self.shared:
+            await self._hit_shared(limits)
+        else:
+            await self._hit_local(limits)
+        self.metrics["allowed"] += 1
+
+    async def reset(self, key: str):
+        """Forget a key's attempts (e.g. after a successful login)"""
+        if self.shared:
+            await db.auth_rate_buckets.delete_many({"key": key})
+        else:
+            self._attempts.pop(key, None)
+
+    async def refund(self, key: str):
+        """Take back the latest attempt for a key, so successful attempts don't use up the budget"""
+        if self.shared:
+            window = int(datetime.now(timezone.utc).timestamp() // self.window_seconds)
+            # The attempt may have been counted just before the window rolled over
+            for bucket_window in (window, window - 1):
+                refunded = await db.auth_rate_buckets.update_one(
+                    {"_id": self._bucket_id(key, bucket_window), "count": {"$gt": 0}},
+                    {"$inc": {"count": -1}}
+                )
+                if refunded.modified_count:
+                    return
+        elif self._attempts.get(key):
+            self._attempts[key].pop()
+
+auth_limiter = SlidingWindowLimiter(AUTH_RATE_WINDOW_SECONDS, shared=AUTH_RATE_LIMIT_SHARED)
+
+def client_ip(request: Request) -> str:
+    """The caller's address as seen by the outermost trusted proxy.
+
+    Each proxy appends the address it received the request from, so only the
+    last TRUSTED_PROXY_HOPS entries are trustworthy; anything to their left
+    was supplied by the client.
+    """
+    if TRUST_FORWARDED_FOR and TRUSTED_PROXY_HOPS > 0:
+        hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        if len(hops) >= TRUSTED_PROXY_HOPS:
+            return hops[-TRUSTED_PROXY_HOPS]
+    return request.client.host if request.client else "unknown"
+
+async def throttle_auth_attempt(request: Request, email: str, action: str):
+    await auth_limiter.hit({
+        f"ip:{action}:{client_ip(request)}": AUTH_RATE_LIMIT_PER_IP,
+        f"email:{action}:{email.strip().lower()}": AUTH_RATE_LIMIT_PER_EMAIL
+    })
+
+class TenantContext:
+    """The authenticated user of one request.
+
+    Settings and the user document are loaded lazily and memoized, so a
+    request (and the background tasks it schedules) reads each at most once.
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self._settings = None
+        self._user = None
+
+    async def settings(self) -> dict:
+        """The user's settings document, or {} if none exists"""
+        if self._settings is None:
+            self._settings = await db.settings.find_one({"user_id": self.user_id}, {"_id": 0}) or {}
+        return self._settings
+
+    def set_settings(self, settings: dict):
+        """Replace the memoized settings after this request wrote them"""
+        self._settings = settings
+
+    async def user(self) -> dict:
+        """The user document without the password hash, or {} if the user no longer exists"""
+        if self._user is None:
+            self._user = await db.users.find_one({"id": self.user_id}, {"_id": 0, "password_hash": 0}) or {}
+        return self._user
+
+async def get_tenant(credentials: HTTPAuthorizationCredentials = Depends(security)) -> TenantContext:
+    """Decode the bearer token once per request (FastAPI caches dependencies within a request)"""
     try:
         payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
         user_id = payload.get("sub")
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid token")
-        return user_id
+        return TenantContext(user_id)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+async def get_current_user(tenant: TenantContext = Depends(get_tenant)) -> str:
+    return tenant.user_id
+
+async def require_admin(tenant: TenantContext = Depends(get_tenant)) -> str:
+    """Only operators listed in ADMIN_EMAILS; metrics aggregate every tenant's traffic"""
+    user = await tenant.user()
+    if not user or (user.get("email") or "").lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return tenant.user_id
+
 # ==================== HELPER FUNCTIONS ====================
 
 def serialize_datetime(obj):
@@ -502,6 +852,70 @@ def parse_datetime_fields(doc: dict, fields: List[str]) -> dict:
             doc[field] = datetime.fromisoformat(doc[field].replace('Z', '+00:00'))
     return doc
 
+# Collections included in per-user backups
+BACKUP_COLLECTIONS = ["clients", "pets", "services", "items", "appointments", "waitlist", "recurring_templates", "settings"]
+
+async def delete_with_tombstones(collection_name: str, query: dict) -> int:
+    """Delete matching documents, recording tombstones so incremental backups ship the deletion"""
+    if collection_name not in BACKUP_COLLECTIONS:
+        result = await db[collection_name].delete_many(query)
+        return result.deleted_count
+    
+    docs = await db[collection_name].find(query, {"_id": 0, "id": 1, "user_id": 1}).to_list(None)
+    if not docs:
+        return 0
+    result = await db[collection_name].delete_many({**query, "id": {"$in": [d["id"] for d in docs]}})
+    deleted_at = datetime.now(timezone.utc).isoformat()
+    await db.backup_tombstones.insert_many([
+        {"user_id": d["user_id"], "collection": collection_name, "doc_id": d["id"], "deleted_at": deleted_at}
+        for d in docs
+    ])
+    for user_id in set(d["user_id"] for d in docs):
+        backup_coordinator.mark_dirty(user_id, collection_name)
+    return result.deleted_count
+
+class LatencyMetrics:
+    """In-process call counters and latency totals, keyed by operation name"""
+    
+    def __init__(self):
+        self._ops = {}
+    
+    def record(self, op: str, elapsed_ms: float, error: bool = False, timeout: bool = False):
+        stats = self._ops.setdefault(op, {"count": 0, "errors": 0, "timeouts": 0, "total_ms": 0.0, "max_ms": 0.0})
+        stats["count"] += 1
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+        if error:
+            stats["errors"] += 1
+        if timeout:
+            stats["timeouts"] += 1
+    
+    def snapshot(self) -> dict:
+        return {
+            op: {**stats, "avg_ms": round(stats["total_ms"] / stats["count"], 2) if stats["count"] else 0.0}
+            for op, stats in self._ops.items()
+        }
+
+async def run_blocking(executor: ThreadPoolExecutor, timeout: float, metrics: LatencyMetrics, op: str, fn, *args, **kwargs):
+    """Run a blocking callable on a dedicated pool with a timeout, recording its latency"""
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    error = timed_out = False
+    try:
+        return await asyncio.wait_for(
+            loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs)),
+            timeout=timeout
+        )
+    except asyncio.TimeoutError:
+        error = timed_out = True
+        logger.error(f"Blocking call {op} timed out after {timeout}s")
+        raise
+    except Exception:
+        error = True
+        raise
+    finally:
+        metrics.record(op, (time.perf_counter() - start) * 1000, error=error, timeout=timed_out)
+
 # ==================== AUTH ROUTES ====================
 
 @api_router.post("/auth/register", response_model=Token)
@@ -515,7 +929,7 @@ async def register(user: UserCreate):
     user_doc = {
         "id": user_id,
         "email": user.email,
-        "password_hash": hash_password(user.password),
+        "password_hash": await hash_password(user.password),
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.users.insert_one(user_doc)
@@ -524,18 +938,55 @@ async def register(user: UserCreate):
     settings = Settings(user_id=user_id, business_name=user.business_name)
     settings_doc = prepare_doc_for_mongo(settings.model_dump())
     await db.settings.insert_one(settings_doc)
+    backup_coordinator.mark_dirty(user_id, "settings")
     
-    token = create_access_token(user_id)
-    return Token(access_token=token)
+    return await issue_tokens(user_id)
 
 @api_router.post("/auth/login", response_model=Token)
-async def login(user: UserLogin):
+async def login(user: UserLogin, background_tasks: BackgroundTasks, request: Request):
+    await throttle_auth_attempt(request, user.email, "login")
     db_user = await db.users.find_one({"email": user.email}, {"_id": 0})
-    if not db_user or not verify_password(user.password, db_user["password_hash"]):
+    if not db_user or not await verify_password(user.password, db_user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    token = create_access_token(db_user["id"])
-    return Token(access_token=token)
+    # Only failed logins count against the limits
+    await auth_limiter.reset(f"email:login:{user.email.strip().lower()}")
+    await auth_limiter.refund(f"ip:login:{client_ip(request)}")
+    if password_needs_rehash(db_user["password_hash"]):
+        background_tasks.add_task(rehash_password, db_user["id"], user.password, db_user["password_hash"])
+    
+    return await issue_tokens(db_user["id"])
+
+@api_router.post("/auth/refresh", response_model=Token)
+async def refresh_access_token(request: RefreshRequest):
+    """Exchange a refresh token for a new access token and a rotated refresh token"""
+    token_hash = hash_refresh_token(request.refresh_token)
+    now = datetime.now(timezone.utc)
+    stored = await db.refresh_tokens.find_one_and_update(
+        {"token_hash": token_hash, "used": False, "expires_at": {"$gt": now}},
+        {"$set": {"used": True, "used_at": now.isoformat()}},
+        projection={"_id": 0}
+    )
+    if not stored:
+        reused = await db.refresh_tokens.find_one({"token_hash": token_hash, "used": True}, {"_id": 0, "family_id": 1})
+        if reused:
+            # A rotated token was presented again: assume it leaked and end the whole session
+            await db.refresh_tokens.delete_many({"family_id": reused["family_id"]})
+            logger.warning(f"Refresh token reuse detected for family {reused['family_id']}")
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+    
+    if not await db.users.find_one({"id": stored["user_id"]}, {"_id": 0, "id": 1}):
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+    
+    return await issue_tokens(stored["user_id"], stored["family_id"])
+
+@api_router.post("/auth/logout")
+async def logout(request: RefreshRequest):
+    """Revoke the session a refresh token belongs to"""
+    stored = await db.refresh_tokens.find_one({"token_hash": hash_refresh_token(request.refresh_token)}, {"_id": 0, "family_id": 1})
+    if stored:
+        await db.refresh_tokens.delete_many({"family_id": stored["family_id"]})
+    return {"message": "Logged out"}
 
 class ForgotPasswordRequest(BaseModel):
     email: str
@@ -545,7 +996,8 @@ class ResetPasswordResponse(BaseModel):
     temporary_password: Optional[str] = None
 
 @api_router.post("/auth/forgot-password", response_model=ResetPasswordResponse)
-async def forgot_password(request: ForgotPasswordRequest):
+async def forgot_password(request: ForgotPasswordRequest, http_request: Request):
+    await throttle_auth_attempt(http_request, request.email, "forgot")
     # Check if user exists
     db_user = await db.users.find_one({"email": request.email}, {"_id": 0})
     
@@ -559,11 +1011,12 @@ async def forgot_password(request: ForgotPasswordRequest):
     temp_password = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(10))
     
     # Hash and update the password
-    new_hash = hash_password(temp_password)
+    new_hash = await hash_password(temp_password)
     await db.users.update_one(
         {"id": db_user["id"]},
         {"$set": {"password_hash": new_hash}}
     )
+    await revoke_refresh_tokens(db_user["id"])
     
     return ResetPasswordResponse(
         message="Your password has been reset. Please use the temporary password below to login, then change it in Settings.",
@@ -582,7 +1035,7 @@ async def change_password(request: ChangePasswordRequest, user_id: str = Depends
         raise HTTPException(status_code=404, detail="User not found")
     
     # Verify current password
-    if not verify_password(request.current_password, db_user["password_hash"]):
+    if not await verify_password(request.current_password, db_user["password_hash"]):
         raise HTTPException(status_code=400, detail="Current password is incorrect")
     
     # Validate new password
@@ -590,17 +1043,23 @@ async def change_password(request: ChangePasswordRequest, user_id: str = Depends
         raise HTTPException(status_code=400, detail="New password must be at least 6 characters")
     
     # Hash and update password
-    new_hash = hash_password(request.new_password)
+    new_hash = await hash_password(request.new_password)
     await db.users.update_one(
         {"id": user_id},
         {"$set": {"password_hash": new_hash}}
     )
+    await revoke_refresh_tokens(user_id)
     
     return {"message": "Password changed successfully"}
 
+@api_router.get("/auth/rate-limit-metrics")
+async def get_auth_rate_limit_metrics(user_id: str = Depends(require_admin)):
+    """Allowed and rejected login/password-reset attempts in this worker"""
+    return {"auth_rate_limit": auth_limiter.metrics}
+
 @api_router.get("/auth/me")
-async def get_me(user_id: str = Depends(get_current_user)):
-    user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
+async def get_me(tenant: TenantContext = Depends(get_tenant)):
+    user = await tenant.user()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
@@ -608,23 +1067,32 @@ async def get_me(user_id: str = Depends(get_current_user)):
 # ==================== SETTINGS ROUTES ====================
 
 @api_router.get("/settings", response_model=Settings)
-async def get_settings(user_id: str = Depends(get_current_user)):
-    settings = await db.settings.find_one({"user_id": user_id}, {"_id": 0})
+async def get_settings(tenant: TenantContext = Depends(get_tenant)):
+    user_id = tenant.user_id
+    settings = await tenant.settings()
     if not settings:
         # Create default settings if not exists
         new_settings = Settings(user_id=user_id)
         settings_doc = prepare_doc_for_mongo(new_settings.model_dump())
         await db.settings.insert_one(settings_doc)
+        backup_coordinator.mark_dirty(user_id, "settings")
         return new_settings
     return parse_datetime_fields(settings, ["created_at", "updated_at"])
 
 @api_router.put("/settings", response_model=Settings)
-async def update_settings(update: SettingsUpdate, user_id: str = Depends(get_current_user)):
+async def update_settings(update: SettingsUpdate, tenant: TenantContext = Depends(get_tenant)):
+    user_id = tenant.user_id
     update_data = {k: v for k, v in update.model_dump().items() if v is not None}
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
-    await db.settings.update_one({"user_id": user_id}, {"$set": update_data})
-    settings = await db.settings.find_one({"user_id": user_id}, {"_id": 0})
+    settings = await db.settings.find_one_and_update(
+        {"user_id": user_id}, {"$set": update_data},
+        projection={"_id": 0}, return_document=ReturnDocument.AFTER
+    )
+    tenant.set_settings(settings)
+    backup_coordinator.mark_dirty(user_id, "settings")
+    if any(field in update_data for field in INVOICE_PDF_SETTINGS_FIELDS):
+        await db.invoice_pdfs.delete_many({"user_id": user_id})
     return parse_datetime_fields(settings, ["created_at", "updated_at"])
 
 # ==================== CLIENT ROUTES ====================
@@ -635,7 +1103,7 @@ async def create_client(client: ClientCreate, background_tasks: BackgroundTasks,
     client_doc = prepare_doc_for_mongo(new_client.model_dump())
     await db.clients.insert_one(client_doc)
     # Trigger backup
-    background_tasks.add_task(backup_collection_to_supabase, "clients", user_id)
+    backup_coordinator.mark_dirty(user_id, "clients")
     return new_client
 
 @api_router.get("/clients", response_model=List[Client])
@@ -662,6 +1130,7 @@ async def update_client(client_id: str, update: ClientUpdate, user_id: str = Dep
     update_data = {k: v for k, v in update.model_dump().items() if v is not None}
     if not update_data:
         raise HTTPException(status_code=400, detail="No update data provided")
+    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
     result = await db.clients.update_one(
         {"id": client_id, "user_id": user_id},
@@ -669,17 +1138,18 @@ async def update_client(client_id: str, update: ClientUpdate, user_id: str = Dep
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Client not found")
+    backup_coordinator.mark_dirty(user_id, "clients")
     
     client = await db.clients.find_one({"id": client_id}, {"_id": 0})
     return parse_datetime_fields(client, ["created_at"])
 
 @api_router.delete("/clients/{client_id}")
 async def delete_client(client_id: str, user_id: str = Depends(get_current_user)):
-    result = await db.clients.delete_one({"id": client_id, "user_id": user_id})
-    if result.deleted_count == 0:
+    deleted = await delete_with_tombstones("clients", {"id": client_id, "user_id": user_id})
+    if deleted == 0:
         raise HTTPException(status_code=404, detail="Client not found")
     # Also delete associated pets
-    await db.pets.delete_many({"client_id": client_id, "user_id": user_id})
+    await delete_with_tombstones("pets", {"client_id": client_id, "user_id": user_id})
     return {"message": "Client deleted"}
 
 # ==================== PET ROUTES ====================
@@ -694,6 +1164,7 @@ async def create_pet(pet: PetCreate, user_id: str = Depends(get_current_user)):
     new_pet = Pet(user_id=user_id, **pet.model_dump())
     pet_doc = prepare_doc_for_mongo(new_pet.model_dump())
     await db.pets.insert_one(pet_doc)
+    backup_coordinator.mark_dirty(user_id, "pets")
     return new_pet
 
 @api_router.get("/pets", response_model=List[Pet])
@@ -716,18 +1187,20 @@ async def update_pet(pet_id: str, update: PetUpdate, user_id: str = Depends(get_
     update_data = {k: v for k, v in update.model_dump().items() if v is not None}
     if not update_data:
         raise HTTPException(status_code=400, detail="No update data provided")
+    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
     result = await db.pets.update_one({"id": pet_id, "user_id": user_id}, {"$set": update_data})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Pet not found")
+    backup_coordinator.mark_dirty(user_id, "pets")
     
     pet = await db.pets.find_one({"id": pet_id}, {"_id": 0})
     return parse_datetime_fields(pet, ["created_at"])
 
 @api_router.delete("/pets/{pet_id}")
 async def delete_pet(pet_id: str, user_id: str = Depends(get_current_user)):
-    result = await db.pets.delete_one({"id": pet_id, "user_id": user_id})
-    if result.deleted_count == 0:
+    deleted = await delete_with_tombstones("pets", {"id": pet_id, "user_id": user_id})
+    if deleted == 0:
         raise HTTPException(status_code=404, detail="Pet not found")
     return {"message": "Pet deleted"}
 
@@ -738,6 +1211,7 @@ async def create_service(service: ServiceCreate, user_id: str = Depends(get_curr
     new_service = Service(user_id=user_id, **service.model_dump())
     service_doc = prepare_doc_for_mongo(new_service.model_dump())
     await db.services.insert_one(service_doc)
+    backup_coordinator.mark_dirty(user_id, "services")
     return new_service
 
 @api_router.get("/services", response_model=List[Service])
@@ -757,18 +1231,20 @@ async def update_service(service_id: str, update: ServiceUpdate, user_id: str =
     update_data = {k: v for k, v in update.model_dump().items() if v is not None}
     if not update_data:
         raise HTTPException(status_code=400, detail="No update data provided")
+    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
     result = await db.services.update_one({"id": service_id, "user_id": user_id}, {"$set": update_data})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Service not found")
+    backup_coordinator.mark_dirty(user_id, "services")
     
     service = await db.services.find_one({"id": service_id}, {"_id": 0})
     return parse_datetime_fields(service, ["created_at"])
 
 @api_router.delete("/services/{service_id}")
 async def delete_service(service_id: str, user_id: str = Depends(get_current_user)):
-    result = await db.services.delete_one({"id": service_id, "user_id": user_id})
-    if result.deleted_count == 0:
+    deleted = await delete_with_tombstones("services", {"id": service_id, "user_id": user_id})
+    if deleted == 0:
         raise HTTPException(status_code=404, detail="Service not found")
     return {"message": "Service deleted"}
 
@@ -779,6 +1255,7 @@ async def create_item(item: ItemCreate, user_id: str = Depends(get_current_user)
     new_item = Item(user_id=user_id, **item.model_dump())
     item_doc = prepare_doc_for_mongo(new_item.model_dump())
     await db.items.insert_one(item_doc)
+    backup_coordinator.mark_dirty(user_id, "items")
     return new_item
 
 @api_router.get("/items", response_model=List[Item])
@@ -791,69 +1268,118 @@ async def update_item(item_id: str, update: ItemUpdate, user_id: str = Depends(g
     update_data = {k: v for k, v in update.model_dump().items() if v is not None}
     if not update_data:
         raise HTTPException(status_code=400, detail="No update data provided")
+    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
     result = await db.items.update_one({"id": item_id, "user_id": user_id}, {"$set": update_data})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Item not found")
+    backup_coordinator.mark_dirty(user_id, "items")
     
     item = await db.items.find_one({"id": item_id}, {"_id": 0})
     return parse_datetime_fields(item, ["created_at"])
 
 @api_router.delete("/items/{item_id}")
 async def delete_item(item_id: str, user_id: str = Depends(get_current_user)):
-    result = await db.items.delete_one({"id": item_id, "user_id": user_id})
-    if result.deleted_count == 0:
+    deleted = await delete_with_tombstones("items", {"id": item_id, "user_id": user_id})
+    if deleted == 0:
         raise HTTPException(status_code=404, detail="Item not found")
     return {"message": "Item deleted"}
 
 # ==================== APPOINTMENT ROUTES ====================
 
+async def push_series_to_google(user_id: str, service, series: list):
+    """Create one recurring Google event for a whole series and link every occurrence to its instance"""
+    first = series[0]
+    event = build_calendar_event(first)
+    event["recurrence"] = [build_recurrence_rule(first, len(series))]
+    event["extendedProperties"]["private"]["gromify_recurring_id"] = first.get("recurring_id", "")
+    result = await google_gateway.insert_event(service, event)
+    master_id = result.get("id")
+    
+    await db.appointments.bulk_write([
+        UpdateOne(
+            {"id": appt["id"]},
+            {"$set": {
+                "google_event_id": google_instance_id(master_id, appt["date_time"]),
+                "google_recurring_event_id": master_id,
+                "updated_at": datetime.now(timezone.utc).isoformat()
+            }}
+        )
+        for appt in series
+    ])
+    backup_coordinator.mark_dirty(user_id, "appointments")
+    logger.info(f"Synced series {first.get('recurring_id')} ({len(series)} occurrences) to Google Calendar as one recurring event")
+
+async def push_appointment_to_google(service, appointment: dict) -> str:
+    """Create or update the Google event for one appointment; returns the Google event ID"""
+    event = build_calendar_event(appointment)
+    google_event_id = appointment.get("google_event_id")
+    
+    if google_event_id:
+        # Update existing (for series occurrences this records an instance exception)
+        try:
+            await google_gateway.update_event(service, google_event_id, event)
+            return google_event_id
+        except HttpError as e:
+            if e.resp.status not in (404, 410):
+                raise
+            logger.info(f"Google event {google_event_id} is gone, recreating for appointment {appointment['id']}")
+    
+    # Create new
+    result = await google_gateway.insert_event(service, event)
+    await db.appointments.update_one(
+        {"id": appointment["id"]},
+        {"$set": {"google_event_id": result.get("id"), "updated_at": datetime.now(timezone.utc).isoformat()},
+         "$unset": {"google_recurring_event_id": ""}}
+    )
+    backup_coordinator.mark_dirty(appointment["user_id"], "appointments")
+    return result.get("id")
+
 async def auto_sync_appointments_to_google(user_id: str, appointment_ids: list):
-    """Background task to sync appointments to Google Calendar"""
+    """Background task to sync appointments to Google Calendar.
+
+    Unsynced recurring series are pushed as a single recurring event with an
+    RRULE; everything else is created or updated event by event, so edits to
+    a linked occurrence become per-instance exceptions in Google.
+    """
     try:
         credentials = await get_user_google_credentials(user_id)
         if not credentials:
             return  # User not connected to Google Calendar
         
-        service = build('calendar', 'v3', credentials=credentials)
+        service = await google_gateway.get_service(user_id, credentials)
         
-        for appt_id in appointment_ids:
-            try:
-                appointment = await db.appointments.find_one({"id": appt_id, "user_id": user_id}, {"_id": 0})
-                if not appointment:
+        appointments = await db.appointments.find(
+            {"id": {"$in": list(appointment_ids)}, "user_id": user_id}, {"_id": 0}
+        ).sort("date_time", 1).to_list(None)
+        
+        # Get client details
+        await attach_client_details(appointments)
+        
+        # Group unsynced occurrences of the same series
+        series_groups = {}
+        singles = []
+        for appointment in appointments:
+            if appointment.get("recurring_id") and appointment.get("recurring_unit") and not appointment.get("google_event_id"):
+                series_groups.setdefault(appointment["recurring_id"], []).append(appointment)
+            else:
+                singles.append(appointment)
+        
+        for recurring_id, series in series_groups.items():
+            if len(series) > 1 and is_complete_series(series):
+                try:
+                    await push_series_to_google(user_id, service, series)
                     continue
-                
-                # Get client details
-                client = await db.clients.find_one({"id": appointment.get("client_id")}, {"_id": 0})
-                if client:
-                    appointment["client_phone"] = client.get("phone", "")
-                    appointment["client_address"] = client.get("address", "")
-                
-                event = build_calendar_event(appointment)
-                google_event_id = appointment.get("google_event_id")
-                
-                if google_event_id:
-                    # Update existing
-                    service.events().update(
-                        calendarId='primary',
-                        eventId=google_event_id,
-                        body=event
-                    ).execute()
-                else:
-                    # Create new
-                    result = service.events().insert(
-                        calendarId='primary',
-                        body=event
-                    ).execute()
-                    
-                    await db.appointments.update_one(
-                        {"id": appt_id},
-                        {"$set": {"google_event_id": result.get("id")}}
-                    )
-                
-                logger.info(f"Synced appointment {appt_id} to Google Calendar")
+                except Exception as e:
+                    logger.error(f"Failed to sync series {recurring_id} as a recurring event, syncing occurrences: {e}")
+            singles.extend(series)
+        
+        for appointment in singles:
+            try:
+                await push_appointment_to_google(service, appointment)
+                logger.info(f"Synced appointment {appointment['id']} to Google Calendar")
             except Exception as e:
-                logger.error(f"Failed to sync appointment {appt_id}: {e}")
+                logger.error(f"Failed to sync appointment {appointment['id']}: {e}")
     except Exception as e:
         logger.error(f"Auto-sync error: {e}")
 
@@ -864,14 +1390,67 @@ async def delete_from_google(user_id: str, google_event_id: str):
         if not credentials or not google_event_id:
             return
         
-        service = build('calendar', 'v3', credentials=credentials)
-        service.events().delete(calendarId='primary', eventId=google_event_id).execute()
+        service = await google_gateway.get_service(user_id, credentials)
+        await google_gateway.delete_event(service, google_event_id)
         logger.info(f"Deleted Google Calendar event {google_event_id}")
     except Exception as e:
         logger.error(f"Failed to delete from Google Calendar: {e}")
 
+async def delete_series_from_google(user_id: str, series_appts: list):
+    """Background task to delete a whole series from Google Calendar with one credential/service fetch.
+
+    Series pushed as a recurring event are removed with a single delete of the
+    recurring event; any separately created events go out in batch requests.
+    """
+    try:
+        credentials = await get_user_google_credentials(user_id)
+        if not credentials:
+            return
+        
+        recurring_event_ids = {a["google_recurring_event_id"] for a in series_appts if a.get("google_recurring_event_id")}
+        standalone_ids = [
+            a["google_event_id"] for a in series_appts
+            if a.get("google_event_id") and not a.get("google_recurring_event_id")
+        ]
+        if not recurring_event_ids and not standalone_ids:
+            return
+        
+        service = await google_gateway.get_service(user_id, credentials)
+        for recurring_event_id in recurring_event_ids:
+            try:
+                await google_gateway.delete_event(service, recurring_event_id)
+            except HttpError as e:
+                if e.resp.status not in (404, 410):
+                    raise
+        
+        failed = await google_gateway.delete_events_batch(service, standalone_ids)
+        logger.info(
+            f"Deleted {len(recurring_event_ids)} recurring and {len(standalone_ids) - len(failed)} single "
+            f"Google Calendar events for series"
+        )
+        
+        if recurring_event_ids:
+            # Occurrences detached from the series still pointed at instances of the deleted
+            # recurring event; recreate them as standalone events
+            detached = await db.appointments.find(
+                {"user_id": user_id, "google_recurring_event_id": {"$in": list(recurring_event_ids)}},
+                {"_id": 0, "id": 1}
+            ).to_list(None)
+            if detached:
+                detached_ids = [a["id"] for a in detached]
+                await db.appointments.update_many(
+                    {"id": {"$in": detached_ids}},
+                    {"$unset": {"google_event_id": "", "google_recurring_event_id": ""},
+                     "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}}
+                )
+                backup_coordinator.mark_dirty(user_id, "appointments")
+                google_sync_queue.enqueue(user_id, detached_ids)
+    except Exception as e:
+        logger.error(f"Failed to delete series from Google Calendar: {e}")
+
 @api_router.post("/appointments", response_model=Appointment)
-async def create_appointment(appt: AppointmentCreate, background_tasks: BackgroundTasks, user_id: str = Depends(get_current_user)):
+async def create_appointment(appt: AppointmentCreate, background_tasks: BackgroundTasks, tenant: TenantContext = Depends(get_tenant)):
+    user_id = tenant.user_id
     # Get client name
     client = await db.clients.find_one({"id": appt.client_id, "user_id": user_id}, {"_id": 0})
     if not client:
@@ -913,8 +1492,6 @@ async def create_appointment(appt: AppointmentCreate, background_tasks: Backgrou
     recurring_id = str(uuid.uuid4()) if appt.is_recurring else None
     
     if appt.is_recurring and appt.recurring_value and appt.recurring_unit:
-        import pytz
-        
         # Get the original datetime
         original_dt = appt.date_time
         
@@ -1023,12 +1600,12 @@ async def create_appointment(appt: AppointmentCreate, background_tasks: Backgrou
         await db.appointments.insert_many(prepared_docs)
         
         # Trigger backup
-        background_tasks.add_task(backup_collection_to_supabase, "appointments", user_id)
+        backup_coordinator.mark_dirty(user_id, "appointments")
         # Send SMS notification if automated (only for first appointment)
-        background_tasks.add_task(send_appointment_sms, user_id, prepared_docs[0], "appointment_booked")
+        background_tasks.add_task(send_appointment_sms, tenant, prepared_docs[0], "appointment_booked")
         
         # Auto-sync to Google Calendar if connected
-        background_tasks.add_task(auto_sync_appointments_to_google, user_id, [doc["id"] for doc in prepared_docs])
+        google_sync_queue.enqueue(user_id, [doc["id"] for doc in prepared_docs])
         
         # Return the first appointment
         return parse_datetime_fields(prepared_docs[0], ["date_time", "end_time", "created_at"])
@@ -1071,7 +1648,8 @@ async def get_appointment(appointment_id: str, user_id: str = Depends(get_curren
     return parse_datetime_fields(appt, ["date_time", "end_time", "created_at"])
 
 @api_router.put("/appointments/{appointment_id}", response_model=Appointment)
-async def update_appointment(appointment_id: str, update: AppointmentUpdate, background_tasks: BackgroundTasks, user_id: str = Depends(get_current_user)):
+async def update_appointment(appointment_id: str, update: AppointmentUpdate, background_tasks: BackgroundTasks, tenant: TenantContext = Depends(get_tenant)):
+    user_id = tenant.user_id
     update_data = {}
     original_appt = await db.appointments.find_one({"id": appointment_id, "user_id": user_id}, {"_id": 0})
     
@@ -1098,9 +1676,10 @@ async def update_appointment(appointment_id: str, update: AppointmentUpdate, bac
                 {"id": original_appt["client_id"]},
                 {
                     "$inc": {"no_show_count": 1},
-                    "$set": {"last_no_show": datetime.now(timezone.utc).isoformat()}
+                    "$set": {"last_no_show": datetime.now(timezone.utc).isoformat(), "updated_at": datetime.now(timezone.utc).isoformat()}
                 }
             )
+            backup_coordinator.mark_dirty(user_id, "clients")
             sms_type = "no_show"
         elif update.status == "cancelled":
             sms_type = "appointment_cancelled"
@@ -1146,6 +1725,7 @@ async def update_appointment(appointment_id: str, update: AppointmentUpdate, bac
     
     if not update_data:
         raise HTTPException(status_code=400, detail="No update data provided")
+    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
     # Special case: Converting non-recurring to recurring OR updating recurring frequency
     if hasattr(update, 'is_recurring') and update.is_recurring:
@@ -1165,7 +1745,7 @@ async def update_appointment(appointment_id: str, update: AppointmentUpdate, bac
                 # If frequency changed, delete old future occurrences first
                 if frequency_changed and recurring_id:
                     current_date_str = datetime.now(timezone.utc).isoformat()
-                    await db.appointments.delete_many({
+                    await delete_with_tombstones("appointments", {
                         "user_id": user_id,
                         "recurring_id": recurring_id,
                         "date_time": {"$gt": original_appt["date_time"]},  # Delete future occurrences only
@@ -1232,8 +1812,6 @@ async def update_appointment(appointment_id: str, update: AppointmentUpdate, bac
     
     # Update single or series
     if update_series and update.date_time:
-        import pytz
-        
         # Update all appointments with the same recurring_id
         # We need to reschedule to the new LOCAL time for each appointment date
         recurring_id = original_appt.get("recurring_id")
@@ -1303,11 +1881,13 @@ async def update_appointment(appointment_id: str, update: AppointmentUpdate, bac
                 {"id": appt["id"], "user_id": user_id},
                 {"$set": {
                     "date_time": new_appt_utc.isoformat().replace('+00:00', 'Z'),
-                    "end_time": new_end_time.isoformat().replace('+00:00', 'Z')
+                    "end_time": new_end_time.isoformat().replace('+00:00', 'Z'),
+                    "updated_at": datetime.now(timezone.utc).isoformat()
                 }}
             )
         
         logger.info(f"Updated {len(future_appts)} appointments in series to local time {target_hour}:{target_minute}")
+        backup_coordinator.mark_dirty(user_id, "appointments")
         
         # Return the updated appointment
         appt = await db.appointments.find_one({"id": appointment_id}, {"_id": 0})
@@ -1368,6 +1948,7 @@ async def update_appointment(appointment_id: str, update: AppointmentUpdate, bac
     if result.matched_count == 0:
         logger.error(f"No appointments matched for update. ID: {appointment_id}, update_series: {update_series}")
         raise HTTPException(status_code=404, detail="Appointment not found")
+    backup_coordinator.mark_dirty(user_id, "appointments")
     
     appt = await db.appointments.find_one({"id": appointment_id}, {"_id": 0})
     if not appt:
@@ -1376,10 +1957,10 @@ async def update_appointment(appointment_id: str, update: AppointmentUpdate, bac
     
     # Send SMS if status changed to something notable
     if sms_type:
-        background_tasks.add_task(send_appointment_sms, user_id, appt, sms_type)
+        background_tasks.add_task(send_appointment_sms, tenant, appt, sms_type)
     
     # Auto-sync to Google Calendar
-    background_tasks.add_task(auto_sync_appointments_to_google, user_id, [appointment_id])
+    google_sync_queue.enqueue(user_id, [appointment_id])
     
     return parse_datetime_fields(appt, ["date_time", "end_time", "created_at"])
 
@@ -1397,29 +1978,27 @@ async def delete_appointment(appointment_id: str, delete_series: bool = False, b
         # Get all appointments in series to delete from Google Calendar
         series_appts = await db.appointments.find(
             {"user_id": user_id, "recurring_id": recurring_id},
-            {"_id": 0, "google_event_id": 1}
-        ).to_list(500)
+            {"_id": 0, "google_event_id": 1, "google_recurring_event_id": 1}
+        ).to_list(None)
         
         # Delete from Google Calendar
         if background_tasks:
-            for sa in series_appts:
-                if sa.get("google_event_id"):
-                    background_tasks.add_task(delete_from_google, user_id, sa["google_event_id"])
+            background_tasks.add_task(delete_series_from_google, user_id, series_appts)
         
         # Delete ALL appointments with the same recurring_id (entire series)
-        result = await db.appointments.delete_many({
+        deleted = await delete_with_tombstones("appointments", {
             "user_id": user_id,
             "recurring_id": recurring_id
         })
-        logger.info(f"Deleted {result.deleted_count} appointments with recurring_id {recurring_id}")
-        return {"message": f"Deleted {result.deleted_count} appointments in series"}
+        logger.info(f"Deleted {deleted} appointments with recurring_id {recurring_id}")
+        return {"message": f"Deleted {deleted} appointments in series"}
     else:
         # Delete from Google Calendar
         if background_tasks and appt.get("google_event_id"):
             background_tasks.add_task(delete_from_google, user_id, appt["google_event_id"])
         
-        result = await db.appointments.delete_one({"id": appointment_id, "user_id": user_id})
-        if result.deleted_count == 0:
+        deleted = await delete_with_tombstones("appointments", {"id": appointment_id, "user_id": user_id})
+        if deleted == 0:
             raise HTTPException(status_code=404, detail="Appointment not found")
         return {"message": "Appointment deleted"}
 
@@ -1444,6 +2023,7 @@ async def create_waitlist(entry: WaitlistCreate, user_id: str = Depends(get_curr
     )
     entry_doc = prepare_doc_for_mongo(new_entry.model_dump())
     await db.waitlist.insert_one(entry_doc)
+    backup_coordinator.mark_dirty(user_id, "waitlist")
     return new_entry
 
 @api_router.get("/waitlist", response_model=List[Waitlist])
@@ -1456,18 +2036,20 @@ async def update_waitlist(waitlist_id: str, update: WaitlistUpdate, user_id: str
     update_data = {k: v for k, v in update.model_dump().items() if v is not None}
     if not update_data:
         raise HTTPException(status_code=400, detail="No update data provided")
+    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
     result = await db.waitlist.update_one({"id": waitlist_id, "user_id": user_id}, {"$set": update_data})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Waitlist entry not found")
+    backup_coordinator.mark_dirty(user_id, "waitlist")
     
     entry = await db.waitlist.find_one({"id": waitlist_id}, {"_id": 0})
     return parse_datetime_fields(entry, ["date_added"])
 
 @api_router.delete("/waitlist/{waitlist_id}")
 async def delete_waitlist(waitlist_id: str, user_id: str = Depends(get_current_user)):
-    result = await db.waitlist.delete_one({"id": waitlist_id, "user_id": user_id})
-    if result.deleted_count == 0:
+    deleted = await delete_with_tombstones("waitlist", {"id": waitlist_id, "user_id": user_id})
+    if deleted == 0:
         raise HTTPException(status_code=404, detail="Waitlist entry not found")
     return {"message": "Waitlist entry deleted"}
 
@@ -1501,6 +2083,7 @@ async def create_recurring_template(template: RecurringTemplateCreate, user_id:
     )
     template_doc = prepare_doc_for_mongo(new_template.model_dump())
     await db.recurring_templates.insert_one(template_doc)
+    backup_coordinator.mark_dirty(user_id, "recurring_templates")
     return new_template
 
 @api_router.get("/recurring-templates", response_model=List[RecurringTemplate])
@@ -1512,16 +2095,17 @@ async def get_recurring_templates(user_id: str = Depends(get_current_user)):
 async def toggle_recurring_template(template_id: str, active: bool, user_id: str = Depends(get_current_user)):
     result = await db.recurring_templates.update_one(
         {"id": template_id, "user_id": user_id},
-        {"$set": {"active": active}}
+        {"$set": {"active": active, "updated_at": datetime.now(timezone.utc).isoformat()}}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Template not found")
+    backup_coordinator.mark_dirty(user_id, "recurring_templates")
     return {"message": "Template updated"}
 
 @api_router.delete("/recurring-templates/{template_id}")
 async def delete_recurring_template(template_id: str, user_id: str = Depends(get_current_user)):
-    result = await db.recurring_templates.delete_one({"id": template_id, "user_id": user_id})
-    if result.deleted_count == 0:
+    deleted = await delete_with_tombstones("recurring_templates", {"id": template_id, "user_id": user_id})
+    if deleted == 0:
         raise HTTPException(status_code=404, detail="Template not found")
     return {"message": "Template deleted"}
 
@@ -1562,41 +2146,146 @@ async def get_dashboard_stats(user_id: str = Depends(get_current_user)):
 
 # ==================== INVOICE ROUTES ====================
 
+def invoice_counter_id(user_id: str, period: str) -> str:
+    return f"invoice:{user_id}:{period}"
+
+async def seed_invoice_counter(user_id: str, period: str):
+    """Create a month's counter at the highest invoice number already issued for that month.
+
+    Runs before the first increment, so numbers are never reissued even while
+    the one-time counter backfill has not reached this user yet.
+    """
+    highest = 0
+    async for invoice in db.invoices.find(
+        {"user_id": user_id, "invoice_number": {"$regex": rf"^INV-{period}-\d+$"}},
+        {"_id": 0, "invoice_number": 1}
+    ):
+        highest = max(highest, int(invoice["invoice_number"].rsplit("-", 1)[1]))
+    try:
+        await db.counters.update_one(
+            {"id": invoice_counter_id(user_id, period)},
+            {"$max": {"seq": highest}, "$setOnInsert": {"user_id": user_id, "kind": "invoice", "period": period}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        pass  # Another request seeded it first
+
+async def allocate_invoice_numbers(user_id: str, count: int = 1) -> List[str]:
+    """Reserve `count` consecutive invoice numbers for this month with one atomic increment"""
+    period = datetime.now(timezone.utc).strftime('%Y%m')
+    counter_id = invoice_counter_id(user_id, period)
+    counter = None
+    for attempt in range(2):
+        counter = await db.counters.find_one_and_update(
+            {"id": counter_id},
+            {"$inc": {"seq": count}},
+            return_document=ReturnDocument.AFTER
+        )
+        if counter:
+            break
+        # First allocation of the month: seed from existing invoices, then increment
+        await seed_invoice_counter(user_id, period)
+    if not counter:
+        raise HTTPException(status_code=500, detail="Could not allocate an invoice number")
+    first = counter["seq"] - count + 1
+    return [f"INV-{period}-{str(n).zfill(4)}" for n in range(first, counter["seq"] + 1)]
+
+def invoice_doc_for_mongo(invoice: Invoice) -> dict:
+    """Invoice document as stored, with the normalized client name the list search matches on"""
+    doc = prepare_doc_for_mongo(invoice.model_dump())
+    doc["client_name_lower"] = invoice.client_name.lower()
+    return doc
+
 async def generate_invoice_number(user_id: str) -> str:
     """Generate unique invoice number"""
-    # Get the highest invoice number for this user this month
+    return (await allocate_invoice_numbers(user_id))[0]
+
+# A worker that died mid-migration gives up its claim after this long
+MIGRATION_CLAIM_SECONDS = 600
+
+async def claim_migration(name: str) -> bool:
+    """Atomically claim a one-time migration marker in counters.
+
+    False if the migration has completed or another worker is running it: the
+    upsert only matches an unfinished marker with no live claim, and otherwise
+    collides with the existing marker on the unique id index.
+    """
     now = datetime.now(timezone.utc)
-    month_prefix = f"INV-{now.strftime('%Y%m')}-"
-    
-    # Find the highest number for this month
-    latest = await db.invoices.find_one(
-        {"user_id": user_id, "invoice_number": {"$regex": f"^{month_prefix}"}},
-        {"invoice_number": 1, "_id": 0},
-        sort=[("invoice_number", -1)]
+    stale = (now - timedelta(seconds=MIGRATION_CLAIM_SECONDS)).isoformat()
+    try:
+        await db.counters.update_one(
+            {"id": name, "completed_at": None, "$or": [{"claimed_at": None}, {"claimed_at": {"$lt": stale}}]},
+            {"$set": {"claimed_by": WORKER_ID, "claimed_at": now.isoformat()}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def claim_lease(name: str, seconds: int) -> bool:
+    """Take or renew a named lease in counters for the next `seconds`.
+
+    False while another worker holds it; the holder can renew its own lease,
+    and anyone can take over one that has run out.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        await db.counters.update_one(
+            {"id": name, "$or": [{"lease_until": None}, {"lease_until": {"$lte": now.isoformat()}}, {"claimed_by": WORKER_ID}]},
+            {"$set": {"claimed_by": WORKER_ID, "lease_until": (now + timedelta(seconds=seconds)).isoformat()}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def complete_migration(name: str):
+    await db.counters.update_one(
+        {"id": name, "claimed_by": WORKER_ID},
+        {"$set": {"completed_at": datetime.now(timezone.utc).isoformat()}}
     )
-    
-    if latest:
-        # Extract the number part and increment
-        try:
-            last_num = int(latest["invoice_number"].split("-")[-1])
-            next_num = last_num + 1
-        except (ValueError, IndexError):
-            next_num = 1
-    else:
-        next_num = 1
-    
-    return f"{month_prefix}{str(next_num).zfill(4)}"
+
+async def backfill_invoice_counters():
+    """One-time seeding of invoice counters from the highest existing invoice numbers"""
+    if not await claim_migration("migration:invoice_counters"):
+        return
+    highest = {}  # (user_id, period) -> highest sequence number
+    async for invoice in db.invoices.find({"invoice_number": {"$regex": r"^INV-\d{6}-\d+$"}}, {"_id": 0, "user_id": 1, "invoice_number": 1}):
+        _, period, number = invoice["invoice_number"].split("-")
+        key = (invoice["user_id"], period)
+        highest[key] = max(highest.get(key, 0), int(number))
+    
+    if highest:
+        # $max keeps any numbers allocated while the backfill was running
+        await db.counters.bulk_write([
+            UpdateOne(
+                {"id": invoice_counter_id(user_id, period)},
+                {"$max": {"seq": seq}, "$setOnInsert": {"user_id": user_id, "kind": "invoice", "period": period}},
+                upsert=True
+            )
+            for (user_id, period), seq in highest.items()
+        ], ordered=False)
+    await complete_migration("migration:invoice_counters")
+    logger.info(f"Backfilled {len(highest)} invoice counters")
+
+async def ensure_invoice_counters():
+    try:
+        await db.counters.create_index("id", unique=True)
+        await backfill_invoice_counters()
+    except Exception as e:
+        logger.error(f"Invoice counter setup failed: {e}")
 
 @api_router.post("/invoices", response_model=Invoice)
-async def create_invoice(invoice_data: InvoiceCreate, user_id: str = Depends(get_current_user)):
+async def create_invoice(invoice_data: InvoiceCreate, tenant: TenantContext = Depends(get_tenant)):
     """Create a new invoice"""
+    user_id = tenant.user_id
     # Get client info
     client = await db.clients.find_one({"id": invoice_data.client_id, "user_id": user_id}, {"_id": 0})
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
     
     # Get user settings for GST
-    settings = await db.settings.find_one({"user_id": user_id}, {"_id": 0})
+    settings = await tenant.settings()
     gst_enabled = settings.get("gst_enabled", False) if settings else False
     gst_rate = settings.get("gst_rate", 10) if settings else 10
     
@@ -1630,14 +2319,19 @@ async def create_invoice(invoice_data: InvoiceCreate, user_id: str = Depends(get
         due_date=invoice_data.due_date.isoformat() if invoice_data.due_date else None
     )
     
-    invoice_doc = prepare_doc_for_mongo(new_invoice.model_dump())
-    await db.invoices.insert_one(invoice_doc)
+    invoice_doc = invoice_doc_for_mongo(new_invoice)
+    try:
+        await db.invoices.insert_one(invoice_doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Appointment already has an invoice")
+    await apply_invoice_rollups(None, invoice_doc)
     
     return new_invoice
 
 @api_router.post("/invoices/from-appointment/{appointment_id}", response_model=Invoice)
-async def create_invoice_from_appointment(appointment_id: str, user_id: str = Depends(get_current_user)):
+async def create_invoice_from_appointment(appointment_id: str, tenant: TenantContext = Depends(get_tenant)):
     """Create invoice from an appointment, or return existing one"""
+    user_id = tenant.user_id
     # Check if invoice already exists for this appointment
     existing_invoice = await db.invoices.find_one({"appointment_id": appointment_id, "user_id": user_id}, {"_id": 0})
     if existing_invoice:
@@ -1653,8 +2347,31 @@ async def create_invoice_from_appointment(appointment_id: str, user_id: str = De
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
     
-    # Get settings
-    settings = await db.settings.find_one({"user_id": user_id}, {"_id": 0})
+    services, catalog_items = await load_appointment_catalog([appointment])
+    invoice_number = await generate_invoice_number(user_id)
+    new_invoice = build_appointment_invoice(appointment, client, services, catalog_items, await tenant.settings(), invoice_number)
+    
+    invoice_doc = invoice_doc_for_mongo(new_invoice)
+    try:
+        await db.invoices.insert_one(invoice_doc)
+    except DuplicateKeyError:
+        # A concurrent request (e.g. a double click) invoiced the appointment first
+        return await db.invoices.find_one({"appointment_id": appointment_id, "user_id": user_id}, {"_id": 0})
+    await apply_invoice_rollups(None, invoice_doc)
+    
+    return new_invoice
+
+async def load_appointment_catalog(appointments: List[dict]) -> tuple:
+    """Services and items referenced by the appointments, each keyed by id (two queries in total)"""
+    service_ids = {sid for appt in appointments for pet in appt.get("pets", []) for sid in pet.get("services", [])}
+    item_ids = {iid for appt in appointments for pet in appt.get("pets", []) for iid in pet.get("items", [])}
+    services = await db.services.find({"id": {"$in": list(service_ids)}}, {"_id": 0}).to_list(None) if service_ids else []
+    items = await db.items.find({"id": {"$in": list(item_ids)}}, {"_id": 0}).to_list(None) if item_ids else []
+    return {s["id"]: s for s in services}, {i["id"]: i for i in items}
+
+def build_appointment_invoice(appointment: dict, client: dict, services: dict, catalog_items: dict,
+                              settings: dict, invoice_number: str) -> Invoice:
+    """Invoice for an appointment's services and items; prices include GST"""
     gst_enabled = settings.get("gst_enabled", False) if settings else False
     gst_rate = settings.get("gst_rate", 10) if settings else 10
     
@@ -1665,18 +2382,19 @@ async def create_invoice_from_appointment(appointment_id: str, user_id: str = De
         
         # Add services
         for service_id in pet.get("services", []):
-            service = await db.services.find_one({"id": service_id}, {"_id": 0})
+            service = services.get(service_id)
             if service:
                 items.append({
                     "name": f"{service['name']} - {pet_name}",
                     "quantity": 1,
                     "unit_price": service.get("price", 0),
-                    "total": service.get("price", 0)
+                    "total": service.get("price", 0),
+                    "service_id": service_id
                 })
         
         # Add items
         for item_id in pet.get("items", []):
-            item = await db.items.find_one({"id": item_id}, {"_id": 0})
+            item = catalog_items.get(item_id)
             if item:
                 items.append({
                     "name": item["name"],
@@ -1692,13 +2410,10 @@ async def create_invoice_from_appointment(appointment_id: str, user_id: str = De
     gst_amount = (total_amount * gst_rate / (100 + gst_rate)) if gst_enabled else 0
     subtotal = total_amount - gst_amount
     
-    # Generate invoice number
-    invoice_number = await generate_invoice_number(user_id)
-    
-    new_invoice = Invoice(
+    return Invoice(
         invoice_number=invoice_number,
-        user_id=user_id,
-        appointment_id=appointment_id,
+        user_id=appointment["user_id"],
+        appointment_id=appointment["id"],
         client_id=appointment["client_id"],
         client_name=client.get("name", ""),
         client_email=client.get("email", ""),
@@ -1709,11 +2424,91 @@ async def create_invoice_from_appointment(appointment_id: str, user_id: str = De
         gst_amount=gst_amount,
         total=total_amount
     )
+
+@api_router.post("/invoices/batch-from-appointments")
+async def create_invoices_from_appointments(request: BatchInvoiceRequest, tenant: TenantContext = Depends(get_tenant)):
+    """Invoice many appointments at once: completed appointments on a date, or a list of IDs"""
+    user_id = tenant.user_id
+    if bool(request.date) == bool(request.appointment_ids):
+        raise HTTPException(status_code=400, detail="Provide either a date or appointment_ids")
     
-    invoice_doc = prepare_doc_for_mongo(new_invoice.model_dump())
-    await db.invoices.insert_one(invoice_doc)
+    query = {"user_id": user_id}
+    if request.date:
+        try:
+            day = datetime.strptime(request.date, "%Y-%m-%d")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Date must be YYYY-MM-DD")
+        # The day is a business day in the salon's timezone
+        local_tz = pytz.timezone(APPOINTMENT_TIMEZONE)
+        day_start = local_tz.localize(day).astimezone(timezone.utc)
+        day_end = local_tz.localize(day + timedelta(days=1)).astimezone(timezone.utc)
+        query["date_time"] = {"$gte": day_start.isoformat(), "$lt": day_end.isoformat()}
+        query["status"] = "completed"
+    else:
+        query["id"] = {"$in": request.appointment_ids}
+    
+    appointments = await db.appointments.find(query, {"_id": 0}).sort("date_time", 1).to_list(None)
+    found_ids = {appt["id"] for appt in appointments}
+    skipped = [
+        {"appointment_id": appt_id, "reason": "Appointment not found"}
+        for appt_id in (request.appointment_ids or []) if appt_id not in found_ids
+    ]
+    
+    # Prefetch existing invoices, clients, services/items and settings in bulk
+    invoiced = await db.invoices.find(
+        {"user_id": user_id, "appointment_id": {"$in": list(found_ids)}}, {"_id": 0, "appointment_id": 1}
+    ).to_list(None)
+    invoiced_ids = {inv["appointment_id"] for inv in invoiced}
+    pending = [appt for appt in appointments if appt["id"] not in invoiced_ids]
+    clients = await db.clients.find(
+        {"user_id": user_id, "id": {"$in": list({appt["client_id"] for appt in pending})}}, {"_id": 0}
+    ).to_list(None)
+    clients_by_id = {c["id"]: c for c in clients}
+    for appt in pending:
+        if appt["client_id"] not in clients_by_id:
+            skipped.append({"appointment_id": appt["id"], "reason": "Client not found"})
+    pending = [appt for appt in pending if appt["client_id"] in clients_by_id]
+    
+    invoices = []
+    if pending:
+        services, catalog_items = await load_appointment_catalog(pending)
+        settings = await tenant.settings()
+        numbers = await allocate_invoice_numbers(user_id, len(pending))
+        invoices = [
+            build_appointment_invoice(appt, clients_by_id[appt["client_id"]], services, catalog_items, settings, number)
+            for appt, number in zip(pending, numbers)
+        ]
+        invoice_docs = [invoice_doc_for_mongo(inv) for inv in invoices]
+        duplicates = set()
+        try:
+            await db.invoices.insert_many(invoice_docs, ordered=False)
+        except BulkWriteError as e:
+            # A concurrent request invoiced some of these appointments first (unique appointment index)
+            errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != 11000 for err in errors):
+                raise
+            duplicates = {err["index"] for err in errors}
+            invoiced_ids |= {invoice_docs[index]["appointment_id"] for index in duplicates}
+        invoices = [inv for index, inv in enumerate(invoices) if index not in duplicates]
+        await apply_invoice_rollups_many([(None, doc) for index, doc in enumerate(invoice_docs) if index not in duplicates])
     
-    return new_invoice
+    return {
+        "created": invoices,
+        "already_invoiced": sorted(invoiced_ids),
+        "skipped": skipped
+    }
+
+async def ensure_invoice_appointment_index():
+    """At most one invoice per appointment, so concurrent invoicing cannot create duplicates"""
+    try:
+        await db.invoices.create_index(
+            [("user_id", 1), ("appointment_id", 1)],
+            unique=True,
+            partialFilterExpression={"appointment_id": {"$type": "string"}}
+        )
+    except Exception as e:
+        # Fails while duplicate invoices for one appointment already exist
+        logger.error(f"Invoice appointment index setup failed: {e}")
 
 @api_router.get("/invoices/check/{appointment_id}")
 async def check_invoice_exists(appointment_id: str, user_id: str = Depends(get_current_user)):
@@ -1726,6 +2521,82 @@ async def check_invoice_exists(appointment_id: str, user_id: str = Depends(get_c
         return {"has_invoice": True, "invoice_id": existing_invoice["id"], "invoice_number": existing_invoice["invoice_number"]}
     return {"has_invoice": False, "invoice_id": None, "invoice_number": None}
 
+# Settings field behind each business detail shown on an invoice
+INVOICE_BUSINESS_FIELDS = {
+    "name": "business_name",
+    "abn": "abn",
+    "phone": "phone",
+    "email": "email",
+    "address": "address",
+    "pay_id": "pay_id",
+    "bank_name": "bank_name",
+    "bsb": "bsb",
+    "account_number": "account_number",
+    "account_name": "account_name",
+}
+
+def invoice_business_details(settings: Optional[dict]) -> dict:
+    settings = settings or {}
+    details = {key: settings.get(field, "") for key, field in INVOICE_BUSINESS_FIELDS.items()}
+    details["gst_enabled"] = settings.get("gst_enabled", False)
+    return details
+
+# Newest first; id breaks ties between invoices created in the same instant
+INVOICE_LIST_SORT = [("created_at", -1), ("id", -1)]
+
+async def ensure_invoice_list_indexes():
+    """Compound indexes for the invoice list: equality fields, then the sort keys, then total for range filters"""
+    try:
+        await db.invoices.create_index([("user_id", 1), ("created_at", -1), ("id", -1), ("total", 1)])
+        await db.invoices.create_index([("user_id", 1), ("status", 1), ("created_at", -1), ("id", -1)])
+        await db.invoices.create_index([("user_id", 1), ("client_id", 1), ("created_at", -1), ("id", -1)])
+        # Each branch of the search $or is an anchored prefix, so both are index range scans
+        await db.invoices.create_index([("user_id", 1), ("invoice_number", 1)])
+        await db.invoices.create_index([("user_id", 1), ("client_name_lower", 1)])
+        await backfill_invoice_client_names()
+    except Exception as e:
+        logger.error(f"Invoice list index setup failed: {e}")
+
+async def backfill_invoice_client_names():
+    """One-time fill of client_name_lower on invoices created before the field existed"""
+    if not await claim_migration("migration:invoice_client_name_lower"):
+        return
+    updated = 0
+    batch = []
+    async for invoice in db.invoices.find({"client_name_lower": None}, {"_id": 0, "id": 1, "client_name": 1}):
+        batch.append(UpdateOne({"id": invoice["id"]}, {"$set": {"client_name_lower": (invoice.get("client_name") or "").lower()}}))
+        if len(batch) >= 1000:
+            await db.invoices.bulk_write(batch, ordered=False)
+            updated += len(batch)
+            batch = []
+    if batch:
+        await db.invoices.bulk_write(batch, ordered=False)
+        updated += len(batch)
+    await complete_migration("migration:invoice_client_name_lower")
+    logger.info(f"Backfilled client_name_lower on {updated} invoices")
+
+def encode_invoice_cursor(invoice: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps([invoice["created_at"], invoice["id"]]).encode()).decode()
+
+def decode_invoice_cursor(cursor: str) -> dict:
+    """Keyset condition for the invoices that sort after the cursor"""
+    try:
+        created_at, invoice_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": invoice_id}}
+    ]}
+
+def business_day_start(date_str: str, days: int = 0) -> str:
+    """UTC ISO timestamp for the start of a YYYY-MM-DD day (plus days) in the business timezone"""
+    try:
+        day = datetime.strptime(date_str, "%Y-%m-%d") + timedelta(days=days)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+    return pytz.timezone(APPOINTMENT_TIMEZONE).localize(day).astimezone(timezone.utc).isoformat()
+
 @api_router.get("/invoices", response_model=List[Invoice])
 async def get_invoices(
     client_id: str = "",
@@ -1733,16 +2604,106 @@ async def get_invoices(
     limit: int = 100,
     user_id: str = Depends(get_current_user)
 ):
-    """Get all invoices"""
+    """Get all invoices (see /invoices/page for filters, totals and paging)"""
     query = {"user_id": user_id}
     if client_id:
         query["client_id"] = client_id
     if status:
         query["status"] = status
     
-    invoices = await db.invoices.find(query, {"_id": 0}).sort("created_at", -1).limit(limit).to_list(limit)
+    invoices = await db.invoices.find(query, {"_id": 0}).sort(INVOICE_LIST_SORT).limit(limit).to_list(limit)
     return [parse_datetime_fields(inv, ["created_at"]) for inv in invoices]
 
+@api_router.get("/invoices/page", response_model=InvoicePage)
+async def get_invoice_page(
+    client_id: str = "",
+    status: str = "",
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    min_total: Optional[float] = None,
+    max_total: Optional[float] = None,
+    search: str = "",
+    cursor: str = "",
+    limit: int = Query(100, ge=1, le=500),
+    user_id: str = Depends(get_current_user)
+):
+    """List invoices newest first, one keyset page at a time.
+
+    Pass back next_cursor to fetch the following page. Totals for the whole
+    filtered set are computed with a single $facet aggregation and are only
+    returned with the first page (they do not change between pages).
+    """
+    query = {"user_id": user_id}
+    if client_id:
+        query["client_id"] = client_id
+    if status:
+        query["status"] = status
+    if start_date or end_date:
+        query["created_at"] = {}
+        if start_date:
+            query["created_at"]["$gte"] = business_day_start(start_date)
+        if end_date:
+            # end_date is inclusive: everything before the start of the next day
+            query["created_at"]["$lt"] = business_day_start(end_date, days=1)
+    if min_total is not None or max_total is not None:
+        query["total"] = {}
+        if min_total is not None:
+            query["total"]["$gte"] = min_total
+        if max_total is not None:
+            query["total"]["$lte"] = max_total
+    conditions = []
+    if search.strip():
+        term = search.strip()
+        # Anchored prefixes, so each branch can use an index: the invoice number,
+        # or the start of the client's name (matched case-insensitively through
+        # the stored lowercase copy). Names are not matched mid-word.
+        matches = [
+            {"invoice_number": {"$regex": f"^{re.escape(term.upper())}"}},
+            {"client_name_lower": {"$regex": f"^{re.escape(term.lower())}"}}
+        ]
+        if term.isdigit():
+            # "12" or "0012" finds INV-YYYYMM-0012; scans only this user's invoice_number index keys
+            matches.append({"invoice_number": {"$regex": f"-0*{int(term)}$"}})
+        conditions.append({"$or": matches})
+    filtered = {**query, "$and": conditions} if conditions else query
+    
+    page_query = {**query, "$and": conditions + [decode_invoice_cursor(cursor)]} if cursor else filtered
+    page_task = db.invoices.find(page_query, {"_id": 0}).sort(INVOICE_LIST_SORT).limit(limit + 1).to_list(limit + 1)
+    totals = None
+    if cursor:
+        invoices = await page_task
+    else:
+        totals_task = db.invoices.aggregate([
+            {"$match": filtered},
+            {"$facet": {
+                "totals": [{"$group": {
+                    "_id": None,
+                    "count": {"$sum": 1},
+                    "total": {"$sum": "$total"},
+                    "gst": {"$sum": "$gst_amount"},
+                    "outstanding": {"$sum": {"$cond": [{"$in": ["$status", ["sent", "overdue"]]}, "$total", 0]}}
+                }}],
+                "by_status": [{"$group": {"_id": "$status", "count": {"$sum": 1}, "total": {"$sum": "$total"}}}]
+            }}
+        ]).to_list(1)
+        invoices, facets = await asyncio.gather(page_task, totals_task)
+        summary = facets[0]["totals"][0] if facets and facets[0]["totals"] else {}
+        totals = {
+            "count": summary.get("count", 0),
+            **{key: round(summary.get(key, 0), 2) for key in ("total", "gst", "outstanding")},
+            "by_status": {
+                row["_id"]: {"count": row["count"], "total": round(row["total"], 2)}
+                for row in (facets[0]["by_status"] if facets else [])
+            }
+        }
+    
+    next_cursor = encode_invoice_cursor(invoices[limit - 1]) if len(invoices) > limit else None
+    return {
+        "invoices": [parse_datetime_fields(inv, ["created_at"]) for inv in invoices[:limit]],
+        "next_cursor": next_cursor,
+        "totals": totals
+    }
+
 @api_router.get("/invoices/{invoice_id}", response_model=Invoice)
 async def get_invoice(invoice_id: str, user_id: str = Depends(get_current_user)):
     """Get a single invoice"""
@@ -1752,40 +2713,30 @@ async def get_invoice(invoice_id: str, user_id: str = Depends(get_current_user))
     return parse_datetime_fields(invoice, ["created_at"])
 
 @api_router.get("/invoices/by-number/{invoice_number}")
-async def get_invoice_by_number(invoice_number: str, user_id: str = Depends(get_current_user)):
+async def get_invoice_by_number(invoice_number: str, tenant: TenantContext = Depends(get_tenant)):
     """Get invoice by invoice number"""
+    user_id = tenant.user_id
     invoice = await db.invoices.find_one({"invoice_number": invoice_number, "user_id": user_id}, {"_id": 0})
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
     # Get business settings for invoice display
-    settings = await db.settings.find_one({"user_id": user_id}, {"_id": 0})
+    settings = await tenant.settings()
     
     return {
         "invoice": parse_datetime_fields(invoice, ["created_at"]),
-        "business": {
-            "name": settings.get("business_name", "") if settings else "",
-            "abn": settings.get("abn", "") if settings else "",
-            "phone": settings.get("phone", "") if settings else "",
-            "email": settings.get("email", "") if settings else "",
-            "address": settings.get("address", "") if settings else "",
-            "pay_id": settings.get("pay_id", "") if settings else "",
-            "bank_name": settings.get("bank_name", "") if settings else "",
-            "bsb": settings.get("bsb", "") if settings else "",
-            "account_number": settings.get("account_number", "") if settings else "",
-            "account_name": settings.get("account_name", "") if settings else "",
-            "gst_enabled": settings.get("gst_enabled", False) if settings else False
-        }
+        "business": invoice_business_details(settings)
     }
 
 @api_router.put("/invoices/{invoice_id}", response_model=Invoice)
-async def update_invoice(invoice_id: str, update: InvoiceUpdate, user_id: str = Depends(get_current_user)):
+async def update_invoice(invoice_id: str, update: InvoiceUpdate, tenant: TenantContext = Depends(get_tenant)):
     """Update an invoice"""
+    user_id = tenant.user_id
     update_data = {}
     
     if update.items is not None:
         # Recalculate totals - prices INCLUDE GST
-        settings = await db.settings.find_one({"user_id": user_id}, {"_id": 0})
+        settings = await tenant.settings()
         gst_enabled = settings.get("gst_enabled", False) if settings else False
         gst_rate = settings.get("gst_rate", 10) if settings else 10
         
@@ -1812,96 +2763,709 @@ async def update_invoice(invoice_id: str, update: InvoiceUpdate, user_id: str =
     
     if not update_data:
         raise HTTPException(status_code=400, detail="No update data provided")
+    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
-    result = await db.invoices.update_one(
+    # The previous version is needed to move its amounts out of the report rollups
+    previous = await db.invoices.find_one_and_update(
         {"id": invoice_id, "user_id": user_id},
-        {"$set": update_data}
+        {"$set": update_data, "$unset": {"overdue_pending": ""}},
+        projection={"_id": 0}
     )
     
-    if result.matched_count == 0:
+    if not previous:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
-    invoice = await db.invoices.find_one({"id": invoice_id}, {"_id": 0})
+    invoice = {**previous, **update_data}
+    invoice.pop("overdue_pending", None)
+    counted = await claim_overdue_transition(previous, notify=invoice.get("status") == "overdue")
+    await apply_invoice_rollups(counted, invoice)
+    await db.invoice_pdfs.delete_one({"user_id": user_id, "invoice_id": invoice_id})
     return parse_datetime_fields(invoice, ["created_at"])
 
 @api_router.delete("/invoices/{invoice_id}")
 async def delete_invoice(invoice_id: str, user_id: str = Depends(get_current_user)):
     """Delete an invoice"""
-    result = await db.invoices.delete_one({"id": invoice_id, "user_id": user_id})
-    if result.deleted_count == 0:
+    invoice = await db.invoices.find_one_and_delete({"id": invoice_id, "user_id": user_id}, projection={"_id": 0})
+    if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
+    await apply_invoice_rollups(await claim_overdue_transition(invoice, notify=False), None)
+    await db.invoice_pdfs.delete_one({"user_id": user_id, "invoice_id": invoice_id})
     return {"message": "Invoice deleted"}
 
-# ==================== SMS FUNCTIONS ====================
+# ==================== REVENUE REPORTS ====================
 
-async def get_user_settings(user_id: str) -> dict:
-    """Get user settings from database"""
-    settings = await db.settings.find_one({"user_id": user_id}, {"_id": 0})
-    if not settings:
-        return {}
-    return settings
+# invoice_rollups holds one document per (user, dimension, key) with running totals,
+# kept current by $inc on every invoice write and rebuildable from invoices with
+# rebuild_invoice_rollups(). Amounts of cancelled invoices are not counted.
+ROLLUP_DIMENSIONS = ["day", "week", "month", "client", "service", "tenant"]
+ROLLUP_METRICS = ["count", "revenue", "paid", "gst", "discount", "outstanding", "overdue"]
+OUTSTANDING_STATUSES = ["sent", "overdue"]
 
-def format_sms_template(template: str, variables: dict) -> str:
-    """Replace template variables with actual values"""
-    message = template
-    for key, value in variables.items():
-        message = message.replace(f"{{{key}}}", str(value))
-    return message
+def invoice_local_datetime(invoice: dict) -> datetime:
+    return to_utc_datetime(invoice["created_at"]).astimezone(pytz.timezone(APPOINTMENT_TIMEZONE))
 
-async def send_twilio_sms(to_phone: str, message: str, settings: dict) -> tuple:
-    """Send SMS via Twilio"""
-    try:
-        from twilio.rest import Client as TwilioClient
-        
-        account_sid = settings.get("twilio_account_sid")
-        auth_token = settings.get("twilio_auth_token")
-        from_phone = settings.get("twilio_phone_number")
-        
-        if not all([account_sid, auth_token, from_phone]):
-            return False, "Twilio credentials not configured"
-        
-        client = TwilioClient(account_sid, auth_token)
-        
-        # Ensure Australian format
-        if not to_phone.startswith("+"):
-            to_phone = "+61" + to_phone.lstrip("0")
-        
-        message_obj = client.messages.create(
-            body=message,
-            from_=from_phone,
-            to=to_phone
-        )
-        
-        return True, message_obj.sid
-    except Exception as e:
-        logger.error(f"Twilio SMS error: {e}")
-        return False, str(e)
+def rollup_period_keys(local: datetime) -> dict:
+    iso_year, iso_week, _ = local.isocalendar()
+    return {"day": local.strftime("%Y-%m-%d"), "week": f"{iso_year}-W{iso_week:02d}", "month": local.strftime("%Y-%m")}
 
-async def create_sms_log(user_id: str, client_id: str, client_name: str, phone: str, 
-                         message_type: str, message_text: str, appointment_id: str = None,
-                         status: str = "pending", error_message: str = None) -> str:
-    """Create SMS message log entry"""
-    sms_log = {
-        "id": str(uuid.uuid4()),
-        "user_id": user_id,
-        "client_id": client_id,
-        "client_name": client_name,
-        "phone": phone,
-        "message_type": message_type,
-        "message_text": message_text,
-        "status": status,
-        "appointment_id": appointment_id,
-        "error_message": error_message,
-        "sent_at": datetime.now(timezone.utc).isoformat() if status == "sent" else None,
-        "created_at": datetime.now(timezone.utc).isoformat()
+def invoice_rollup_metrics(invoice: dict, weight: float = 1.0) -> dict:
+    live = invoice.get("status") != "cancelled"
+    total = (invoice.get("total") or 0) * weight
+    return {
+        "count": 1 if live else 0,
+        "revenue": total if live else 0,
+        "paid": total if invoice.get("status") == "paid" else 0,
+        "gst": (invoice.get("gst_amount") or 0) * weight if live else 0,
+        "discount": (invoice.get("discount") or 0) * weight if live else 0,
+        "outstanding": total if invoice.get("status") in OUTSTANDING_STATUSES else 0,
+        "overdue": total if invoice.get("status") == "overdue" else 0
     }
-    await db.sms_messages.insert_one(sms_log)
-    return sms_log["id"]
 
-async def send_appointment_sms(user_id: str, appointment: dict, message_type: str):
+def service_rollup_key(item: dict) -> tuple:
+    """(key, label) for a line item: the service id when known, else the item name"""
+    if item.get("service_id"):
+        return item["service_id"], item["name"].split(" - ")[0]
+    return f"name:{item['name']}", item["name"]
+
+def invoice_rollup_contributions(invoice: dict) -> List[tuple]:
+    """(dimension, key, label, metrics) rows an invoice adds to the rollups"""
+    rows = [
+        (dimension, key, key, invoice_rollup_metrics(invoice))
+        for dimension, key in rollup_period_keys(invoice_local_datetime(invoice)).items()
+    ]
+    rows.append(("client", invoice["client_id"], invoice.get("client_name", ""), invoice_rollup_metrics(invoice)))
+    # Single per-tenant row: the running outstanding/overdue balance
+    rows.append(("tenant", "all", "All invoices", invoice_rollup_metrics(invoice)))
+    # Line items share the invoice's totals (net of discount) in proportion to their amounts;
+    # a service counts each invoice it appears on once, however many lines it has
+    items = invoice.get("items") or []
+    items_total = sum(item.get("total") or 0 for item in items)
+    services = {}  # key -> [label, weight]
+    for item in items:
+        key, label = service_rollup_key(item)
+        entry = services.setdefault(key, [label, 0])
+        entry[0] = label
+        entry[1] += (item.get("total") or 0) / items_total if items_total else 0
+    for key, (label, weight) in services.items():
+        rows.append(("service", key, label, invoice_rollup_metrics(invoice, weight)))
+    return rows
+
+async def apply_invoice_rollups_many(changes: List[tuple]):
+    """Apply (previous, current) invoice versions to the rollups; either side may be None"""
+    deltas = {}
+    for previous, current in changes:
+        for invoice, sign in ((previous, -1), (current, 1)):
+            if not invoice:
+                continue
+            for dimension, key, label, metrics in invoice_rollup_contributions(invoice):
+                entry = deltas.setdefault((invoice["user_id"], dimension, key), {"label": label, "inc": dict.fromkeys(ROLLUP_METRICS, 0)})
+                if sign > 0:
+                    entry["label"] = label
+                for metric, value in metrics.items():
+                    entry["inc"][metric] += sign * value
+    
+    now = datetime.now(timezone.utc).isoformat()
+    operations = [
+        UpdateOne(
+            {"id": f"{user_id}:{dimension}:{key}"},
+            {
+                "$inc": entry["inc"],
+                "$set": {"label": entry["label"], "updated_at": now},
+                "$setOnInsert": {"user_id": user_id, "dimension": dimension, "key": key}
+            },
+            upsert=True
+        )
+        for (user_id, dimension, key), entry in deltas.items()
+        if any(entry["inc"].values())
+    ]
+    if not operations:
+        return
+    try:
+        await db.invoice_rollups.bulk_write(operations, ordered=False)
+    except Exception as e:
+        # The invoice write already succeeded; a rebuild repairs the rollups
+        logger.error(f"Failed to update invoice rollups: {e}")
+
+async def apply_invoice_rollups(previous: Optional[dict], current: Optional[dict]):
+    await apply_invoice_rollups_many([(previous, current)])
+
+def rollup_pipeline(dimension: str, match: dict) -> List[dict]:
+    """Aggregation computing one dimension's rollups from invoices, mirroring invoice_rollup_contributions"""
+    live = {"$ne": ["$status", "cancelled"]}
+    
+    def metric_sums(weight):
+        def amount(field):
+            return {"$multiply": [{"$ifNull": [field, 0]}, weight]}
+        return {
+            "count": {"$sum": {"$cond": [live, 1, 0]}},
+            "revenue": {"$sum": {"$cond": [live, amount("$total"), 0]}},
+            "paid": {"$sum": {"$cond": [{"$eq": ["$status", "paid"]}, amount("$total"), 0]}},
+            "gst": {"$sum": {"$cond": [live, amount("$gst_amount"), 0]}},
+            "discount": {"$sum": {"$cond": [live, amount("$discount"), 0]}},
+            "outstanding": {"$sum": {"$cond": [{"$in": ["$status", OUTSTANDING_STATUSES]}, amount("$total"), 0]}},
+            "overdue": {"$sum": {"$cond": [{"$eq": ["$status", "overdue"]}, amount("$total"), 0]}}
+        }
+    
+    pipeline = [{"$match": match}]
+    if dimension in ("day", "week", "month"):
+        fmt = {"day": "%Y-%m-%d", "week": "%G-W%V", "month": "%Y-%m"}[dimension]
+        # created_at is stored as a UTC ISO string; keys use the business timezone
+        created = {"$dateFromString": {"dateString": {"$substrCP": ["$created_at", 0, 19]}, "timezone": "UTC"}}
+        pipeline += [
+            {"$group": {
+                "_id": {"user_id": "$user_id", "key": {"$dateToString": {"date": created, "format": fmt, "timezone": APPOINTMENT_TIMEZONE}}},
+                **metric_sums(1)
+            }}
+        ]
+    elif dimension == "tenant":
+        pipeline += [{"$group": {"_id": {"user_id": "$user_id", "key": "all"}, "label": {"$first": "All invoices"}, **metric_sums(1)}}]
+    elif dimension == "client":
+        pipeline += [
+            {"$sort": {"created_at": 1}},
+            {"$group": {"_id": {"user_id": "$user_id", "key": "$client_id"}, "label": {"$last": "$client_name"}, **metric_sums(1)}}
+        ]
+    else:
+        items_total = {"$sum": {"$map": {"input": {"$ifNull": ["$items", []]}, "as": "item", "in": {"$ifNull": ["$$item.total", 0]}}}}
+        pipeline += [
+            {"$addFields": {"_items_total": items_total}},
+            {"$unwind": "$items"},
+            {"$addFields": {
+                "_weight": {"$cond": [{"$gt": ["$_items_total", 0]}, {"$divide": [{"$ifNull": ["$items.total", 0]}, "$_items_total"]}, 0]},
+                "_key": {"$cond": [
+                    {"$ifNull": ["$items.service_id", False]},
+                    "$items.service_id",
+                    {"$concat": ["name:", "$items.name"]}
+                ]},
+                "_label": {"$cond": [
+                    {"$ifNull": ["$items.service_id", False]},
+                    {"$arrayElemAt": [{"$split": ["$items.name", " - "]}, 0]},
+                    "$items.name"
+                ]}
+            }},
+            # One row per (invoice, service) so a service counts each invoice once
+            {"$group": {
+                "_id": {"user_id": "$user_id", "invoice": "$id", "key": "$_key"},
+                "_weight": {"$sum": "$_weight"},
+                "_label": {"$last": "$_label"},
+                **{field: {"$first": f"${field}"} for field in ("user_id", "created_at", "status", "total", "gst_amount", "discount")}
+            }},
+            {"$sort": {"created_at": 1}},
+            {"$group": {"_id": {"user_id": "$user_id", "key": "$_id.key"}, "label": {"$last": "$_label"},
+                        **metric_sums("$_weight")}}
+        ]
+    return pipeline
+
+async def rebuild_invoice_rollups(user_id: str = None) -> int:
+    """Recompute rollups from invoices with aggregation pipelines (all users, or one).
+
+    Rows are replaced key by key (upserts, so concurrent live $inc upserts and
+    other rebuilds never hit duplicate keys) and stamped with this rebuild's
+    id; afterwards, rows this rebuild did not produce and no live write has
+    touched since it started are removed.
+    
+    This is a maintenance operation: a live $inc that lands between the
+    aggregation and the replace of its row is lost. It runs once per rollup
+    format change at startup and otherwise only on an admin's request.
+    """
+    match = {"user_id": user_id} if user_id else {}
+    rebuild_id = str(uuid.uuid4())
+    started = datetime.now(timezone.utc).isoformat()
+    written = 0
+    for dimension in ROLLUP_DIMENSIONS:
+        batch = []
+        async for row in db.invoices.aggregate(rollup_pipeline(dimension, match), allowDiskUse=True):
+            owner, key = row["_id"]["user_id"], row["_id"]["key"]
+            rollup_id = f"{owner}:{dimension}:{key}"
+            batch.append(ReplaceOne({"id": rollup_id}, {
+                "id": rollup_id, "user_id": owner, "dimension": dimension, "key": key,
+                "label": row.get("label") or key, **{metric: row[metric] for metric in ROLLUP_METRICS},
+                "rebuild_id": rebuild_id, "updated_at": datetime.now(timezone.utc).isoformat()
+            }, upsert=True))
+            if len(batch) >= 1000:
+                await db.invoice_rollups.bulk_write(batch, ordered=False)
+                written += len(batch)
+                batch = []
+        if batch:
+            await db.invoice_rollups.bulk_write(batch, ordered=False)
+            written += len(batch)
+    await db.invoice_rollups.delete_many({**match, "rebuild_id": {"$ne": rebuild_id}, "updated_at": {"$not": {"$gte": started}}})
+    logger.info(f"Rebuilt {written} invoice rollups" + (f" for user {user_id}" if user_id else ""))
+    return written
+
+# ==================== OVERDUE INVOICES ====================
+
+async def sweep_overdue_invoices():
+    """Mark sent invoices past their due date as overdue, for all tenants at once.
+
+    Only the worker holding the sweep lease runs a tick. One update_many
+    (served by the status/due_date index) flips every invoice whose due day
+    has passed in the business timezone and flags it overdue_pending. The
+    rollup and event side effects are recorded afterwards by whoever claims
+    the transition first (record_overdue_invoices, or an edit or delete of the
+    invoice), so a crash in between leaves the flag set for the next sweep
+    rather than losing them.
+    """
+    try:
+        if not await claim_lease("lease:overdue_sweep", OVERDUE_SWEEP_MINUTES * 60):
+            return
+        now = datetime.now(timezone.utc)
+        today = now.astimezone(pytz.timezone(APPOINTMENT_TIMEZONE)).strftime("%Y-%m-%d")
+        # due_date is an ISO string, so anything before today's date string was due on an earlier day
+        result = await db.invoices.update_many(
+            {"status": "sent", "due_date": {"$ne": None, "$lt": today}},
+            {"$set": {"status": "overdue", "overdue_at": now.isoformat(), "updated_at": now.isoformat(), "overdue_pending": True}}
+        )
+        if result.modified_count:
+            logger.info(f"Marked {result.modified_count} invoices overdue")
+        # Also picks up invoices left pending by an earlier sweep that did not finish
+        await record_overdue_invoices(now)
+        await process_invoice_events()
+    except Exception as e:
+        logger.error(f"Error sweeping overdue invoices: {e}")
+
+def invoice_overdue_event(invoice: dict, now: datetime, status: str = "pending") -> dict:
+    return {
+        # One event per swept transition, so inserting it is what claims the transition
+        "id": f"overdue:{invoice['id']}:{invoice['overdue_at']}",
+        "type": "invoice_overdue",
+        "user_id": invoice["user_id"],
+        "invoice_id": invoice["id"],
+        "status": status,
+        "attempts": 0,
+        "created_at": now.isoformat()
+    }
+
+async def claim_overdue_transition(invoice: dict, notify: bool) -> dict:
+    """The invoice as the rollups count it, claiming its unrecorded overdue transition if it has one.
+
+    A sweep not yet recorded still counts as sent. Whoever inserts the
+    transition's event first records it; if the sweeper got there first, the
+    rollups already count the invoice as overdue. Without `notify` the event
+    is stored as skipped, so no reminder goes out.
+    """
+    if not invoice.get("overdue_pending"):
+        return invoice
+    event = invoice_overdue_event(invoice, datetime.now(timezone.utc), "pending" if notify else "skipped")
+    try:
+        result = await db.invoice_events.update_one({"id": event["id"]}, {"$setOnInsert": event}, upsert=True)
+    except DuplicateKeyError:
+        return invoice
+    return {**invoice, "status": "sent"} if result.upserted_id else invoice
+
+async def record_overdue_invoices(now: datetime):
+    """Move pending swept invoices into the overdue balance and queue their overdue events.
+
+    All pending invoices are claimed in one unordered bulk_write that upserts
+    their events; only the invoices whose event this call inserted are
+    recorded here, the rest were claimed first by an edit or delete.
+    """
+    pending = await db.invoices.find({"overdue_pending": True}, {"_id": 0}).to_list(None)
+    if not pending:
+        return
+    claims = []
+    for invoice in pending:
+        event = invoice_overdue_event(invoice, now)
+        claims.append(UpdateOne({"id": event["id"]}, {"$setOnInsert": event}, upsert=True))
+    try:
+        upserted = (await db.invoice_events.bulk_write(claims, ordered=False)).upserted_ids
+    except BulkWriteError as e:
+        # A concurrent claim of the same event loses on the unique id index
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+        upserted = {row["index"]: row["_id"] for row in e.details.get("upserted", [])}
+    claimed = [pending[index] for index in upserted]
+    changes = []
+    for invoice in claimed:
+        invoice.pop("overdue_pending")
+        changes.append(({**invoice, "status": "sent"}, invoice))
+    await apply_invoice_rollups_many(changes)
+    # Every pending transition now has its event, whoever inserted it
+    await db.invoices.update_many(
+        {"id": {"$in": [invoice["id"] for invoice in pending]}, "overdue_pending": True},
+        {"$unset": {"overdue_pending": ""}}
+    )
+    if claimed:
+        logger.info(f"Recorded {len(claimed)} overdue invoices")
+
+def invoice_event_retry_at(attempts: int, now: datetime) -> str:
+    """Exponential backoff: the base delay doubles with each failed attempt"""
+    return (now + timedelta(seconds=INVOICE_EVENT_RETRY_SECONDS * 2 ** (attempts - 1))).isoformat()
+
+async def process_invoice_events():
+    """Handle due invoice events; each is claimed atomically so workers never double-send.
+
+    A failed event goes back to pending with a backed-off next_attempt_at and
+    is only marked failed after INVOICE_EVENT_MAX_ATTEMPTS attempts.
+    """
+    settings_cache = {}
+    now = datetime.now(timezone.utc)
+    # Events claimed by a worker that died mid-way are picked up again after a while
+    stale = (now - timedelta(minutes=OVERDUE_SWEEP_MINUTES)).isoformat()
+    while True:
+        claimed_at = datetime.now(timezone.utc).isoformat()
+        event = await db.invoice_events.find_one_and_update(
+            {"$or": [
+                {"status": "pending", "$or": [{"next_attempt_at": None}, {"next_attempt_at": {"$lte": now.isoformat()}}]},
+                {"status": "processing", "claimed_at": {"$lt": stale}}
+            ]},
+            {"$set": {"status": "processing", "claimed_by": WORKER_ID, "claimed_at": claimed_at}, "$inc": {"attempts": 1}},
+            projection={"_id": 0},
+            sort=[("created_at", 1)]
+        )
+        if not event:
+            return
+        attempts = event.get("attempts", 0) + 1
+        result = {"status": "done", "error": None}
+        try:
+            if event["type"] == "invoice_overdue":
+                if event["user_id"] not in settings_cache:
+                    settings_cache[event["user_id"]] = await db.settings.find_one({"user_id": event["user_id"]}, {"_id": 0}) or {}
+                await send_invoice_overdue_sms(event, settings_cache[event["user_id"]])
+        except Exception as e:
+            if attempts < INVOICE_EVENT_MAX_ATTEMPTS:
+                result = {"status": "pending", "error": str(e), "next_attempt_at": invoice_event_retry_at(attempts, datetime.now(timezone.utc))}
+            else:
+                result = {"status": "failed", "error": str(e)}
+            logger.error(f"Invoice event {event['id']} failed (attempt {attempts}): {e}")
+        # Only the worker holding the claim records the outcome
+        await db.invoice_events.update_one(
+            {"id": event["id"], "claimed_by": WORKER_ID, "claimed_at": claimed_at},
+            {"$set": {**result, "processed_at": datetime.now(timezone.utc).isoformat()}}
+        )
+
+async def ensure_invoice_rollups():
+    """Indexes, plus a one-time backfill of rollups for existing invoices"""
+    try:
+        await db.invoice_rollups.create_index("id", unique=True)
+        await db.invoice_rollups.create_index([("user_id", 1), ("dimension", 1), ("key", 1)])
+        await db.invoices.create_index([("status", 1), ("due_date", 1)])
+        await db.invoices.create_index("overdue_pending", sparse=True)
+        await db.invoice_events.create_index("id", unique=True)
+        await db.invoice_events.create_index([("status", 1), ("created_at", 1)])
+        await db.counters.create_index("id", unique=True)
+        # v3: service rows count invoices rather than item quantities
+        if await claim_migration("migration:invoice_rollups_v3"):
+            await rebuild_invoice_rollups()
+            await complete_migration("migration:invoice_rollups_v3")
+    except Exception as e:
+        logger.error(f"Invoice rollup setup failed: {e}")
+
+def rollup_period_key(dimension: str, date_str: str) -> str:
+    """Convert a YYYY-MM-DD bound to the key format of a time dimension"""
+    try:
+        day = datetime.strptime(date_str, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+    return rollup_period_keys(day)[dimension]
+
+@api_router.get("/reports/revenue")
+async def get_revenue_report(
+    group_by: str = "month",
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    user_id: str = Depends(get_current_user)
+):
+    """Revenue, GST, discounts and outstanding balance grouped by day, week, month, client or service"""
+    if group_by not in ROLLUP_DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of: {', '.join(ROLLUP_DIMENSIONS)}")
+    if group_by == "tenant":
+        raise HTTPException(status_code=400, detail="Use /reports/outstanding for the overall balance")
+    
+    query = {"user_id": user_id, "dimension": group_by}
+    if group_by in ("day", "week", "month") and (start_date or end_date):
+        query["key"] = {}
+        if start_date:
+            query["key"]["$gte"] = rollup_period_key(group_by, start_date)
+        if end_date:
+            query["key"]["$lte"] = rollup_period_key(group_by, end_date)
+    
+    sort = [("key", 1)] if group_by in ("day", "week", "month") else [("revenue", -1)]
+    rollups = await db.invoice_rollups.find(query, {"_id": 0}).sort(sort).to_list(None)
+    rows = [
+        {"key": r["key"], "label": r.get("label", r["key"]), **{m: round(r.get(m, 0), 2) for m in ROLLUP_METRICS}}
+        for r in rollups
+        if r.get("count") or any(abs(r.get(m, 0)) >= 0.005 for m in ROLLUP_METRICS)
+    ]
+    totals = {m: round(sum(row[m] for row in rows), 2) for m in ROLLUP_METRICS}
+    return {"group_by": group_by, "rows": rows, "totals": totals}
+
+@api_router.get("/reports/outstanding")
+async def get_outstanding_balance(user_id: str = Depends(get_current_user)):
+    """Current outstanding and overdue balance across all of the user's invoices"""
+    balance = await db.invoice_rollups.find_one({"id": f"{user_id}:tenant:all"}, {"_id": 0}) or {}
+    return {
+        "outstanding": round(balance.get("outstanding", 0), 2),
+        "overdue": round(balance.get("overdue", 0), 2),
+        "invoice_count": int(round(balance.get("count", 0)))
+    }
+
+@api_router.post("/reports/rebuild")
+async def rebuild_revenue_report(tenant_id: str = Query(...), user_id: str = Depends(require_admin)):
+    """Maintenance: recompute one tenant's report rollups from their invoices.
+
+    Run it while the tenant is not editing invoices: a live rollup update that
+    lands between the rebuild's aggregation and its writes is overwritten.
+    """
+    written = await rebuild_invoice_rollups(tenant_id)
+    logger.info(f"Admin {user_id} rebuilt invoice rollups for user {tenant_id}")
+    return {"message": "Reports rebuilt", "rollups": written}
+
+# ==================== INVOICE PDFS ====================
+
+# Settings that feed the rendered PDF; changing any of them drops the user's cached PDFs
+INVOICE_PDF_SETTINGS_FIELDS = set(INVOICE_BUSINESS_FIELDS.values()) | {"gst_enabled", "logo_data_url"}
+
+# Rendering is CPU-bound, so it runs in worker processes rather than threads.
+# Workers are spawned (not forked from a process that already runs threads and
+# the event loop) and only import the small invoice_pdf module.
+invoice_pdf_executor: Optional[ProcessPoolExecutor] = None
+
+def get_invoice_pdf_executor() -> ProcessPoolExecutor:
+    global invoice_pdf_executor
+    if invoice_pdf_executor is None:
+        invoice_pdf_executor = ProcessPoolExecutor(
+            max_workers=INVOICE_PDF_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return invoice_pdf_executor
+
+def invoice_pdf_document(invoice: dict, settings: Optional[dict]) -> dict:
+    """Everything the renderer reads from an invoice and its business settings.
+
+    The PDF is a pure function of this dict, so its hash is the cache key and ETag.
+    """
+    local_tz = pytz.timezone(APPOINTMENT_TIMEZONE)
+    
+    def local_date(value) -> str:
+        return to_utc_datetime(value).astimezone(local_tz).strftime("%d %b %Y") if value else ""
+    
+    business = invoice_business_details(settings)
+    business["logo_data_url"] = (settings or {}).get("logo_data_url", "")
+    return {
+        "version": INVOICE_PDF_RENDERER_VERSION,
+        "invoice": {
+            "invoice_number": invoice.get("invoice_number", ""),
+            "date": local_date(invoice.get("created_at")),
+            "due_date": local_date(invoice.get("due_date")),
+            "items": [
+                {key: item.get(key) for key in ("name", "quantity", "unit_price", "total")}
+                for item in invoice.get("items", [])
+            ],
+            "discount": invoice.get("discount", 0),
+            "gst_amount": invoice.get("gst_amount", 0),
+            "total": invoice.get("total", 0),
+            "notes": invoice.get("notes", ""),
+        },
+        "client": {
+            "name": invoice.get("client_name", ""),
+            "address": invoice.get("client_address", ""),
+            "phone": invoice.get("client_phone", ""),
+            "email": invoice.get("client_email", ""),
+        },
+        "business": business,
+    }
+
+def invoice_pdf_hash(document: dict) -> str:
+    return hashlib.sha256(json.dumps(document, sort_keys=True, separators=(",", ":"), default=str).encode()).hexdigest()
+
+async def render_invoice_pdfs(documents: List[dict]) -> List[bytes]:
+    global invoice_pdf_executor
+    loop = asyncio.get_running_loop()
+    executor = get_invoice_pdf_executor()
+    try:
+        return await asyncio.gather(*(loop.run_in_executor(executor, render_invoice_pdf, document) for document in documents))
+    except BrokenProcessPool:
+        # A crashed worker poisons the pool; start a fresh one for the next request
+        if invoice_pdf_executor is executor:
+            invoice_pdf_executor = None
+        raise
+
+def invoice_pdf_write(user_id: str, invoice: dict, content_hash: str, pdf: bytes) -> UpdateOne:
+    return UpdateOne(
+        {"user_id": user_id, "invoice_id": invoice["id"]},
+        {"$set": {
+            "invoice_number": invoice.get("invoice_number", ""),
+            "content_hash": content_hash,
+            "pdf": pdf,
+            "size": len(pdf),
+            "rendered_at": datetime.now(timezone.utc).isoformat()
+        }},
+        upsert=True
+    )
+
+async def cache_invoice_pdfs(user_id: str, invoices: List[dict], settings: Optional[dict]) -> int:
+    """Render and cache every invoice whose cached PDF is missing or stale; returns how many were rendered.
+
+    Work is fed to the process pool in slices so a month of invoices never sits
+    in memory as rendered PDFs all at once.
+    """
+    cached = {
+        doc["invoice_id"]: doc["content_hash"]
+        async for doc in db.invoice_pdfs.find(
+            {"user_id": user_id, "invoice_id": {"$in": [inv["id"] for inv in invoices]}},
+            {"_id": 0, "invoice_id": 1, "content_hash": 1}
+        )
+    }
+    stale = []
+    for invoice in invoices:
+        document = invoice_pdf_document(invoice, settings)
+        content_hash = invoice_pdf_hash(document)
+        if cached.get(invoice["id"]) != content_hash:
+            stale.append((invoice, document, content_hash))
+    
+    for start in range(0, len(stale), INVOICE_PDF_BATCH_SIZE):
+        batch = stale[start:start + INVOICE_PDF_BATCH_SIZE]
+        pdfs = await render_invoice_pdfs([document for _, document, _ in batch])
+        await db.invoice_pdfs.bulk_write(
+            [invoice_pdf_write(user_id, invoice, content_hash, pdf) for (invoice, _, content_hash), pdf in zip(batch, pdfs)],
+            ordered=False
+        )
+    return len(stale)
+
+async def ensure_invoice_pdf_indexes():
+    try:
+        await db.invoice_pdfs.create_index([("user_id", 1), ("invoice_id", 1)], unique=True)
+    except Exception as e:
+        logger.error(f"Invoice PDF index setup failed: {e}")
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match", "")
+    return header.strip() == "*" or etag in [tag.strip().removeprefix("W/") for tag in header.split(",")]
+
+@api_router.get("/invoices/{invoice_id}/pdf")
+async def get_invoice_pdf(invoice_id: str, request: Request, tenant: TenantContext = Depends(get_tenant)):
+    """Invoice as a PDF, rendered once per content version and revalidated by ETag"""
+    user_id = tenant.user_id
+    invoice = await db.invoices.find_one({"id": invoice_id, "user_id": user_id}, {"_id": 0})
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    
+    document = invoice_pdf_document(invoice, await tenant.settings())
+    content_hash = invoice_pdf_hash(document)
+    # no-cache: clients keep the PDF but revalidate it, so edits show up immediately
+    headers = {"ETag": f'"{content_hash}"', "Cache-Control": "private, no-cache"}
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    
+    cached = await db.invoice_pdfs.find_one(
+        {"user_id": user_id, "invoice_id": invoice_id, "content_hash": content_hash}, {"_id": 0, "pdf": 1}
+    )
+    if cached:
+        pdf = cached["pdf"]
+    else:
+        pdf = (await render_invoice_pdfs([document]))[0]
+        await db.invoice_pdfs.bulk_write([invoice_pdf_write(user_id, invoice, content_hash, pdf)])
+    
+    headers["Content-Disposition"] = f'inline; filename="Invoice_{invoice.get("invoice_number") or invoice_id}.pdf"'
+    return Response(content=pdf, media_type="application/pdf", headers=headers)
+
+async def stream_invoice_pdf_archive(user_id: str, invoice_ids: List[str]):
+    """Yield a zip of cached invoice PDFs, read one at a time from the cache"""
+    buffer = ZipStreamBuffer()
+    # PDFs are already compressed, so entries are stored as-is
+    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        cursor = db.invoice_pdfs.find(
+            {"user_id": user_id, "invoice_id": {"$in": invoice_ids}},
+            {"_id": 0, "invoice_id": 1, "invoice_number": 1, "pdf": 1}
+        ).sort("invoice_number", 1).batch_size(20)
+        async for doc in cursor:
+            with archive.open(f"Invoice_{doc.get('invoice_number') or doc['invoice_id']}.pdf", mode="w", force_zip64=True) as entry:
+                entry.write(doc["pdf"])
+            yield buffer.drain()
+    yield buffer.drain()
+
+@api_router.get("/invoices/pdfs/{month}")
+async def get_invoice_pdf_archive(month: str, tenant: TenantContext = Depends(get_tenant)):
+    """Zip of every invoice created in a month (YYYY-MM, business timezone), rendered in parallel"""
+    user_id = tenant.user_id
+    try:
+        first_day = datetime.strptime(month, "%Y-%m")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Month must be YYYY-MM")
+    next_month = (first_day + timedelta(days=32)).replace(day=1)
+    local_tz = pytz.timezone(APPOINTMENT_TIMEZONE)
+    start = local_tz.localize(first_day).astimezone(timezone.utc)
+    end = local_tz.localize(next_month).astimezone(timezone.utc)
+    
+    invoices = await db.invoices.find(
+        {"user_id": user_id, "created_at": {"$gte": start.isoformat(), "$lt": end.isoformat()}}, {"_id": 0}
+    ).to_list(None)
+    if not invoices:
+        raise HTTPException(status_code=404, detail="No invoices in this month")
+    
+    started = time.perf_counter()
+    rendered = await cache_invoice_pdfs(user_id, invoices, await tenant.settings())
+    logger.info(f"Rendered {rendered}/{len(invoices)} invoice PDFs for {month} in {time.perf_counter() - started:.2f}s")
+    
+    return StreamingResponse(
+        stream_invoice_pdf_archive(user_id, [inv["id"] for inv in invoices]),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="invoices-{month}.zip"'}
+    )
+
+# ==================== SMS FUNCTIONS ====================
+
+def format_sms_template(template: str, variables: dict) -> str:
+    """Replace template variables with actual values"""
+    message = template
+    for key, value in variables.items():
+        message = message.replace(f"{{{key}}}", str(value))
+    return message
+
+async def send_twilio_sms(to_phone: str, message: str, settings: dict) -> tuple:
+    """Send SMS via Twilio"""
+    try:
+        from twilio.rest import Client as TwilioClient
+        
+        account_sid = settings.get("twilio_account_sid")
+        auth_token = settings.get("twilio_auth_token")
+        from_phone = settings.get("twilio_phone_number")
+        
+        if not all([account_sid, auth_token, from_phone]):
+            return False, "Twilio credentials not configured"
+        
+        client = TwilioClient(account_sid, auth_token)
+        
+        # Ensure Australian format
+        if not to_phone.startswith("+"):
+            to_phone = "+61" + to_phone.lstrip("0")
+        
+        message_obj = client.messages.create(
+            body=message,
+            from_=from_phone,
+            to=to_phone
+        )
+        
+        return True, message_obj.sid
+    except Exception as e:
+        logger.error(f"Twilio SMS error: {e}")
+        return False, str(e)
+
+async def create_sms_log(user_id: str, client_id: str, client_name: str, phone: str, 
+                         message_type: str, message_text: str, appointment_id: str = None,
+                         status: str = "pending", error_message: str = None) -> str:
+    """Create SMS message log entry"""
+    sms_log = {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "client_id": client_id,
+        "client_name": client_name,
+        "phone": phone,
+        "message_type": message_type,
+        "message_text": message_text,
+        "status": status,
+        "appointment_id": appointment_id,
+        "error_message": error_message,
+        "sent_at": datetime.now(timezone.utc).isoformat() if status == "sent" else None,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    await db.sms_messages.insert_one(sms_log)
+    return sms_log["id"]
+
+async def send_appointment_sms(tenant: TenantContext, appointment: dict, message_type: str):
     """Send SMS for appointment events (if automated mode is enabled)"""
+    user_id = tenant.user_id
     try:
-        settings = await get_user_settings(user_id)
+        settings = await tenant.settings()
         
         if not settings.get("sms_enabled"):
             return
@@ -1960,6 +3524,53 @@ async def send_appointment_sms(user_id: str, appointment: dict, message_type: st
     except Exception as e:
         logger.error(f"Error sending appointment SMS: {e}")
 
+async def send_invoice_overdue_sms(event: dict, settings: dict):
+    """Send the overdue-invoice SMS for an event (if automated SMS and the template are enabled)"""
+    if not settings.get("sms_enabled") or settings.get("sms_mode") != "automated":
+        return
+    template_config = settings.get("sms_templates", DEFAULT_SMS_TEMPLATES).get("invoice_overdue")
+    if not template_config or not template_config.get("enabled"):
+        return
+    
+    invoice = await db.invoices.find_one({"id": event["invoice_id"], "user_id": event["user_id"]}, {"_id": 0})
+    if not invoice or invoice.get("status") != "overdue":
+        return  # Paid or deleted since the sweep
+    client = await db.clients.find_one({"id": invoice["client_id"], "user_id": event["user_id"]}, {"_id": 0})
+    if not client or not client.get("phone"):
+        return
+    
+    variables = {
+        "client_name": client.get("name", ""),
+        "invoice_number": invoice.get("invoice_number", ""),
+        "amount": f"{invoice.get('total', 0):.2f}",
+        "due_date": to_utc_datetime(invoice["due_date"]).strftime("%d/%m/%Y"),
+        "business_name": settings.get("business_name", "our salon"),
+        "business_phone": settings.get("phone", "")
+    }
+    message = format_sms_template(template_config["template"], variables)
+    
+    if settings.get("sms_provider") == "twilio":
+        success, result = await send_twilio_sms(client["phone"], message, settings)
+        status = "sent" if success else "failed"
+        error = None if success else result
+    else:
+        status = "pending"
+        error = None
+    
+    await create_sms_log(
+        user_id=event["user_id"],
+        client_id=client["id"],
+        client_name=client["name"],
+        phone=client["phone"],
+        message_type="invoice_overdue",
+        message_text=message,
+        status=status,
+        error_message=error
+    )
+    if error:
+        # Let process_invoice_events retry the event with backoff
+        raise RuntimeError(f"SMS send failed: {error}")
+
 # ==================== AUTOMATED REMINDER SYSTEM ====================
 
 async def check_and_send_reminders():
@@ -1970,9 +3581,7 @@ async def check_and_send_reminders():
         # Get all users with SMS enabled
         users_with_sms = await db.settings.find(
             {"sms_enabled": True, "sms_mode": "automated"},
-            {"_id": 0, "user_id": 1, "send_24h_reminder": 1, "reminder_value": 1, 
-             "reminder_unit": 1, "send_confirmation_request": 1, 
-             "confirmation_request_value": 1, "confirmation_request_unit": 1}
+            {"_id": 0}
         ).to_list(None)
         
         now = datetime.now(timezone.utc)
@@ -1982,8 +3591,7 @@ async def check_and_send_reminders():
             if not user_id:
                 continue
             
-            # Get full settings for this user
-            full_settings = await get_user_settings(user_id)
+            full_settings = user_settings
             
             # Check 24h reminder
             if user_settings.get("send_24h_reminder", True):
@@ -2017,8 +3625,9 @@ async def check_and_send_reminders():
                         # Mark as sent
                         await db.appointments.update_one(
                             {"id": appt["id"]},
-                            {"$set": {"reminder_24h_sent": True}}
+                            {"$set": {"reminder_24h_sent": True, "updated_at": datetime.now(timezone.utc).isoformat()}}
                         )
+                        backup_coordinator.mark_dirty(user_id, "appointments")
                         logger.info(f"Sent 24h reminder for appointment {appt['id']}")
                     except Exception as e:
                         logger.error(f"Failed to send 24h reminder for {appt['id']}: {e}")
@@ -2056,8 +3665,9 @@ async def check_and_send_reminders():
                         # Mark as sent
                         await db.appointments.update_one(
                             {"id": appt["id"]},
-                            {"$set": {"confirmation_sent": True}}
+                            {"$set": {"confirmation_sent": True, "updated_at": datetime.now(timezone.utc).isoformat()}}
                         )
+                        backup_coordinator.mark_dirty(user_id, "appointments")
                         logger.info(f"Sent confirmation request for appointment {appt['id']}")
                     except Exception as e:
                         logger.error(f"Failed to send confirmation for {appt['id']}: {e}")
@@ -2174,9 +3784,9 @@ async def get_reminder_status(user_id: str = Depends(get_current_user)):
     }
 
 @api_router.get("/sms/templates")
-async def get_sms_templates(user_id: str = Depends(get_current_user)):
+async def get_sms_templates(tenant: TenantContext = Depends(get_tenant)):
     """Get SMS templates for user"""
-    settings = await db.settings.find_one({"user_id": user_id}, {"_id": 0})
+    settings = await tenant.settings()
     if not settings:
         return {"templates": DEFAULT_SMS_TEMPLATES}
     return {"templates": settings.get("sms_templates", DEFAULT_SMS_TEMPLATES)}
@@ -2188,12 +3798,14 @@ async def update_sms_templates(templates: dict, user_id: str = Depends(get_curre
         {"user_id": user_id},
         {"$set": {"sms_templates": templates, "updated_at": datetime.now(timezone.utc).isoformat()}}
     )
+    backup_coordinator.mark_dirty(user_id, "settings")
     return {"message": "Templates updated"}
 
 @api_router.post("/sms/send")
-async def send_sms(request: SendSMSRequest, background_tasks: BackgroundTasks, user_id: str = Depends(get_current_user)):
+async def send_sms(request: SendSMSRequest, background_tasks: BackgroundTasks, tenant: TenantContext = Depends(get_tenant)):
     """Send SMS to a client (manual trigger)"""
-    settings = await get_user_settings(user_id)
+    user_id = tenant.user_id
+    settings = await tenant.settings()
     
     if not settings.get("sms_enabled"):
         raise HTTPException(status_code=400, detail="SMS is not enabled")
@@ -2291,9 +3903,10 @@ async def update_sms_status(message_id: str, status: str, user_id: str = Depends
     return {"message": "Status updated"}
 
 @api_router.post("/sms/preview")
-async def preview_sms(message_type: str, appointment_id: str = None, user_id: str = Depends(get_current_user)):
+async def preview_sms(message_type: str, appointment_id: str = None, tenant: TenantContext = Depends(get_tenant)):
     """Preview an SMS message without sending"""
-    settings = await get_user_settings(user_id)
+    user_id = tenant.user_id
+    settings = await tenant.settings()
     templates = settings.get("sms_templates", DEFAULT_SMS_TEMPLATES)
     template_config = templates.get(message_type)
     
@@ -2336,43 +3949,704 @@ async def preview_sms(message_type: str, appointment_id: str = None, user_id: st
 
 # ==================== BACKUP FUNCTIONS ====================
 
-async def backup_collection_to_supabase(collection_name: str, user_id: str):
-    """Backup a MongoDB collection to Supabase for a specific user"""
-    if not supabase_client:
+def backup_change_fields(collection_name: str) -> List[str]:
+    """Timestamp fields that mark a document as changed since a watermark"""
+    # Waitlist entries carry date_added instead of created_at
+    return ["updated_at", "date_added" if collection_name == "waitlist" else "created_at"]
+
+class BackupStorage(ABC):
+    """Where backup chunks and manifests are kept.
+
+    Chunks are gzip-compressed NDJSON blobs addressed by key. A manifest lists
+    the chunks of one backup and is written last, so a backup only exists once
+    its manifest does.
+    """
+
+    @abstractmethod
+    async def put_chunk(self, key: str, data: bytes):
+        ...
+
+    @abstractmethod
+    async def get_chunk(self, key: str) -> bytes:
+        ...
+
+    @abstractmethod
+    async def delete_chunks(self, keys: List[str]):
+        ...
+
+    @abstractmethod
+    async def save_manifest(self, manifest: dict):
+        ...
+
+    @abstractmethod
+    async def list_manifests(self, user_id: str, collection_name: str = None) -> List[dict]:
+        """Manifests for a user (optionally one collection), oldest first"""
+
+    @abstractmethod
+    async def delete_manifests(self, manifests: List[dict]):
+        ...
+
+    async def latest_manifest(self, user_id: str) -> Optional[dict]:
+        manifests = await self.list_manifests(user_id)
+        return manifests[-1] if manifests else None
+
+    def close(self):
+        pass
+
+class LocalBackupStorage(BackupStorage):
+    """Backups on the local filesystem, laid out as {user}/{collection}/{backup_id}/"""
+
+    def __init__(self, root_dir: str):
+        self.root = Path(root_dir).resolve()
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root not in path.parents:
+            raise ValueError(f"Backup key outside storage root: {key}")
+        return path
+
+    @staticmethod
+    def _write(path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def _manifest_path(self, manifest: dict) -> Path:
+        return self._path(f"{manifest['user_id']}/{manifest['collection']}/{manifest['backup_id']}/manifest.json")
+
+    async def put_chunk(self, key: str, data: bytes):
+        await asyncio.to_thread(self._write, self._path(key), data)
+
+    async def get_chunk(self, key: str) -> bytes:
+        return await asyncio.to_thread(self._path(key).read_bytes)
+
+    async def delete_chunks(self, keys: List[str]):
+        def remove():
+            for key in keys:
+                path = self._path(key)
+                path.unlink(missing_ok=True)
+                if path.parent != self.root and not any(path.parent.iterdir()):
+                    path.parent.rmdir()
+        await asyncio.to_thread(remove)
+
+    async def save_manifest(self, manifest: dict):
+        data = json.dumps(manifest, sort_keys=True).encode()
+        await asyncio.to_thread(self._write, self._manifest_path(manifest), data)
+
+    async def list_manifests(self, user_id: str, collection_name: str = None) -> List[dict]:
+        def scan():
+            base = self._path(user_id)
+            pattern = f"{collection_name or '*'}/*/manifest.json"
+            return [json.loads(p.read_bytes()) for p in base.glob(pattern)] if base.exists() else []
+        manifests = await asyncio.to_thread(scan)
+        return sorted(manifests, key=lambda m: m["backup_at"])
+
+    async def delete_manifests(self, manifests: List[dict]):
+        def remove():
+            for manifest in manifests:
+                path = self._manifest_path(manifest)
+                path.unlink(missing_ok=True)
+                try:
+                    path.parent.rmdir()
+                except OSError:
+                    pass  # Chunks still present
+        await asyncio.to_thread(remove)
+
+class SupabaseBackupStorage(BackupStorage):
+    """Chunks in a Supabase Storage bucket, manifests as rows of the maya_backups table.
+
+    supabase-py does synchronous HTTP, so every call runs on a dedicated
+    bounded thread pool with a timeout; latency is recorded in metrics.
+    """
+
+    def __init__(self, supabase, bucket: str, max_workers: int, timeout: float):
+        self.supabase = supabase
+        self.bucket = bucket
+        self.timeout = timeout
+        self.metrics = LatencyMetrics()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="supabase-io")
+
+    async def run(self, op: str, fn, *args, **kwargs):
+        return await run_blocking(self._executor, self.timeout, self.metrics, op, fn, *args, **kwargs)
+
+    async def put_chunk(self, key: str, data: bytes):
+        await self.run(
+            "storage.upload", self.supabase.storage.from_(self.bucket).upload,
+            key, data, {"content-type": "application/gzip", "upsert": "true"}
+        )
+
+    async def get_chunk(self, key: str) -> bytes:
+        return await self.run("storage.download", self.supabase.storage.from_(self.bucket).download, key)
+
+    async def delete_chunks(self, keys: List[str]):
+        if keys:
+            await self.run("storage.remove", self.supabase.storage.from_(self.bucket).remove, keys)
+
+    async def save_manifest(self, manifest: dict):
+        query = self.supabase.table("maya_backups").upsert({
+            "id": manifest["backup_id"],
+            "user_id": manifest["user_id"],
+            "collection": manifest["collection"],
+            "kind": manifest["kind"],
+            "backup_at": manifest["backup_at"],
+            "count": manifest["count"],
+            "manifest": manifest
+        })
+        await self.run("manifests.upsert", query.execute)
+
+    @staticmethod
+    def _manifest_from_row(row: dict, user_id: str) -> dict:
+        # Rows written before chunked backups have no manifest; expose them so they can be pruned
+        return row.get("manifest") or {
+            "backup_id": row["id"], "user_id": user_id, "collection": row["collection"],
+            "kind": row.get("kind", "full"), "backup_at": row["backup_at"], "chunks": [], "legacy": True
+        }
+
+    async def list_manifests(self, user_id: str, collection_name: str = None) -> List[dict]:
+        query = self.supabase.table("maya_backups").select("id, collection, kind, backup_at, manifest").eq("user_id", user_id)
+        if collection_name:
+            query = query.eq("collection", collection_name)
+        result = await self.run("manifests.list", query.order("backup_at").execute)
+        return [self._manifest_from_row(row, user_id) for row in result.data]
+
+    async def latest_manifest(self, user_id: str) -> Optional[dict]:
+        query = self.supabase.table("maya_backups").select("id, collection, kind, backup_at").eq(
+            "user_id", user_id
+        ).order("backup_at", desc=True).limit(1)
+        result = await self.run("manifests.latest", query.execute)
+        return self._manifest_from_row(result.data[0], user_id) if result.data else None
+
+    async def delete_manifests(self, manifests: List[dict]):
+        if manifests:
+            query = self.supabase.table("maya_backups").delete().in_("id", [m["backup_id"] for m in manifests])
+            await self.run("manifests.delete", query.execute)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+def create_backup_storage() -> Optional[BackupStorage]:
+    if BACKUP_STORAGE == "local":
+        return LocalBackupStorage(BACKUP_LOCAL_DIR)
+    if supabase_client:
+        return SupabaseBackupStorage(supabase_client, BACKUP_BUCKET, SUPABASE_IO_MAX_WORKERS, SUPABASE_IO_TIMEOUT_SECONDS)
+    return None
+
+backup_storage = create_backup_storage()
+
+class BackupChunkWriter:
+    """Streams documents into gzip-compressed NDJSON chunks with a sha256 per chunk.
+
+    The first chunk is held back until a second one is needed, so a backup
+    that turns out to match the previous one never uploads anything when it
+    fits in a single chunk.
+    """
+
+    def __init__(self, storage: BackupStorage, prefix: str, chunk_docs: int):
+        self.storage = storage
+        self.prefix = prefix
+        self.chunk_docs = chunk_docs
+        self.chunks = []
+        self.count = 0
+        self.content = hashlib.sha256()  # Over the uncompressed stream, for change detection
+        self._held = None
+        self._uploaded = []
+        self._start_chunk()
+
+    def _start_chunk(self):
+        self._compressor = zlib.compressobj(wbits=31)  # gzip container
+        self._parts = []
+        self._chunk_count = 0
+
+    async def add(self, doc: dict):
+        line = (json.dumps(doc, sort_keys=True, default=str) + "\n").encode()
+        self.content.update(line)
+        self._parts.append(self._compressor.compress(line))
+        self._chunk_count += 1
+        self.count += 1
+        if self._chunk_count >= self.chunk_docs:
+            await self._seal()
+
+    async def _upload(self, key: str, data: bytes):
+        await self.storage.put_chunk(key, data)
+        self._uploaded.append(key)
+
+    async def _seal(self):
+        if not self._chunk_count:
+            return
+        data = b"".join(self._parts) + self._compressor.flush()
+        key = f"{self.prefix}/chunk-{len(self.chunks):05d}.ndjson.gz"
+        self.chunks.append({"key": key, "count": self._chunk_count, "sha256": hashlib.sha256(data).hexdigest(), "bytes": len(data)})
+        self._start_chunk()
+        if not self._uploaded and self._held is None:
+            self._held = (key, data)
+            return
+        if self._held:
+            await self._upload(*self._held)
+            self._held = None
+        await self._upload(key, data)
+
+    async def finish(self):
+        """Seal the last chunk; nothing held back is uploaded until commit()"""
+        await self._seal()
+
+    async def commit(self):
+        if self._held:
+            await self._upload(*self._held)
+            self._held = None
+
+    async def discard(self):
+        self._held = None
+        await self.storage.delete_chunks(self._uploaded)
+        self._uploaded = []
+
+async def backup_collection(collection_name: str, user_id: str, full: bool = False):
+    """Backup a MongoDB collection for a specific user.
+
+    Documents are streamed from the cursor into compressed chunks and described
+    by a manifest. Normally only documents changed since the stored watermark
+    are shipped, together with tombstones for deleted documents. A full
+    snapshot is written on the first backup, when requested, and when
+    compaction is due; it supersedes (and removes) older backups.
+    """
+    if not backup_storage or (user_id, collection_name) in restoring_collections:
         return
     
+    writer = None
     try:
-        # Fetch all documents for this user
-        docs = await db[collection_name].find({"user_id": user_id}, {"_id": 0}).to_list(10000)
+        run_started = datetime.now(timezone.utc)
+        state = await db.backup_state.find_one({"user_id": user_id, "collection": collection_name}, {"_id": 0})
+        compaction_cutoff = (run_started - timedelta(hours=BACKUP_COMPACTION_HOURS)).isoformat()
+        if not state or not state.get("last_full_at") or state["last_full_at"] < compaction_cutoff:
+            full = True
+        
+        kind = "full" if full else "incremental"
+        backup_id = f"{user_id}_{collection_name}_{run_started.strftime('%Y%m%d_%H%M%S_%f')}_{kind}"
+        writer = BackupChunkWriter(backup_storage, f"{user_id}/{collection_name}/{backup_id}", BACKUP_CHUNK_DOCS)
+        deleted = []
+        if full:
+            query = {"user_id": user_id}
+        else:
+            # Overlap the window slightly so writes racing the previous run are re-shipped
+            since = (datetime.fromisoformat(state["watermark"]) - timedelta(seconds=BACKUP_WATERMARK_OVERLAP_SECONDS)).isoformat()
+            query = {"user_id": user_id, "$or": [{field: {"$gte": since}} for field in backup_change_fields(collection_name)]}
+            tombstones = await db.backup_tombstones.find(
+                {"user_id": user_id, "collection": collection_name, "deleted_at": {"$gte": since}},
+                {"_id": 0, "doc_id": 1}
+            ).to_list(None)
+            deleted = sorted({t["doc_id"] for t in tombstones})
         
-        if not docs:
+        async for doc in db[collection_name].find(query, {"_id": 0}):
+            await writer.add(doc)
+        await writer.finish()
+        
+        if not writer.count and not deleted and (not full or not state):
+            # Nothing changed (or nothing has ever been backed up and there is nothing to back up)
+            await save_backup_state(user_id, collection_name, run_started, full=full)
+            return
+        
+        hash_field = f"last_{kind}_hash"
+        writer.content.update(json.dumps(deleted).encode())
+        content_hash = writer.content.hexdigest()
+        if state and state.get(hash_field) == content_hash:
+            # Identical to what was last shipped (e.g. only the overlap window re-matched)
+            await writer.discard()
+            await save_backup_state(user_id, collection_name, run_started, full=full)
             return
         
-        backup_data = {
-            "id": f"{user_id}_{collection_name}_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}",
+        await writer.commit()
+        backup_at = run_started.isoformat()
+        await backup_storage.save_manifest({
+            "backup_id": backup_id,
             "user_id": user_id,
             "collection": collection_name,
-            "data": docs,
-            "backup_at": datetime.now(timezone.utc).isoformat(),
-            "count": len(docs)
-        }
+            "kind": kind,
+            "backup_at": backup_at,
+            "watermark": backup_at,
+            "format": "ndjson.gz",
+            "chunks": writer.chunks,
+            "deleted": deleted,
+            "count": writer.count,
+            "content_hash": content_hash
+        })
+        
+        if full:
+            # The snapshot supersedes earlier snapshots, incrementals and tombstones
+            older = [m for m in await backup_storage.list_manifests(user_id, collection_name) if m["backup_at"] < backup_at]
+            await backup_storage.delete_manifests(older)
+            await backup_storage.delete_chunks([chunk["key"] for m in older for chunk in m.get("chunks", [])])
+            await db.backup_tombstones.delete_many(
+                {"user_id": user_id, "collection": collection_name, "deleted_at": {"$lt": backup_at}}
+            )
         
-        # Upsert to Supabase
-        supabase_client.table("maya_backups").upsert(backup_data).execute()
-        logger.info(f"Backed up {len(docs)} documents from {collection_name} for user {user_id}")
+        await save_backup_state(user_id, collection_name, run_started, full=full, content_hash=content_hash)
+        logger.info(f"Backed up {writer.count} documents in {len(writer.chunks)} chunks and {len(deleted)} deletions ({kind}) from {collection_name} for user {user_id}")
     except Exception as e:
         logger.error(f"Backup failed for {collection_name}: {e}")
+        if writer:
+            try:
+                await writer.discard()
+            except Exception:
+                pass
+
+# (user_id, collection) pairs being restored; backups skip them until the restore finishes
+restoring_collections = set()
+
+async def save_backup_state(user_id: str, collection_name: str, watermark: datetime, full: bool = False,
+                            content_hash: str = None):
+    update = {"watermark": watermark.isoformat(), "updated_at": datetime.now(timezone.utc).isoformat()}
+    if full:
+        update["last_full_at"] = watermark.isoformat()
+    if content_hash:
+        update["last_full_hash" if full else "last_incremental_hash"] = content_hash
+    await db.backup_state.update_one(
+        {"user_id": user_id, "collection": collection_name},
+        {"$set": update},
+        upsert=True
+    )
 
-async def backup_user_data(user_id: str):
+async def backup_user_data(user_id: str, full: bool = False):
     """Backup all data for a user"""
-    collections = ["clients", "pets", "services", "items", "appointments", "waitlist", "recurring_templates", "settings"]
-    for collection in collections:
-        await backup_collection_to_supabase(collection, user_id)
+    for collection in BACKUP_COLLECTIONS:
+        await backup_collection(collection, user_id, full=full)
 
 def trigger_backup(user_id: str):
-    """Trigger async backup in background"""
-    if supabase_client:
-        asyncio.create_task(backup_user_data(user_id))
+    """Mark all of a user's collections for the next backup flush"""
+    for collection in BACKUP_COLLECTIONS:
+        backup_coordinator.mark_dirty(user_id, collection)
+
+class BackupCoordinator:
+    """Debounces backups per (user, collection).
+
+    Writes only mark a collection dirty; each dirty collection is flushed at
+    most once per interval, with a global cap on concurrent backups.
+    """
+
+    def __init__(self, interval_seconds: float, max_concurrency: int):
+        self.interval_seconds = interval_seconds
+        self._semaphore = None
+        self._max_concurrency = max_concurrency
+        self._dirty = set()  # (user_id, collection)
+        self._last_flush = {}  # (user_id, collection) -> loop time
+        self._timers = {}
+        self._tasks = set()
+
+    def mark_dirty(self, user_id: str, collection_name: str):
+        if not backup_storage:
+            return
+        key = (user_id, collection_name)
+        self._dirty.add(key)
+        if key in self._timers:
+            return  # Flush already scheduled
+        loop = asyncio.get_running_loop()
+        last = self._last_flush.get(key)
+        delay = 0.0 if last is None else max(0.0, last + self.interval_seconds - loop.time())
+        self._timers[key] = loop.call_later(delay, self._start_flush, key)
+
+    def _start_flush(self, key):
+        self._timers.pop(key, None)
+        task = asyncio.create_task(self._flush(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, key):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        async with self._semaphore:
+            if key not in self._dirty:
+                return
+            self._dirty.discard(key)
+            self._last_flush[key] = asyncio.get_running_loop().time()
+            await backup_collection(key[1], key[0])
+        # Marked dirty again while flushing: schedule the next flush after the interval
+        if key in self._dirty and key not in self._timers:
+            loop = asyncio.get_running_loop()
+            self._timers[key] = loop.call_later(self.interval_seconds, self._start_flush, key)
+
+    async def drain(self):
+        """Flush every dirty collection now (used on shutdown)"""
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        await asyncio.gather(*(self._flush(key) for key in list(self._dirty)), return_exceptions=True)
+
+backup_coordinator = BackupCoordinator(BACKUP_FLUSH_INTERVAL_SECONDS, BACKUP_MAX_CONCURRENCY)
+
+async def compact_backups():
+    """Write full snapshots for collections whose last snapshot is older than the compaction interval"""
+    if not backup_storage:
+        return
+    try:
+        cutoff = (datetime.now(timezone.utc) - timedelta(hours=BACKUP_COMPACTION_HOURS)).isoformat()
+        due = await db.backup_state.find(
+            {"$or": [{"last_full_at": {"$lt": cutoff}}, {"last_full_at": None}]},
+            {"_id": 0, "user_id": 1, "collection": 1}
+        ).to_list(None)
+        # Collections never written since backups started have no state row yet; snapshot them too
+        user_ids = [user["id"] for user in await db.users.find({}, {"_id": 0, "id": 1}).to_list(None)]
+        for collection in BACKUP_COLLECTIONS:
+            tracked = set(await db.backup_state.distinct("user_id", {"collection": collection}))
+            due += [{"user_id": user_id, "collection": collection} for user_id in user_ids if user_id not in tracked]
+        for state in due:
+            await backup_collection(state["collection"], state["user_id"], full=True)
+        if due:
+            logger.info(f"Compacted {len(due)} collection backups")
+    except Exception as e:
+        logger.error(f"Error compacting backups: {e}")
+
+# ==================== RESTORE FUNCTIONS ====================
+
+class BackupIntegrityError(Exception):
+    """A backup chunk does not match its manifest"""
+
+def backup_doc_digest(doc: dict) -> int:
+    """Order-independent hash contribution of one document (digests are summed modulo 2**256)"""
+    line = json.dumps(doc, sort_keys=True, default=str).encode()
+    return int.from_bytes(hashlib.sha256(line).digest(), "big")
+
+def restore_chain(manifests: List[dict]) -> List[dict]:
+    """The latest full snapshot followed by the incrementals written after it"""
+    manifests = [m for m in manifests if not m.get("legacy")]
+    fulls = [i for i, m in enumerate(manifests) if m["kind"] == "full"]
+    return manifests[fulls[-1]:] if fulls else []
+
+async def read_backup_chunk(chunk: dict, user_id: str) -> List[dict]:
+    """Download a chunk, check it against the manifest and decode its documents"""
+    data = await backup_storage.get_chunk(chunk["key"])
+    if hashlib.sha256(data).hexdigest() != chunk["sha256"]:
+        raise BackupIntegrityError(f"Checksum mismatch for {chunk['key']}")
+    text = await asyncio.to_thread(zlib.decompress, data, 31)
+    docs = [json.loads(line) for line in text.splitlines() if line]
+    if len(docs) != chunk["count"] or any(doc.get("user_id") != user_id for doc in docs):
+        raise BackupIntegrityError(f"Unexpected contents in {chunk['key']}")
+    return docs
+
+async def insert_restored_docs(collection_name: str, docs: List[dict]) -> int:
+    """Bulk insert documents, replacing in order any that already exist. Returns the number replaced."""
+    if not docs:
+        return 0
+    try:
+        await db[collection_name].insert_many(docs, ordered=False)
+        return 0
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != 11000 for err in errors):
+            raise
+        replaces = []
+        for err in errors:
+            doc = {k: v for k, v in docs[err["index"]].items() if k != "_id"}
+            replaces.append(ReplaceOne({"user_id": doc["user_id"], "id": doc["id"]}, doc, upsert=True))
+        await db[collection_name].bulk_write(replaces, ordered=True)
+        return len(replaces)
+
+async def restore_collection(user_id: str, collection_name: str, prune: bool = False) -> dict:
+    """Restore one collection to the state of its latest backup and verify the result.
+
+    Backups trail writes, so documents missing from the backup are usually just
+    newer than it: they are reported as extra_ids and only deleted with prune.
+    """
+    started = time.perf_counter()
+    chain = restore_chain(await backup_storage.list_manifests(user_id, collection_name))
+    if not chain:
+        return {"collection": collection_name, "status": "no_backup"}
+    snapshot, incrementals = chain[0], chain[1:]
+    
+    # Incrementals override the snapshot: the latest version wins and deletions drop the document
+    overrides = {}
+    removed = set()
+    for manifest in incrementals:
+        for chunk in manifest["chunks"]:
+            for doc in await read_backup_chunk(chunk, user_id):
+                overrides[doc["id"]] = doc
+                removed.discard(doc["id"])
+        for doc_id in manifest.get("deleted", []):
+            overrides.pop(doc_id, None)
+            removed.add(doc_id)
+    
+    expected = {}  # id -> digest
+    replaced = 0
+    semaphore = asyncio.Semaphore(RESTORE_CONCURRENCY)
+    
+    async def restore_batch(docs: List[dict]):
+        nonlocal replaced
+        for doc in docs:
+            # Digest before inserting: insert_many adds _id to the documents
+            expected[doc["id"]] = backup_doc_digest(doc)
+        replaced += await insert_restored_docs(collection_name, docs)
+    
+    async def restore_chunk(chunk: dict):
+        async with semaphore:
+            docs = await read_backup_chunk(chunk, user_id)
+            await restore_batch([doc for doc in docs if doc["id"] not in overrides and doc["id"] not in removed])
+    
+    await asyncio.gather(*(restore_chunk(chunk) for chunk in snapshot["chunks"]))
+    override_docs = list(overrides.values())
+    for i in range(0, len(override_docs), BACKUP_CHUNK_DOCS):
+        await restore_batch(override_docs[i:i + BACKUP_CHUNK_DOCS])
+    
+    # Documents created after the backup are not part of the restored state. Legacy
+    # documents without an id cannot be matched against the backup and are left alone.
+    current = await db[collection_name].find({"user_id": user_id}, {"_id": 0, "id": 1}).to_list(None)
+    extra_ids = [doc["id"] for doc in current if doc.get("id") and doc["id"] not in expected]
+    if extra_ids and prune:
+        await db[collection_name].delete_many({"user_id": user_id, "id": {"$in": extra_ids}})
+    
+    # Verify the documents the backup covers
+    count = 0
+    digest = 0
+    async for doc in db[collection_name].find({"user_id": user_id, "id": {"$in": list(expected)}}, {"_id": 0}):
+        count += 1
+        digest = (digest + backup_doc_digest(doc)) % 2**256
+    verified = count == len(expected) and digest == sum(expected.values()) % 2**256
+    return {
+        "collection": collection_name,
+        "status": "restored" if verified else "verification_failed",
+        "backup_at": chain[-1]["backup_at"],
+        "documents": count,
+        "expected": len(expected),
+        "replaced": replaced,
+        "removed": len(extra_ids) if prune else 0,
+        "extra_ids": [] if prune else extra_ids,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+    }
+
+async def restore_user_data(user_id: str, collections: List[str], prune: bool = False) -> dict:
+    """Restore several collections in parallel; backups of them are paused meanwhile"""
+    started = time.perf_counter()
+    keys = {(user_id, collection) for collection in collections}
+    restoring_collections.update(keys)
+    try:
+        results = await asyncio.gather(
+            *(restore_collection(user_id, collection, prune) for collection in collections),
+            return_exceptions=True
+        )
+    finally:
+        restoring_collections.difference_update(keys)
+    
+    report = []
+    for collection, result in zip(collections, results):
+        if isinstance(result, Exception):
+            logger.error(f"Restore failed for {collection} of user {user_id}: {result}")
+            result = {"collection": collection, "status": "failed", "error": str(result)}
+        report.append(result)
+    
+    # The restored data no longer matches the incremental chain, so the next backup is a full snapshot
+    await db.backup_state.update_many(
+        {"user_id": user_id, "collection": {"$in": collections}},
+        {"$unset": {"last_full_at": ""}}
+    )
+    for collection in collections:
+        backup_coordinator.mark_dirty(user_id, collection)
+    
+    ok = all(r["status"] in ("restored", "no_backup") for r in report)
+    logger.info(f"Restore for user {user_id} finished in {time.perf_counter() - started:.2f}s ({'ok' if ok else 'with errors'})")
+    return {
+        "status": "completed" if ok else "failed",
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        "collections": report
+    }
+
+async def ensure_backup_indexes():
+    """Unique (user_id, id) indexes so restores detect documents that already exist"""
+    for collection in BACKUP_COLLECTIONS:
+        try:
+            await db[collection].create_index([("user_id", 1), ("id", 1)], unique=True, name="user_id_id_unique")
+        except Exception as e:
+            logger.warning(f"Could not create unique index on {collection}: {e}")
+
+# ==================== DATA EXPORT ====================
+
+# (collection, file name, model whose fields become the CSV columns)
+EXPORT_COLLECTIONS = [
+    ("clients", "clients", Client),
+    ("pets", "pets", Pet),
+    ("services", "services", Service),
+    ("items", "items", Item),
+    ("appointments", "appointments", Appointment),
+    ("invoices", "invoices", Invoice),
+    ("waitlist", "waitlist", Waitlist),
+    ("sms_messages", "sms_log", SMSMessage),
+]
+EXPORT_FLUSH_BYTES = 64 * 1024
+
+class ZipStreamBuffer(io.RawIOBase):
+    """Non-seekable sink for zipfile whose written bytes are drained into the response"""
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+def export_csv_columns(model) -> List[str]:
+    return [name for name in model.model_fields if name != "user_id"] + ["updated_at"]
+
+def export_csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return value
+
+async def stream_account_export(user_id: str, fmt: str):
+    """Yield a zip archive with one NDJSON or CSV file per collection.
+
+    Documents are read from cursors and deflated as they arrive, so memory
+    stays flat regardless of how much data the account holds. Entries use
+    data descriptors (and zip64) because the archive is never seeked.
+    """
+    buffer = ZipStreamBuffer()
+    line = io.StringIO()
+    csv_writer = csv.writer(line)
+    
+    def csv_row(values) -> bytes:
+        line.seek(0)
+        line.truncate()
+        csv_writer.writerow(values)
+        return line.getvalue().encode()
+    
+    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for collection_name, file_name, model in EXPORT_COLLECTIONS:
+            columns = export_csv_columns(model)
+            with archive.open(f"{file_name}.{fmt}", mode="w", force_zip64=True) as entry:
+                if fmt == "csv":
+                    entry.write(csv_row(columns))
+                cursor = db[collection_name].find({"user_id": user_id}, {"_id": 0}).batch_size(500)
+                async for doc in cursor:
+                    if fmt == "csv":
+                        entry.write(csv_row([export_csv_value(doc.get(column)) for column in columns]))
+                    else:
+                        entry.write((json.dumps(doc, default=str) + "\n").encode())
+                    if buffer.size >= EXPORT_FLUSH_BYTES:
+                        yield buffer.drain()
+            if buffer.size:
+                yield buffer.drain()
+    yield buffer.drain()
+
+@api_router.get("/export")
+async def export_account(fmt: str = Query("ndjson", alias="format"), user_id: str = Depends(get_current_user)):
+    """Download all account data as a zip of NDJSON (default) or CSV files"""
+    if fmt not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Format must be ndjson or csv")
+    
+    filename = f"maya-groom-pro-export-{datetime.now(timezone.utc).strftime('%Y%m%d')}.zip"
+    return StreamingResponse(
+        stream_account_export(user_id, fmt),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 # ==================== ROOT ROUTE ====================
 
@@ -2383,26 +4657,362 @@ async def root():
 @api_router.post("/backup")
 async def trigger_manual_backup(background_tasks: BackgroundTasks, user_id: str = Depends(get_current_user)):
     """Manually trigger a backup of all user data"""
-    if not supabase_client:
+    if not backup_storage:
         raise HTTPException(status_code=503, detail="Backup service not configured")
     
-    background_tasks.add_task(backup_user_data, user_id)
+    background_tasks.add_task(backup_user_data, user_id, True)
     return {"message": "Backup started", "status": "processing"}
 
 @api_router.get("/backup/status")
 async def get_backup_status(user_id: str = Depends(get_current_user)):
     """Get the latest backup status"""
-    if not supabase_client:
+    if not backup_storage:
         return {"status": "not_configured"}
     
     try:
-        result = supabase_client.table("maya_backups").select("*").eq("user_id", user_id).order("backup_at", desc=True).limit(1).execute()
-        if result.data:
-            return {"status": "active", "last_backup": result.data[0].get("backup_at")}
+        latest = await backup_storage.latest_manifest(user_id)
+        if latest:
+            return {"status": "active", "last_backup": latest["backup_at"], "kind": latest.get("kind", "full")}
         return {"status": "no_backups"}
+    except asyncio.TimeoutError:
+        return {"status": "error", "message": "Backup service timed out"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+@api_router.post("/backup/restore")
+async def restore_backup(request: RestoreRequest, user_id: str = Depends(get_current_user)):
+    """Restore collections from the latest backup, verifying counts and content hashes"""
+    if not backup_storage:
+        raise HTTPException(status_code=503, detail="Backup service not configured")
+    
+    collections = request.collections or BACKUP_COLLECTIONS
+    unknown = [c for c in collections if c not in BACKUP_COLLECTIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown collections: {', '.join(unknown)}")
+    if any((user_id, c) in restoring_collections for c in collections):
+        raise HTTPException(status_code=409, detail="A restore is already in progress")
+    
+    return await restore_user_data(user_id, list(dict.fromkeys(collections)), request.prune)
+
+@api_router.get("/backup/metrics")
+async def get_backup_metrics(user_id: str = Depends(require_admin)):
+    """Latency and error counters for backup storage calls in this worker"""
+    metrics = getattr(backup_storage, "metrics", None)
+    return {"backup_storage": metrics.snapshot() if metrics else {}}
+
+# ==================== GOOGLE CALENDAR GATEWAY ====================
+
+class CalendarService:
+    """A built Calendar API resource and the lock guarding its shared HTTP connection"""
+
+    def __init__(self, resource, credential_key: str):
+        self.resource = resource
+        self.credential_key = credential_key
+        # httplib2 connections are not thread-safe, so calls on one service are serialized
+        self.lock = threading.Lock()
+
+def google_credential_key(credentials) -> str:
+    """Identity of a credential set; changes whenever the access token is refreshed"""
+    raw = f"{credentials.refresh_token or ''}:{credentials.token or ''}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+class GoogleCalendarGateway:
+    """Single entry point for blocking Google API calls.
+
+    googleapiclient and google-auth do synchronous HTTP, so every call is run
+    on a dedicated bounded thread pool with a timeout, keeping the event loop
+    free for unrelated requests. Per-operation latency is recorded in metrics.
+    Built Calendar services are cached per user so discovery parsing and the
+    HTTP connection are reused across calls.
+    """
+
+    def __init__(self, max_workers: int, timeout: float, cache_size: int):
+        self.timeout = timeout
+        self.metrics = LatencyMetrics()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="google-io")
+        self._services = OrderedDict()  # user_id -> CalendarService, in LRU order
+        self._cache_size = cache_size
+
+    def _build_service(self, credentials, credential_key: str) -> CalendarService:
+        http = AuthorizedHttp(credentials, http=httplib2.Http(timeout=self.timeout))
+        resource = build('calendar', 'v3', http=http, static_discovery=True, cache_discovery=False)
+        return CalendarService(resource, credential_key)
+
+    async def get_service(self, user_id: str, credentials) -> CalendarService:
+        """Return the cached Calendar service for a user, rebuilding it if the credentials changed"""
+        credential_key = google_credential_key(credentials)
+        cached = self._services.get(user_id)
+        if cached and cached.credential_key == credential_key:
+            self._services.move_to_end(user_id)
+            return cached
+        
+        service = await self.run("service.build", self._build_service, credentials, credential_key)
+        self._services[user_id] = service
+        self._services.move_to_end(user_id)
+        while len(self._services) > self._cache_size:
+            self._services.popitem(last=False)
+        return service
+
+    def evict_service(self, user_id: str):
+        """Drop a user's cached service (token refresh or disconnect)"""
+        self._services.pop(user_id, None)
+
+    async def run(self, op: str, fn, *args, **kwargs):
+        """Run a blocking callable on the Google I/O pool"""
+        return await run_blocking(self._executor, self.timeout, self.metrics, op, fn, *args, **kwargs)
+
+    async def execute(self, op: str, service: CalendarService, request):
+        """Execute a prepared googleapiclient request on the service's shared connection"""
+        def locked_execute():
+            with service.lock:
+                return request.execute()
+        return await self.run(op, locked_execute)
+
+    async def refresh_credentials(self, credentials):
+        from google.auth.transport.requests import Request
+        await self.run("credentials.refresh", credentials.refresh, Request())
+
+    async def insert_event(self, service: CalendarService, event: dict) -> dict:
+        return await self.execute(
+            "events.insert", service,
+            service.resource.events().insert(calendarId='primary', body=event)
+        )
+
+    async def update_event(self, service: CalendarService, google_event_id: str, event: dict) -> dict:
+        return await self.execute(
+            "events.update", service,
+            service.resource.events().update(calendarId='primary', eventId=google_event_id, body=event)
+        )
+
+    async def delete_event(self, service: CalendarService, google_event_id: str):
+        return await self.execute(
+            "events.delete", service,
+            service.resource.events().delete(calendarId='primary', eventId=google_event_id)
+        )
+
+    async def delete_events_batch(self, service: CalendarService, google_event_ids: list) -> list:
+        """Delete events using batch HTTP requests; returns IDs that failed (already-gone events count as deleted)"""
+        failed = []
+
+        def on_response(request_id, response, exception):
+            if exception is not None:
+                status_code = getattr(getattr(exception, "resp", None), "status", None)
+                if status_code not in (404, 410):
+                    failed.append(request_id)
+
+        for start in range(0, len(google_event_ids), GOOGLE_BATCH_SIZE):
+            batch = service.resource.new_batch_http_request(callback=on_response)
+            for google_event_id in google_event_ids[start:start + GOOGLE_BATCH_SIZE]:
+                batch.add(
+                    service.resource.events().delete(calendarId='primary', eventId=google_event_id),
+                    request_id=google_event_id
+                )
+            await self.execute("events.delete.batch", service, batch)
+        return failed
+
+    async def list_events(self, service: CalendarService, **params) -> dict:
+        return await self.execute(
+            "events.list", service,
+            service.resource.events().list(calendarId='primary', **params)
+        )
+
+    async def watch_events(self, service: CalendarService, channel: dict) -> dict:
+        return await self.execute(
+            "events.watch", service,
+            service.resource.events().watch(calendarId='primary', body=channel)
+        )
+
+    async def stop_channel(self, service: CalendarService, channel_id: str, resource_id: str):
+        return await self.execute(
+            "channels.stop", service,
+            service.resource.channels().stop(body={"id": channel_id, "resourceId": resource_id})
+        )
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+google_gateway = GoogleCalendarGateway(GOOGLE_IO_MAX_WORKERS, GOOGLE_IO_TIMEOUT_SECONDS, GOOGLE_SERVICE_CACHE_SIZE)
+
+def google_tokens_to_credentials(tokens: dict) -> Credentials:
+    """Build Credentials from the google_tokens stored on a user"""
+    expiry = None
+    if tokens.get("expiry"):
+        # google-auth compares expiry against naive UTC datetimes
+        expiry = datetime.fromisoformat(tokens["expiry"].replace('Z', '+00:00')).astimezone(timezone.utc).replace(tzinfo=None)
+    return Credentials(
+        token=tokens.get("access_token"),
+        refresh_token=tokens.get("refresh_token"),
+        token_uri="https://oauth2.googleapis.com/token",
+        client_id=GOOGLE_CLIENT_ID,
+        client_secret=GOOGLE_CLIENT_SECRET,
+        scopes=GOOGLE_SCOPES,
+        expiry=expiry
+    )
+
+def google_expiry_iso(credentials) -> Optional[str]:
+    if not credentials.expiry:
+        return None
+    return credentials.expiry.replace(tzinfo=timezone.utc).isoformat()
+
+class GoogleCredentialCache:
+    """Live Google credentials per user, kept in memory for a TTL.
+
+    Tokens close to expiry are refreshed in a background task, so sync paths
+    only wait for a refresh when the token has already expired. Refreshes are
+    serialized per user and refreshed tokens are written back to Mongo
+    without blocking the caller.
+    """
+
+    def __init__(self, ttl_seconds: int, refresh_margin_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin = timedelta(seconds=refresh_margin_seconds)
+        self._entries = {}  # user_id -> (credentials, loaded_at monotonic)
+        self._locks = {}  # user_id -> asyncio.Lock
+        self._refreshing = set()
+        self._background_tasks = set()
+
+    def _lock(self, user_id: str) -> asyncio.Lock:
+        if user_id not in self._locks:
+            self._locks[user_id] = asyncio.Lock()
+        return self._locks[user_id]
+
+    def _cached(self, user_id: str):
+        entry = self._entries.get(user_id)
+        if entry and time.monotonic() - entry[1] < self.ttl_seconds:
+            return entry[0]
+        return None
+
+    def _expiring_soon(self, credentials) -> bool:
+        if not credentials.expiry:
+            return False
+        return credentials.expiry - self.refresh_margin <= datetime.now(timezone.utc).replace(tzinfo=None)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def get(self, user_id: str):
+        """Return usable credentials for a user, or None if not connected"""
+        credentials = self._cached(user_id)
+        if credentials and not credentials.expired:
+            if self._expiring_soon(credentials) and user_id not in self._refreshing:
+                self._spawn(self._background_refresh(user_id, credentials))
+            return credentials
+        
+        async with self._lock(user_id):
+            credentials = self._cached(user_id)
+            if not credentials:
+                credentials = await self._load(user_id)
+                if not credentials:
+                    return None
+            if credentials.expired and credentials.refresh_token:
+                if not await self._refresh(user_id, credentials):
+                    return None
+            return credentials
+
+    async def _load(self, user_id: str):
+        user = await db.users.find_one({"id": user_id}, {"_id": 0, "google_tokens": 1})
+        if not user or not user.get("google_tokens"):
+            return None
+        credentials = google_tokens_to_credentials(user["google_tokens"])
+        self._entries[user_id] = (credentials, time.monotonic())
+        return credentials
+
+    async def _refresh(self, user_id: str, credentials) -> bool:
+        """Refresh a token in place; caller must hold the user's lock"""
+        self._refreshing.add(user_id)
+        try:
+            await google_gateway.refresh_credentials(credentials)
+        except Exception as e:
+            logger.error(f"Failed to refresh Google token: {e}")
+            self.invalidate(user_id)
+            return False
+        finally:
+            self._refreshing.discard(user_id)
+        
+        google_gateway.evict_service(user_id)
+        self._entries[user_id] = (credentials, time.monotonic())
+        self._spawn(self._persist(user_id, credentials))
+        return True
+
+    async def _background_refresh(self, user_id: str, credentials):
+        async with self._lock(user_id):
+            # Another caller may have refreshed or replaced the credentials meanwhile
+            if self._cached(user_id) is credentials and self._expiring_soon(credentials):
+                await self._refresh(user_id, credentials)
+
+    async def _persist(self, user_id: str, credentials):
+        try:
+            await db.users.update_one(
+                {"id": user_id},
+                {"$set": {
+                    "google_tokens.access_token": credentials.token,
+                    "google_tokens.expiry": google_expiry_iso(credentials)
+                }}
+            )
+        except Exception as e:
+            logger.error(f"Failed to save refreshed Google token for user {user_id}: {e}")
+
+    def invalidate(self, user_id: str):
+        self._entries.pop(user_id, None)
+        google_gateway.evict_service(user_id)
+
+google_credentials_cache = GoogleCredentialCache(GOOGLE_CREDENTIAL_TTL_SECONDS, GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS)
+
+class GoogleSyncQueue:
+    """Per-user debounce queue for pushing appointments to Google Calendar.
+
+    Appointment IDs enqueued while a user's timer is pending are coalesced
+    into one auto_sync_appointments_to_google call. Each new enqueue restarts
+    the debounce timer, up to max_delay after the first pending change.
+    """
+
+    def __init__(self, debounce_seconds: float, max_delay_seconds: float):
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self._pending = {}  # user_id -> set of appointment IDs
+        self._first_enqueued = {}  # user_id -> loop time of the oldest pending change
+        self._timers = {}  # user_id -> asyncio.TimerHandle
+        self._locks = {}  # user_id -> asyncio.Lock
+        self._tasks = set()
+
+    def enqueue(self, user_id: str, appointment_ids: list):
+        loop = asyncio.get_running_loop()
+        self._pending.setdefault(user_id, set()).update(appointment_ids)
+        first = self._first_enqueued.setdefault(user_id, loop.time())
+        
+        timer = self._timers.pop(user_id, None)
+        if timer:
+            timer.cancel()
+        delay = min(self.debounce_seconds, max(0.0, first + self.max_delay_seconds - loop.time()))
+        self._timers[user_id] = loop.call_later(delay, self._start_flush, user_id)
+
+    def _start_flush(self, user_id: str):
+        self._timers.pop(user_id, None)
+        task = asyncio.create_task(self.flush(user_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self, user_id: str):
+        if user_id not in self._locks:
+            self._locks[user_id] = asyncio.Lock()
+        # One flush per user at a time; changes queued meanwhile go in the next flush
+        async with self._locks[user_id]:
+            appointment_ids = self._pending.pop(user_id, set())
+            self._first_enqueued.pop(user_id, None)
+            if appointment_ids:
+                await auto_sync_appointments_to_google(user_id, list(appointment_ids))
+
+    async def drain(self):
+        """Flush everything pending immediately (used on shutdown)"""
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        await asyncio.gather(*(self.flush(user_id) for user_id in list(self._pending)), return_exceptions=True)
+
+google_sync_queue = GoogleSyncQueue(GOOGLE_SYNC_DEBOUNCE_SECONDS, GOOGLE_SYNC_MAX_DELAY_SECONDS)
+
 # ==================== GOOGLE CALENDAR ROUTES ====================
 
 def get_google_flow():
@@ -2425,41 +5035,49 @@ def get_google_flow():
     return flow
 
 async def get_user_google_credentials(user_id: str):
-    """Get stored Google credentials for a user"""
-    user = await db.users.find_one({"id": user_id}, {"_id": 0, "google_tokens": 1})
-    if not user or not user.get("google_tokens"):
-        return None
-    
-    tokens = user["google_tokens"]
-    credentials = Credentials(
-        token=tokens.get("access_token"),
-        refresh_token=tokens.get("refresh_token"),
-        token_uri="https://oauth2.googleapis.com/token",
-        client_id=GOOGLE_CLIENT_ID,
-        client_secret=GOOGLE_CLIENT_SECRET,
-        scopes=GOOGLE_SCOPES
-    )
-    
-    # Refresh if expired
-    if credentials.expired and credentials.refresh_token:
-        try:
-            from google.auth.transport.requests import Request
-            credentials.refresh(Request())
-            # Save refreshed tokens
-            await db.users.update_one(
-                {"id": user_id},
-                {"$set": {"google_tokens.access_token": credentials.token}}
-            )
-        except Exception as e:
-            logger.error(f"Failed to refresh Google token: {e}")
-            return None
-    
-    return credentials
+    """Get Google credentials for a user from the in-memory cache"""
+    return await google_credentials_cache.get(user_id)
+
+APPOINTMENT_TIMEZONE = 'Australia/Sydney'
+
+def to_utc_datetime(value) -> datetime:
+    """Parse a stored appointment datetime (ISO string or datetime) as an aware UTC datetime"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def recurrence_interval_days(appointment: dict) -> int:
+    """Days between occurrences, matching how create_appointment generates a series"""
+    value = appointment.get("recurring_value") or 1
+    return {"day": value, "week": value * 7, "month": value * 30, "year": value * 365}.get(appointment.get("recurring_unit"), 7)
+
+def build_recurrence_rule(appointment: dict, count: int) -> str:
+    """RRULE for a series; month/year series are fixed day intervals in this app, not calendar months"""
+    if appointment.get("recurring_unit") == "week":
+        return f"RRULE:FREQ=WEEKLY;INTERVAL={appointment.get('recurring_value') or 1};COUNT={count}"
+    return f"RRULE:FREQ=DAILY;INTERVAL={recurrence_interval_days(appointment)};COUNT={count}"
+
+def google_instance_id(recurring_event_id: str, date_time) -> str:
+    """Google's ID for one instance of a recurring event, derived from its original start"""
+    return f"{recurring_event_id}_{to_utc_datetime(date_time).strftime('%Y%m%dT%H%M%SZ')}"
+
+def is_complete_series(series: list) -> bool:
+    """True if the occurrences (sorted by date) fall on every step of the RRULE with no gaps"""
+    local_tz = pytz.timezone(APPOINTMENT_TIMEZONE)
+    interval = recurrence_interval_days(series[0])
+    first_local = to_utc_datetime(series[0]["date_time"]).astimezone(local_tz)
+    for index, appt in enumerate(series):
+        local = to_utc_datetime(appt["date_time"]).astimezone(local_tz)
+        if (local.date() - first_local.date()).days != index * interval:
+            return False
+        if (local.hour, local.minute) != (first_local.hour, first_local.minute):
+            return False
+    return True
 
 def build_calendar_event(appointment: dict) -> dict:
     """Build a Google Calendar event from an appointment"""
-    import pytz
-    
     # Build description with client details
     pets_info = []
     for pet in appointment.get("pets", []):
@@ -2564,7 +5182,8 @@ async def google_callback(code: str = Query(...), state: str = Query(None)):
             "access_token": credentials.token,
             "refresh_token": credentials.refresh_token,
             "token_uri": credentials.token_uri,
-            "scopes": list(credentials.scopes) if credentials.scopes else GOOGLE_SCOPES
+            "scopes": list(credentials.scopes) if credentials.scopes else GOOGLE_SCOPES,
+            "expiry": google_expiry_iso(credentials)
         }
         
         await db.users.update_one(
@@ -2574,12 +5193,19 @@ async def google_callback(code: str = Query(...), state: str = Query(None)):
                     "google_tokens": tokens,
                     "google_calendar_connected": True
                 },
-                "$unset": {"google_oauth_state": ""}
+                "$unset": {"google_oauth_state": "", "google_sync_token": ""}
             }
         )
         
+        google_credentials_cache.invalidate(user["id"])
         logger.info(f"Google Calendar connected for user {user['id']}")
         
+        if GOOGLE_WEBHOOK_URL:
+            try:
+                await start_google_watch(user["id"])
+            except Exception as e:
+                logger.error(f"Failed to start Google push notifications for user {user['id']}: {e}")
+        
         # Redirect back to settings with success
         return RedirectResponse(url="/settings?google_connected=true")
     except Exception as e:
@@ -2589,19 +5215,21 @@ async def google_callback(code: str = Query(...), state: str = Query(None)):
 @api_router.post("/auth/google/disconnect")
 async def google_disconnect(user_id: str = Depends(get_current_user)):
     """Disconnect Google Calendar"""
+    await stop_google_watches(user_id)
+    google_credentials_cache.invalidate(user_id)
     await db.users.update_one(
         {"id": user_id},
         {
-            "$unset": {"google_tokens": "", "google_oauth_state": ""},
+            "$unset": {"google_tokens": "", "google_oauth_state": "", "google_sync_token": ""},
             "$set": {"google_calendar_connected": False}
         }
     )
     return {"message": "Google Calendar disconnected"}
 
 @api_router.get("/auth/google/status")
-async def google_status(user_id: str = Depends(get_current_user)):
+async def google_status(tenant: TenantContext = Depends(get_tenant)):
     """Check Google Calendar connection status"""
-    user = await db.users.find_one({"id": user_id}, {"_id": 0, "google_calendar_connected": 1, "google_tokens": 1})
+    user = await tenant.user()
     
     connected = user.get("google_calendar_connected", False) if user else False
     has_tokens = bool(user.get("google_tokens")) if user else False
@@ -2633,7 +5261,7 @@ async def sync_appointment_to_google(
         appointment["client_address"] = client.get("address", "")
     
     try:
-        service = build('calendar', 'v3', credentials=credentials)
+        service = await google_gateway.get_service(user_id, credentials)
         event = build_calendar_event(appointment)
         
         # Check if event already exists
@@ -2641,95 +5269,437 @@ async def sync_appointment_to_google(
         
         if google_event_id:
             # Update existing event
-            result = service.events().update(
-                calendarId='primary',
-                eventId=google_event_id,
-                body=event
-            ).execute()
+            result = await google_gateway.update_event(service, google_event_id, event)
         else:
             # Create new event
-            result = service.events().insert(
-                calendarId='primary',
-                body=event
-            ).execute()
+            result = await google_gateway.insert_event(service, event)
             
             # Save Google event ID
             await db.appointments.update_one(
                 {"id": appointment_id},
-                {"$set": {"google_event_id": result.get("id")}}
+                {"$set": {"google_event_id": result.get("id"), "updated_at": datetime.now(timezone.utc).isoformat()}}
             )
+            backup_coordinator.mark_dirty(user_id, "appointments")
         
         return {"message": "Synced to Google Calendar", "google_event_id": result.get("id")}
     except HttpError as e:
         logger.error(f"Google Calendar API error: {e}")
         raise HTTPException(status_code=500, detail=f"Google Calendar error: {str(e)}")
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Google Calendar request timed out")
+
+async def attach_client_details(appointments: list):
+    """Add client phone/address to appointments for the Google event description"""
+    client_ids = list(set(a.get("client_id") for a in appointments if a.get("client_id")))
+    if not client_ids:
+        return
+    clients = await db.clients.find(
+        {"id": {"$in": client_ids}}, {"_id": 0, "id": 1, "phone": 1, "address": 1}
+    ).to_list(None)
+    client_map = {c["id"]: c for c in clients}
+    for appointment in appointments:
+        client = client_map.get(appointment.get("client_id"), {})
+        appointment["client_phone"] = client.get("phone", "")
+        appointment["client_address"] = client.get("address", "")
+
+async def run_sync_all_job(job_id: str):
+    """Push a user's future appointments to Google in keyset-ordered chunks.
+
+    Progress is checkpointed on the job after every chunk, so a job picked up
+    again after a crash or restart continues from the last synced appointment.
+    Each claim gets its own lease token; every write to the job is guarded by
+    it, and the lease is renewed between appointments, so a run that lost its
+    lease stops before pushing anything else. Stale leases are reclaimed by
+    resume_sync_jobs.
+    """
+    job = await claim_sync_job(job_id)
+    if not job:
+        return  # Finished, or another worker holds the lease
+    
+    user_id = job["user_id"]
+    lease = {"id": job_id, "lease_token": job["lease_token"]}
+    renewed_at = time.monotonic()
+    try:
+        credentials = await get_user_google_credentials(user_id)
+        if not credentials:
+            raise RuntimeError("Google Calendar not connected")
+        service = await google_gateway.get_service(user_id, credentials)
+        
+        checkpoint = job.get("checkpoint")
+        while True:
+            query = {"user_id": user_id, "date_time": {"$gte": job["sync_from"]}, "status": {"$ne": "cancelled"}}
+            if checkpoint:
+                query["$or"] = [
+                    {"date_time": {"$gt": checkpoint["date_time"]}},
+                    {"date_time": checkpoint["date_time"], "id": {"$gt": checkpoint["id"]}}
+                ]
+            chunk = await db.appointments.find(query, {"_id": 0}).sort(
+                [("date_time", 1), ("id", 1)]
+            ).limit(SYNC_JOB_CHUNK_SIZE).to_list(SYNC_JOB_CHUNK_SIZE)
+            if not chunk:
+                break
+            
+            await attach_client_details(chunk)
+            synced = errors = 0
+            for appointment in chunk:
+                # A single push is bounded by the Google timeout, far below the lease,
+                # so renewing once a third of the lease has passed keeps it alive
+                if time.monotonic() - renewed_at > SYNC_JOB_LEASE_SECONDS / 3:
+                    if not await renew_sync_job_lease(lease):
+                        logger.warning(f"Lost lease on sync-all job {job_id}, stopping")
+                        return
+                    renewed_at = time.monotonic()
+                try:
+                    await push_appointment_to_google(service, appointment)
+                    synced += 1
+                except Exception as e:
+                    logger.error(f"Failed to sync appointment {appointment.get('id')}: {e}")
+                    errors += 1
+            
+            checkpoint = {"date_time": chunk[-1]["date_time"], "id": chunk[-1]["id"]}
+            result = await db.sync_jobs.update_one(
+                lease,
+                {
+                    "$set": {
+                        "checkpoint": checkpoint,
+                        "lease_until": (datetime.now(timezone.utc) + timedelta(seconds=SYNC_JOB_LEASE_SECONDS)).isoformat(),
+                        "updated_at": datetime.now(timezone.utc).isoformat()
+                    },
+                    "$inc": {"synced": synced, "errors": errors}
+                }
+            )
+            if result.matched_count == 0:
+                logger.warning(f"Lost lease on sync-all job {job_id}, stopping")
+                return
+            renewed_at = time.monotonic()
+        
+        await db.sync_jobs.update_one(
+            lease,
+            {"$set": {"status": "completed", "lease_until": None, "lease_token": None,
+                      "finished_at": datetime.now(timezone.utc).isoformat(),
+                      "updated_at": datetime.now(timezone.utc).isoformat()}}
+        )
+        logger.info(f"Sync-all job {job_id} completed for user {user_id}")
+    except Exception as e:
+        logger.error(f"Sync-all job {job_id} failed: {e}")
+        # Scoped to our lease: a run that lost it must not fail the job another worker is running
+        await db.sync_jobs.update_one(
+            lease,
+            {"$set": {"status": "failed", "error": str(e), "lease_until": None, "lease_token": None,
+                      "updated_at": datetime.now(timezone.utc).isoformat()}}
+        )
+
+async def renew_sync_job_lease(lease: dict) -> bool:
+    """Extend a held lease; False if another claim has taken the job since"""
+    now = datetime.now(timezone.utc)
+    result = await db.sync_jobs.update_one(
+        lease,
+        {"$set": {"lease_until": (now + timedelta(seconds=SYNC_JOB_LEASE_SECONDS)).isoformat(), "updated_at": now.isoformat()}}
+    )
+    return result.matched_count == 1
+
+async def claim_sync_job(job_id: str = None) -> Optional[dict]:
+    """Atomically take the lease on a queued job or one whose lease has expired"""
+    now = datetime.now(timezone.utc)
+    query = {
+        "status": {"$in": ["queued", "running"]},
+        "$or": [{"lease_until": None}, {"lease_until": {"$lt": now.isoformat()}}]
+    }
+    if job_id:
+        query["id"] = job_id
+    return await db.sync_jobs.find_one_and_update(
+        query,
+        {"$set": {
+            "status": "running",
+            "worker_id": WORKER_ID,
+            "lease_token": str(uuid.uuid4()),
+            "lease_until": (now + timedelta(seconds=SYNC_JOB_LEASE_SECONDS)).isoformat(),
+            "updated_at": now.isoformat()
+        }},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+
+_sync_job_tasks = set()
+
+async def resume_sync_jobs():
+    """Restart queued jobs and jobs whose worker died (startup and scheduled job)"""
+    try:
+        stale = await db.sync_jobs.find(
+            {
+                "status": {"$in": ["queued", "running"]},
+                "$or": [{"lease_until": None}, {"lease_until": {"$lt": datetime.now(timezone.utc).isoformat()}}]
+            },
+            {"_id": 0, "id": 1}
+        ).to_list(None)
+        for job in stale:
+            task = asyncio.create_task(run_sync_all_job(job["id"]))
+            _sync_job_tasks.add(task)
+            task.add_done_callback(_sync_job_tasks.discard)
+    except Exception as e:
+        logger.error(f"Error resuming sync jobs: {e}")
 
 @api_router.post("/calendar/sync-all")
 async def sync_all_appointments_to_google(
     background_tasks: BackgroundTasks,
     user_id: str = Depends(get_current_user)
 ):
-    """Sync all future appointments to Google Calendar"""
+    """Start a background job syncing all future appointments to Google Calendar"""
     credentials = await get_user_google_credentials(user_id)
     if not credentials:
         raise HTTPException(status_code=400, detail="Google Calendar not connected")
     
-    # Get all future appointments
-    now = datetime.now(timezone.utc).isoformat()
-    appointments = await db.appointments.find(
-        {"user_id": user_id, "date_time": {"$gte": now}, "status": {"$ne": "cancelled"}},
+    # Only one sync-all per user at a time
+    active = await db.sync_jobs.find_one(
+        {"user_id": user_id, "type": "google_sync_all", "status": {"$in": ["queued", "running"]}},
         {"_id": 0}
-    ).to_list(500)
+    )
+    if active:
+        return {"message": "Sync already in progress", "job_id": active["id"], "status": active["status"]}
+    
+    now = datetime.now(timezone.utc).isoformat()
+    job = {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "type": "google_sync_all",
+        "status": "queued",
+        "sync_from": now,
+        "checkpoint": None,
+        "synced": 0,
+        "errors": 0,
+        "total": await db.appointments.count_documents(
+            {"user_id": user_id, "date_time": {"$gte": now}, "status": {"$ne": "cancelled"}}
+        ),
+        "lease_until": None,
+        "created_at": now,
+        "updated_at": now
+    }
+    await db.sync_jobs.insert_one(job)
+    background_tasks.add_task(run_sync_all_job, job["id"])
+    return {"message": "Sync started", "job_id": job["id"], "status": "queued", "total": job["total"]}
+
+@api_router.get("/calendar/sync-jobs/{job_id}")
+async def get_sync_job(job_id: str, user_id: str = Depends(get_current_user)):
+    """Get progress of a sync-all job"""
+    job = await db.sync_jobs.find_one(
+        {"id": job_id, "user_id": user_id},
+        {"_id": 0, "worker_id": 0, "lease_until": 0, "lease_token": 0}
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="Sync job not found")
+    return job
+
+async def iter_google_event_pages(service, sync_token: Optional[str]):
+    """Yield (events, next_sync_token) per page of events.list.
+
+    With a sync token only changed and deleted events are returned; without
+    one a full listing of future events is made. Google only sends
+    nextSyncToken on the last page.
+    """
+    params = {"singleEvents": True, "maxResults": GOOGLE_IMPORT_PAGE_SIZE}
+    if sync_token:
+        params["syncToken"] = sync_token
+        params["showDeleted"] = True
+    else:
+        params["timeMin"] = datetime.now(timezone.utc).isoformat()
+    
+    page_token = None
+    while True:
+        if page_token:
+            params["pageToken"] = page_token
+        result = await google_gateway.list_events(service, **params)
+        page_token = result.get("nextPageToken")
+        yield result.get("items", []), result.get("nextSyncToken")
+        if not page_token:
+            return
+
+# Appointments imported from Google. Imports made before "source" was recorded
+# are recognised by having no client, which app-created appointments always have.
+GOOGLE_IMPORT_QUERY = {"$or": [{"source": "google"}, {"source": None, "client_id": ""}]}
+
+def is_google_import(appointment: dict) -> bool:
+    return appointment.get("source") == "google" or (appointment.get("source") is None and appointment.get("client_id") == "")
+
+async def backfill_google_import_source():
+    """One-time tagging of legacy Google imports with their source"""
+    if not await claim_migration("migration:appointment_google_source"):
+        return
+    result = await db.appointments.update_many(
+        {"google_event_id": {"$exists": True}, "source": None, "client_id": ""},
+        {"$set": {"source": "google"}}
+    )
+    await complete_migration("migration:appointment_google_source")
+    logger.info(f"Marked {result.modified_count} legacy Google imports")
+
+async def ensure_google_import_source():
+    try:
+        await backfill_google_import_source()
+    except Exception as e:
+        logger.error(f"Google import backfill failed: {e}")
+
+async def apply_google_event_page(user_id: str, events: list, counts: dict):
+    """Create, update or remove local appointments for one page of Google events.
+
+    Existing appointments are resolved with two $in lookups up front and all
+    writes for the page go out as a single unordered bulk_write. A write that
+    fails only moves its own event to "skipped"; the rest of the page applies.
+    """
+    gromify_ids = set()
+    for event in events:
+        gromify_id = event.get('extendedProperties', {}).get('private', {}).get('gromify_id')
+        if gromify_id:
+            gromify_ids.add(gromify_id)
+    
+    app_ids = set()
+    if gromify_ids:
+        app_appts = await db.appointments.find(
+            {"user_id": user_id, "id": {"$in": list(gromify_ids)}},
+            {"_id": 0, "id": 1}
+        ).to_list(None)
+        app_ids = {a["id"] for a in app_appts}
     
-    if not appointments:
-        return {"message": "No appointments to sync", "synced": 0}
+    linked = await db.appointments.find(
+        {"user_id": user_id, "google_event_id": {"$in": [e["id"] for e in events]}},
+        {"_id": 0, "id": 1, "google_event_id": 1, "source": 1, "client_id": 1}
+    ).to_list(None)
+    appt_id_by_event = {a["google_event_id"]: a["id"] for a in linked}
+    imported_id_by_event = {a["google_event_id"]: a["id"] for a in linked if is_google_import(a)}
     
-    # Get all clients for phone/address info
-    client_ids = list(set(a.get("client_id") for a in appointments if a.get("client_id")))
-    clients = await db.clients.find({"id": {"$in": client_ids}}, {"_id": 0}).to_list(100)
-    client_map = {c["id"]: c for c in clients}
+    now = datetime.now(timezone.utc).isoformat()
+    operations = []
+    # (event id, count it was recorded under) for each operation, to undo counts of failed writes
+    operation_events = []
+    tombstones = []
+    for event in events:
+        counts["total_events"] += 1
+        try:
+            if event.get("status") == "cancelled":
+                # Deleted in Google: drop appointments that came from Google, unlink app-created ones
+                operations.append(DeleteMany({"google_event_id": event["id"], "user_id": user_id, **GOOGLE_IMPORT_QUERY}))
+                operations.append(UpdateMany(
+                    {"google_event_id": event["id"], "user_id": user_id},
+                    {"$unset": {"google_event_id": ""}, "$set": {"updated_at": now}}
+                ))
+                operation_events += [(event["id"], "deleted")] * 2
+                appt_id_by_event.pop(event["id"], None)
+                if event["id"] in imported_id_by_event:
+                    tombstones.append((event["id"], {
+                        "user_id": user_id, "collection": "appointments",
+                        "doc_id": imported_id_by_event[event["id"]], "deleted_at": now
+                    }))
+                counts["deleted"] += 1
+                continue
+            
+            # Skip all-day events or events without start time
+            if not event.get('start', {}).get('dateTime'):
+                counts["skipped"] += 1
+                continue
+            
+            # If this event was created by our app, skip it (already synced).
+            # Instances of a recurring series are matched by their linked instance ID.
+            gromify_id = event.get('extendedProperties', {}).get('private', {}).get('gromify_id')
+            if gromify_id and (gromify_id in app_ids or event['id'] in appt_id_by_event):
+                counts["skipped"] += 1
+                continue
+            
+            # Parse event details
+            start_time = event['start']['dateTime']
+            end_time = event['end']['dateTime']
+            summary = event.get('summary', 'Imported from Google Calendar')
+            description = event.get('description', '')
+            
+            existing_id = appt_id_by_event.get(event['id'])
+            if existing_id:
+                # Update existing appointment
+                operations.append(UpdateOne(
+                    {"id": existing_id},
+                    {"$set": {
+                        "date_time": start_time,
+                        "end_time": end_time,
+                        "notes": description,
+                        "updated_at": now
+                    }}
+                ))
+                operation_events.append((event["id"], "updated"))
+                counts["updated"] += 1
+            else:
+                # Create new appointment from Google Calendar event
+                new_appointment = {
+                    "id": str(uuid.uuid4()),
+                    "user_id": user_id,
+                    "client_id": "",
+                    "client_name": summary,
+                    "date_time": start_time,
+                    "end_time": end_time,
+                    "status": "scheduled",
+                    "notes": f"{description}\n\nImported from Google Calendar",
+                    "is_recurring": False,
+                    "recurring_value": None,
+                    "recurring_unit": None,
+                    "recurring_id": None,
+                    "pets": [],
+                    "total_duration": 60,
+                    "total_price": 0.0,
+                    "google_event_id": event['id'],
+                    "source": "google",
+                    "created_at": now
+                }
+                operations.append(InsertOne(new_appointment))
+                operation_events.append((event["id"], "imported"))
+                # A later copy of the same event in this page becomes an update
+                appt_id_by_event[event['id']] = new_appointment["id"]
+                counts["imported"] += 1
+        except Exception as e:
+            logger.error(f"Failed to import event {event.get('id')}: {e}")
+            counts["skipped"] += 1
     
+    failed_events = {}
+    if operations:
+        try:
+            await db.appointments.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                event_id, counted_as = operation_events[error["index"]]
+                if event_id not in failed_events:
+                    failed_events[event_id] = counted_as
+                    logger.error(f"Failed to import event {event_id}: {error.get('errmsg')}")
+            for counted_as in failed_events.values():
+                counts[counted_as] -= 1
+                counts["skipped"] += 1
+    tombstones = [tombstone for event_id, tombstone in tombstones if event_id not in failed_events]
+    if tombstones:
+        await db.backup_tombstones.insert_many(tombstones)
+    if operations:
+        backup_coordinator.mark_dirty(user_id, "appointments")
+
+async def pull_google_changes(user_id: str, credentials) -> dict:
+    """Incrementally pull Google Calendar changes into appointments.
+
+    Uses the user's stored nextSyncToken when present and falls back to a
+    full listing when there is none or Google has expired it (410 Gone).
+    """
+    service = await google_gateway.get_service(user_id, credentials)
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "google_sync_token": 1})
+    sync_token = user.get("google_sync_token") if user else None
+    
+    counts = {"imported": 0, "updated": 0, "deleted": 0, "skipped": 0, "total_events": 0}
+    next_sync_token = None
     try:
-        service = build('calendar', 'v3', credentials=credentials)
-        synced = 0
-        errors = 0
-        
-        for appointment in appointments:
-            try:
-                # Add client details
-                client = client_map.get(appointment.get("client_id"), {})
-                appointment["client_phone"] = client.get("phone", "")
-                appointment["client_address"] = client.get("address", "")
-                
-                event = build_calendar_event(appointment)
-                google_event_id = appointment.get("google_event_id")
-                
-                if google_event_id:
-                    service.events().update(
-                        calendarId='primary',
-                        eventId=google_event_id,
-                        body=event
-                    ).execute()
-                else:
-                    result = service.events().insert(
-                        calendarId='primary',
-                        body=event
-                    ).execute()
-                    
-                    await db.appointments.update_one(
-                        {"id": appointment["id"]},
-                        {"$set": {"google_event_id": result.get("id")}}
-                    )
-                
-                synced += 1
-            except Exception as e:
-                logger.error(f"Failed to sync appointment {appointment.get('id')}: {e}")
-                errors += 1
-        
-        return {"message": f"Synced {synced} appointments", "synced": synced, "errors": errors}
-    except Exception as e:
-        logger.error(f"Sync all error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        async for events, next_sync_token in iter_google_event_pages(service, sync_token):
+            if events:
+                await apply_google_event_page(user_id, events, counts)
+    except HttpError as e:
+        if sync_token and e.resp.status == 410:
+            logger.info(f"Google sync token expired for user {user_id}, running full import")
+            await db.users.update_one({"id": user_id}, {"$unset": {"google_sync_token": ""}})
+            return await pull_google_changes(user_id, credentials)
+        raise
+    
+    if next_sync_token:
+        await db.users.update_one({"id": user_id}, {"$set": {"google_sync_token": next_sync_token}})
+    
+    counts["incremental"] = bool(sync_token)
+    return counts
 
 @api_router.post("/calendar/import-from-google")
 async def import_from_google_calendar(
@@ -2741,104 +5711,8 @@ async def import_from_google_calendar(
         raise HTTPException(status_code=400, detail="Google Calendar not connected")
     
     try:
-        service = build('calendar', 'v3', credentials=credentials)
-        
-        # Get events from Google Calendar from now onwards
-        now = datetime.now(timezone.utc).isoformat()
-        events_result = service.events().list(
-            calendarId='primary',
-            timeMin=now,
-            maxResults=100,
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
-        
-        events = events_result.get('items', [])
-        
-        imported = 0
-        updated = 0
-        skipped = 0
-        
-        for event in events:
-            try:
-                # Skip all-day events or events without start time
-                if not event.get('start', {}).get('dateTime'):
-                    skipped += 1
-                    continue
-                
-                # Check if this event was created by our app
-                extended_props = event.get('extendedProperties', {}).get('private', {})
-                gromify_id = extended_props.get('gromify_id')
-                
-                # If this event was created by our app, skip it (already synced)
-                if gromify_id:
-                    existing = await db.appointments.find_one({"id": gromify_id, "user_id": user_id}, {"_id": 0})
-                    if existing:
-                        skipped += 1
-                        continue
-                
-                # Parse event details
-                start_time = event['start']['dateTime']
-                end_time = event['end']['dateTime']
-                summary = event.get('summary', 'Imported from Google Calendar')
-                description = event.get('description', '')
-                location = event.get('location', '')
-                
-                # Check if appointment with this google_event_id already exists
-                existing_appt = await db.appointments.find_one(
-                    {"google_event_id": event['id'], "user_id": user_id},
-                    {"_id": 0}
-                )
-                
-                if existing_appt:
-                    # Update existing appointment
-                    await db.appointments.update_one(
-                        {"id": existing_appt["id"]},
-                        {"$set": {
-                            "date_time": start_time,
-                            "end_time": end_time,
-                            "notes": description,
-                            "updated_at": datetime.now(timezone.utc).isoformat()
-                        }}
-                    )
-                    updated += 1
-                else:
-                    # Create new appointment from Google Calendar event
-                    new_appointment = {
-                        "id": str(uuid.uuid4()),
-                        "user_id": user_id,
-                        "client_id": "",
-                        "client_name": summary,
-                        "date_time": start_time,
-                        "end_time": end_time,
-                        "status": "scheduled",
-                        "notes": f"{description}\n\nImported from Google Calendar",
-                        "is_recurring": False,
-                        "recurring_value": None,
-                        "recurring_unit": None,
-                        "recurring_id": None,
-                        "pets": [],
-                        "total_duration": 60,
-                        "total_price": 0.0,
-                        "google_event_id": event['id'],
-                        "created_at": datetime.now(timezone.utc).isoformat()
-                    }
-                    
-                    await db.appointments.insert_one(new_appointment)
-                    imported += 1
-                    
-            except Exception as e:
-                logger.error(f"Failed to import event {event.get('id')}: {e}")
-                skipped += 1
-        
-        return {
-            "message": f"Import complete",
-            "imported": imported,
-            "updated": updated,
-            "skipped": skipped,
-            "total_events": len(events)
-        }
-        
+        counts = await pull_google_changes(user_id, credentials)
+        return {"message": "Import complete", **counts}
     except Exception as e:
         logger.error(f"Import from Google error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -2863,14 +5737,15 @@ async def delete_from_google_calendar(
         return {"message": "Not synced to Google Calendar"}
     
     try:
-        service = build('calendar', 'v3', credentials=credentials)
-        service.events().delete(calendarId='primary', eventId=google_event_id).execute()
+        service = await google_gateway.get_service(user_id, credentials)
+        await google_gateway.delete_event(service, google_event_id)
         
         # Remove Google event ID
         await db.appointments.update_one(
             {"id": appointment_id},
-            {"$unset": {"google_event_id": ""}}
+            {"$unset": {"google_event_id": ""}, "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}}
         )
+        backup_coordinator.mark_dirty(user_id, "appointments")
         
         return {"message": "Deleted from Google Calendar"}
     except HttpError as e:
@@ -2878,10 +5753,169 @@ async def delete_from_google_calendar(
             # Event already deleted
             await db.appointments.update_one(
                 {"id": appointment_id},
-                {"$unset": {"google_event_id": ""}}
+                {"$unset": {"google_event_id": ""}, "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}}
             )
+            backup_coordinator.mark_dirty(user_id, "appointments")
             return {"message": "Event already deleted"}
         raise HTTPException(status_code=500, detail=str(e))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Google Calendar request timed out")
+
+@api_router.get("/calendar/metrics")
+async def get_calendar_metrics(user_id: str = Depends(require_admin)):
+    """Latency and error counters for Google Calendar API calls in this worker"""
+    return {"google_api": google_gateway.metrics.snapshot()}
+
+# ==================== GOOGLE PUSH NOTIFICATIONS ====================
+
+async def start_google_watch(user_id: str) -> dict:
+    """Open a Calendar watch channel for a user's primary calendar"""
+    import secrets
+    
+    credentials = await get_user_google_credentials(user_id)
+    if not credentials:
+        raise HTTPException(status_code=400, detail="Google Calendar not connected")
+    
+    service = await google_gateway.get_service(user_id, credentials)
+    channel_id = str(uuid.uuid4())
+    token = secrets.token_urlsafe(32)
+    # Google sends the "sync" handshake as soon as the channel exists, possibly
+    # before watch() returns, so the channel must already be known to the webhook
+    channel_doc = {
+        "id": channel_id,
+        "user_id": user_id,
+        "resource_id": None,
+        "token": token,
+        "expiration": (datetime.now(timezone.utc) + timedelta(seconds=GOOGLE_CHANNEL_TTL_SECONDS)).isoformat(),
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    await db.google_channels.insert_one(channel_doc)
+    channel_doc.pop("_id", None)
+    try:
+        result = await google_gateway.watch_events(service, {
+            "id": channel_id,
+            "type": "web_hook",
+            "address": GOOGLE_WEBHOOK_URL,
+            "token": token,
+            "params": {"ttl": str(GOOGLE_CHANNEL_TTL_SECONDS)}
+        })
+    except BaseException:
+        await db.google_channels.delete_one({"id": channel_id})
+        raise
+    
+    expiration_ms = int(result.get("expiration") or 0)
+    if expiration_ms:
+        channel_doc["expiration"] = datetime.fromtimestamp(expiration_ms / 1000, tz=timezone.utc).isoformat()
+    channel_doc["resource_id"] = result.get("resourceId")
+    await db.google_channels.update_one(
+        {"id": channel_id},
+        {"$set": {"resource_id": channel_doc["resource_id"], "expiration": channel_doc["expiration"]}}
+    )
+    logger.info(f"Started Google watch channel {channel_id} for user {user_id}")
+    return channel_doc
+
+async def stop_google_watches(user_id: str, exclude_channel_id: str = None):
+    """Stop a user's watch channels in Google and forget them"""
+    query = {"user_id": user_id}
+    if exclude_channel_id:
+        query["id"] = {"$ne": exclude_channel_id}
+    channels = await db.google_channels.find(query, {"_id": 0}).to_list(None)
+    if not channels:
+        return
+    
+    credentials = await get_user_google_credentials(user_id)
+    if credentials:
+        service = await google_gateway.get_service(user_id, credentials)
+        for channel in channels:
+            try:
+                await google_gateway.stop_channel(service, channel["id"], channel["resource_id"])
+            except Exception as e:
+                logger.warning(f"Failed to stop Google watch channel {channel['id']}: {e}")
+    await db.google_channels.delete_many({"id": {"$in": [c["id"] for c in channels]}})
+
+async def renew_google_channels():
+    """Replace watch channels that expire soon (scheduled job)"""
+    if not GOOGLE_WEBHOOK_URL:
+        return
+    try:
+        renew_before = datetime.now(timezone.utc) + timedelta(seconds=GOOGLE_CHANNEL_RENEW_BEFORE_SECONDS)
+        expiring = await db.google_channels.find(
+            {"expiration": {"$lte": renew_before.isoformat()}},
+            {"_id": 0, "id": 1, "user_id": 1}
+        ).to_list(None)
+        
+        for channel in expiring:
+            try:
+                new_channel = await start_google_watch(channel["user_id"])
+                await stop_google_watches(channel["user_id"], exclude_channel_id=new_channel["id"])
+            except Exception as e:
+                logger.error(f"Failed to renew Google watch channel {channel['id']}: {e}")
+    except Exception as e:
+        logger.error(f"Error renewing Google watch channels: {e}")
+
+_google_pulls_running = set()
+_google_pulls_dirty = set()
+
+async def run_google_pull(user_id: str):
+    """Incremental pull for one user; notifications during a pull trigger one more pass"""
+    if user_id in _google_pulls_running:
+        _google_pulls_dirty.add(user_id)
+        return
+    
+    _google_pulls_running.add(user_id)
+    try:
+        while True:
+            _google_pulls_dirty.discard(user_id)
+            credentials = await get_user_google_credentials(user_id)
+            if not credentials:
+                return
+            try:
+                counts = await pull_google_changes(user_id, credentials)
+                logger.info(f"Pulled Google changes for user {user_id}: {counts}")
+            except Exception as e:
+                logger.error(f"Google pull failed for user {user_id}: {e}")
+            if user_id not in _google_pulls_dirty:
+                return
+    finally:
+        _google_pulls_running.discard(user_id)
+
+@api_router.post("/calendar/watch")
+async def watch_google_calendar(user_id: str = Depends(get_current_user)):
+    """Subscribe to Google Calendar push notifications for this user"""
+    if not GOOGLE_WEBHOOK_URL:
+        raise HTTPException(status_code=400, detail="Google push notifications not configured")
+    
+    try:
+        channel = await start_google_watch(user_id)
+    except HttpError as e:
+        logger.error(f"Google watch error: {e}")
+        raise HTTPException(status_code=500, detail=f"Google Calendar error: {str(e)}")
+    await stop_google_watches(user_id, exclude_channel_id=channel["id"])
+    return {"channel_id": channel["id"], "expiration": channel["expiration"]}
+
+@api_router.post("/calendar/webhook")
+async def google_calendar_webhook(request: Request, background_tasks: BackgroundTasks):
+    """Receive Google Calendar change notifications"""
+    import secrets
+    
+    channel_id = request.headers.get("X-Goog-Channel-ID")
+    channel_token = request.headers.get("X-Goog-Channel-Token", "")
+    resource_id = request.headers.get("X-Goog-Resource-ID")
+    resource_state = request.headers.get("X-Goog-Resource-State")
+    
+    if not channel_id or not resource_state:
+        raise HTTPException(status_code=400, detail="Missing channel headers")
+    
+    channel = await db.google_channels.find_one({"id": channel_id}, {"_id": 0})
+    if not channel or not secrets.compare_digest(channel.get("token", ""), channel_token):
+        raise HTTPException(status_code=403, detail="Unknown channel")
+    if resource_id and channel.get("resource_id") and resource_id != channel["resource_id"]:
+        raise HTTPException(status_code=403, detail="Unknown channel")
+    
+    # "sync" is the handshake sent when the channel is created
+    if resource_state != "sync":
+        background_tasks.add_task(run_google_pull, channel["user_id"])
+    return {"status": "ok"}
 
 # Include router and middleware
 app.include_router(api_router)
@@ -2898,9 +5932,50 @@ app.add_middleware(
 async def startup_event():
     """Start background services on app startup"""
     start_reminder_scheduler()
+    scheduler.add_job(
+        renew_google_channels,
+        IntervalTrigger(hours=1),
+        id="google_channel_renewal",
+        replace_existing=True
+    )
+    scheduler.add_job(
+        sweep_overdue_invoices,
+        IntervalTrigger(minutes=OVERDUE_SWEEP_MINUTES),
+        id="overdue_invoice_sweep",
+        replace_existing=True
+    )
+    scheduler.add_job(
+        compact_backups,
+        IntervalTrigger(hours=1),
+        id="backup_compaction",
+        replace_existing=True
+    )
+    scheduler.add_job(
+        resume_sync_jobs,
+        IntervalTrigger(minutes=1),
+        id="sync_job_resume",
+        replace_existing=True
+    )
+    await resume_sync_jobs()
+    await ensure_backup_indexes()
+    await ensure_auth_indexes()
+    await ensure_invoice_counters()
+    await ensure_invoice_rollups()
+    await ensure_invoice_pdf_indexes()
+    await ensure_invoice_list_indexes()
+    await ensure_invoice_appointment_index()
+    await ensure_google_import_source()
     logger.info("Application started with reminder scheduler")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
     scheduler.shutdown(wait=False)
+    await google_sync_queue.drain()
+    await backup_coordinator.drain()
+    google_gateway.shutdown()
+    password_hash_executor.shutdown(wait=False)
+    if invoice_pdf_executor:
+        invoice_pdf_executor.shutdown(wait=False, cancel_futures=True)
+    if backup_storage:
+        backup_storage.close()
     client.close()
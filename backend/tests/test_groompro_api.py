@@ -2,9 +2,14 @@
 Backend API Tests for GroomPro Pet Grooming App
 Testing: Login, Invoice check endpoint, Appointments API, Recurring appointments
 """
+import asyncio
 import pytest
 import requests
 import os
+import sys
+import io
+import uuid
+import zipfile
 from datetime import datetime, timedelta
 
 BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
@@ -38,6 +43,48 @@ class TestAuthentication:
         })
         assert response.status_code == 401, f"Expected 401, got {response.status_code}"
         print(f"✓ Invalid login correctly rejected")
+    
+    def test_refresh_token_rotation(self):
+        """Refresh tokens mint new access tokens and cannot be reused"""
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": TEST_EMAIL,
+            "password": TEST_PASSWORD
+        })
+        assert response.status_code == 200, f"Login failed: {response.text}"
+        refresh_token = response.json()["refresh_token"]
+        assert refresh_token, "No refresh_token in response"
+        
+        response = requests.post(f"{BASE_URL}/api/auth/refresh", json={"refresh_token": refresh_token})
+        assert response.status_code == 200, f"Refresh failed: {response.text}"
+        data = response.json()
+        assert data["access_token"] and data["refresh_token"] != refresh_token
+        
+        me = requests.get(f"{BASE_URL}/api/auth/me", headers={"Authorization": f"Bearer {data['access_token']}"})
+        assert me.status_code == 200, f"Refreshed access token rejected: {me.text}"
+        
+        # Reusing the rotated token revokes the session, including the newest token
+        response = requests.post(f"{BASE_URL}/api/auth/refresh", json={"refresh_token": refresh_token})
+        assert response.status_code == 401, f"Expected 401, got {response.status_code}"
+        response = requests.post(f"{BASE_URL}/api/auth/refresh", json={"refresh_token": data["refresh_token"]})
+        assert response.status_code == 401, f"Expected 401, got {response.status_code}"
+        print(f"✓ Refresh token rotated and reuse rejected")
+
+    def test_spoofed_forwarded_for_does_not_reset_ip_limit(self):
+        """A fresh X-Forwarded-For value per request must not buy a fresh per-IP budget"""
+        # Uses password reset for unknown emails, so the login budget is left alone
+        limit = int(os.environ.get("AUTH_RATE_LIMIT_PER_IP", "30"))
+        statuses = []
+        for attempt in range(limit + 1):
+            response = requests.post(
+                f"{BASE_URL}/api/auth/forgot-password",
+                json={"email": f"nobody-{uuid.uuid4().hex[:12]}@example.com"},
+                headers={"X-Forwarded-For": f"203.0.113.{attempt % 250}"}
+            )
+            statuses.append(response.status_code)
+            if response.status_code == 429:
+                break
+        assert statuses[-1] == 429, f"Per-IP limit never applied: {statuses}"
+        print(f"✓ Spoofed X-Forwarded-For throttled after {len(statuses) - 1} attempts")
 
 
 class TestInvoiceCheckEndpoint:
@@ -352,10 +399,51 @@ class TestInvoicesAPI:
             required_fields = ["id", "invoice_number", "client_id", "total", "status"]
             for field in required_fields:
                 assert field in inv, f"Missing field: {field}"
+            internal_fields = {"overdue_at", "overdue_pending", "client_name_lower", "claimed_by"}
+            assert not internal_fields & set(inv), f"Internal fields leaked: {internal_fields & set(inv)}"
             print(f"✓ Invoice structure correct")
         
         return invoices
     
+    def test_invoice_keyset_pagination(self, auth_token):
+        """Following next_cursor walks the same invoices as one large page"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        
+        everything = requests.get(f"{BASE_URL}/api/invoices/page", params={"limit": 500}, headers=headers).json()
+        assert everything["totals"]["count"] >= len(everything["invoices"]), "Totals should cover the whole filtered set"
+        seen, cursor = [], None
+        while True:
+            params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+            response = requests.get(f"{BASE_URL}/api/invoices/page", params=params, headers=headers)
+            assert response.status_code == 200, f"Get invoices failed: {response.text}"
+            page = response.json()
+            seen += [inv["id"] for inv in page["invoices"]]
+            cursor = page["next_cursor"]
+            if not cursor or len(seen) >= 10:
+                break
+        assert seen == [inv["id"] for inv in everything["invoices"]][:len(seen)], "Pages should follow the list order"
+        assert len(seen) == len(set(seen)), "Pages should not overlap"
+        
+        response = requests.get(f"{BASE_URL}/api/invoices/page", params={"cursor": "not-a-cursor"}, headers=headers)
+        assert response.status_code == 400, f"Expected 400, got {response.status_code}"
+        print(f"✓ Paged through {len(seen)} invoices")
+    
+    def test_invoice_search_by_number(self, auth_token):
+        """The numeric part of an invoice number finds the invoice"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        
+        invoices = requests.get(f"{BASE_URL}/api/invoices", headers=headers).json()
+        numbered = [inv for inv in invoices if inv.get("invoice_number", "").startswith("INV-")]
+        if not numbered:
+            pytest.skip("No numbered invoices to search for")
+        number = numbered[0]["invoice_number"]
+        
+        for term in (number.lower(), number.rsplit("-", 1)[1], str(int(number.rsplit("-", 1)[1]))):
+            response = requests.get(f"{BASE_URL}/api/invoices/page", params={"search": term, "limit": 500}, headers=headers)
+            assert response.status_code == 200, f"Search failed: {response.text}"
+            assert number in [inv["invoice_number"] for inv in response.json()["invoices"]], f"{term} should find {number}"
+        print(f"✓ Found {number} by number and by sequence")
+    
     def test_invoice_appointment_link(self, auth_token):
         """Test that invoices are properly linked to appointments"""
         headers = {"Authorization": f"Bearer {auth_token}"}
@@ -381,6 +469,366 @@ class TestInvoicesAPI:
             assert check_data["has_invoice"] == True, f"Invoice check should return True for {appt_id}"
             assert check_data["invoice_number"] == inv["invoice_number"], "Invoice number mismatch"
             print(f"✓ Invoice check correct for appointment {appt_id[:8]}...")
+    
+    def test_batch_invoices_from_appointments(self, auth_token):
+        """Batch invoicing re-uses existing invoices and validates its input"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        
+        response = requests.post(f"{BASE_URL}/api/invoices/batch-from-appointments", json={}, headers=headers)
+        assert response.status_code == 400, f"Expected 400, got {response.status_code}"
+        
+        invoices = requests.get(f"{BASE_URL}/api/invoices", headers=headers).json()
+        linked_ids = [i["appointment_id"] for i in invoices if i.get("appointment_id")][:3]
+        response = requests.post(
+            f"{BASE_URL}/api/invoices/batch-from-appointments",
+            json={"appointment_ids": linked_ids + ["nonexistent-appointment-12345"]},
+            headers=headers
+        )
+        assert response.status_code == 200, f"Batch invoicing failed: {response.text}"
+        data = response.json()
+        assert data["created"] == [], "Already invoiced appointments must not be invoiced again"
+        assert sorted(data["already_invoiced"]) == sorted(set(linked_ids))
+        assert data["skipped"] == [{"appointment_id": "nonexistent-appointment-12345", "reason": "Appointment not found"}]
+        print(f"✓ Batch invoicing skipped {len(linked_ids)} invoiced appointments")
+    
+    def test_revenue_report(self, auth_token):
+        """Revenue report totals match across groupings"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        
+        reports = {}
+        for group_by in ("month", "client"):
+            response = requests.get(f"{BASE_URL}/api/reports/revenue", params={"group_by": group_by}, headers=headers)
+            assert response.status_code == 200, f"Report failed: {response.text}"
+            reports[group_by] = response.json()
+        assert abs(reports["month"]["totals"]["revenue"] - reports["client"]["totals"]["revenue"]) < 0.05
+        
+        response = requests.get(f"{BASE_URL}/api/reports/revenue", params={"group_by": "year"}, headers=headers)
+        assert response.status_code == 400, f"Expected 400, got {response.status_code}"
+        print(f"✓ Revenue report total {reports['month']['totals']['revenue']}")
+
+    def test_invoice_pdf_etag(self, auth_token):
+        """Invoice PDFs are served with an ETag and revalidate with 304"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+
+        invoices = requests.get(f"{BASE_URL}/api/invoices", headers=headers).json()
+        if not invoices:
+            pytest.skip("No invoices to render")
+
+        response = requests.get(f"{BASE_URL}/api/invoices/{invoices[0]['id']}/pdf", headers=headers)
+        assert response.status_code == 200, f"PDF failed: {response.text}"
+        assert response.headers["content-type"] == "application/pdf"
+        assert response.content.startswith(b"%PDF")
+        etag = response.headers["etag"]
+
+        response = requests.get(
+            f"{BASE_URL}/api/invoices/{invoices[0]['id']}/pdf",
+            headers={**headers, "If-None-Match": etag}
+        )
+        assert response.status_code == 304, f"Expected 304, got {response.status_code}"
+        print(f"✓ Invoice PDF revalidated with ETag {etag[:12]}...")
+
+
+def post_google_notification(channel_id=None, token=None, resource_state="exists", resource_id="test-resource"):
+    """Stand-in for Google's push service: post a Calendar change notification"""
+    headers = {"X-Goog-Resource-State": resource_state, "X-Goog-Resource-ID": resource_id}
+    if channel_id:
+        headers["X-Goog-Channel-ID"] = channel_id
+        headers["X-Goog-Message-Number"] = "1"
+    if token:
+        headers["X-Goog-Channel-Token"] = token
+    return requests.post(f"{BASE_URL}/api/calendar/webhook", headers=headers)
+
+
+class TestGoogleCalendarWebhook:
+    """Test the Google Calendar push notification receiver"""
+
+    def test_webhook_missing_headers(self):
+        """Notifications without channel headers are rejected"""
+        response = post_google_notification()
+        assert response.status_code == 400, f"Expected 400, got {response.status_code}"
+        print(f"✓ Notification without channel ID rejected")
+
+    def test_webhook_unknown_channel(self):
+        """Notifications for unknown channels are rejected"""
+        response = post_google_notification(channel_id="nonexistent-channel-12345", token="bogus")
+        assert response.status_code == 403, f"Expected 403, got {response.status_code}"
+        print(f"✓ Unknown channel rejected")
+
+    def test_webhook_sync_handshake_unknown_channel(self):
+        """Even the initial sync handshake must match a stored channel"""
+        response = post_google_notification(channel_id="nonexistent-channel-12345", token="bogus", resource_state="sync")
+        assert response.status_code == 403, f"Expected 403, got {response.status_code}"
+        print(f"✓ Sync handshake for unknown channel rejected")
+
+    def test_webhook_known_channel_accepted(self):
+        """A notification for a stored channel with the right token is accepted"""
+        if not os.environ.get("MONGO_URL"):
+            pytest.skip("MONGO_URL is needed to seed a watch channel")
+        from pymongo import MongoClient
+
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={"email": TEST_EMAIL, "password": TEST_PASSWORD})
+        assert response.status_code == 200
+        token = response.json()["access_token"]
+        user_id = requests.get(f"{BASE_URL}/api/auth/me", headers={"Authorization": f"Bearer {token}"}).json()["id"]
+
+        mongo = MongoClient(os.environ["MONGO_URL"])
+        channels = mongo[os.environ.get("DB_NAME", "test_database")].google_channels
+        channel_id = f"test-channel-{uuid.uuid4()}"
+        channels.insert_one({
+            "id": channel_id,
+            "user_id": user_id,
+            "resource_id": "test-resource",
+            "token": "known-token",
+            "expiration": (datetime.utcnow() + timedelta(days=1)).isoformat() + "+00:00"
+        })
+        try:
+            for state in ("sync", "exists"):
+                response = post_google_notification(channel_id=channel_id, token="known-token", resource_state=state)
+                assert response.status_code == 200, f"Expected 200 for {state}, got {response.status_code}"
+                assert response.json() == {"status": "ok"}
+
+            response = post_google_notification(channel_id=channel_id, token="known-token", resource_id="other-resource")
+            assert response.status_code == 403, f"Expected 403, got {response.status_code}"
+        finally:
+            channels.delete_one({"id": channel_id})
+            mongo.close()
+        print(f"✓ Notification for a known channel accepted")
+
+
+class TestAccountExport:
+    """Test the streaming account export"""
+    
+    @pytest.fixture
+    def auth_token(self):
+        """Get auth token for tests"""
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": TEST_EMAIL,
+            "password": TEST_PASSWORD
+        })
+        assert response.status_code == 200
+        return response.json()["access_token"]
+    
+    def test_export_zip(self, auth_token):
+        """Export contains one file per collection"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        
+        for fmt in ("ndjson", "csv"):
+            response = requests.get(f"{BASE_URL}/api/export", params={"format": fmt}, headers=headers)
+            assert response.status_code == 200, f"Export failed: {response.text}"
+            assert response.headers["content-type"] == "application/zip"
+            archive = zipfile.ZipFile(io.BytesIO(response.content))
+            assert archive.testzip() is None, "Corrupt export archive"
+            assert f"clients.{fmt}" in archive.namelist()
+            assert f"sms_log.{fmt}" in archive.namelist()
+            print(f"✓ {fmt} export has {len(archive.namelist())} files")
+    
+    def test_export_invalid_format(self, auth_token):
+        """Unknown formats are rejected"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        response = requests.get(f"{BASE_URL}/api/export", params={"format": "xml"}, headers=headers)
+        assert response.status_code == 400, f"Expected 400, got {response.status_code}"
+        print(f"✓ Invalid export format rejected")
+
+def run_in_server(scenario):
+    """Run an async scenario against the app's database in-process (the sweeper has no endpoint)"""
+    if not os.environ.get("MONGO_URL") or not os.environ.get("DB_NAME"):
+        pytest.skip("MONGO_URL and DB_NAME are needed to run the sweeper in-process")
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import server
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    async def run():
+        # Motor clients are bound to an event loop, so each scenario gets its own
+        mongo = AsyncIOMotorClient(os.environ["MONGO_URL"])
+        server.db = mongo[os.environ["DB_NAME"]]
+        try:
+            return await scenario(server)
+        finally:
+            mongo.close()
+    return asyncio.run(run())
+
+
+def past_due_invoice(user_id, total=80.0):
+    created = datetime.utcnow() - timedelta(days=30)
+    return {
+        "id": f"test-invoice-{uuid.uuid4()}",
+        "user_id": user_id,
+        "invoice_number": "TEST-0001",
+        "client_id": "test-client",
+        "client_name": "Sweep Test",
+        "items": [],
+        "subtotal": total,
+        "gst_amount": 0,
+        "discount": 0,
+        "total": total,
+        "status": "sent",
+        "due_date": (created + timedelta(days=7)).isoformat() + "+00:00",
+        "created_at": created.isoformat() + "+00:00"
+    }
+
+
+async def remove_sweep_fixtures(server, user_id):
+    await server.db.invoices.delete_many({"user_id": user_id})
+    await server.db.invoice_rollups.delete_many({"user_id": user_id})
+    await server.db.invoice_events.delete_many({"user_id": user_id})
+
+
+class TestOverdueSweep:
+    """Test the overdue invoice sweeper and its event queue"""
+
+    def test_sweep_records_overdue_once(self):
+        """A swept invoice moves into the overdue balance and queues one event, however often the sweep runs"""
+        async def scenario(server):
+            user_id = f"test-sweep-{uuid.uuid4()}"
+            invoice = past_due_invoice(user_id)
+            await server.db.invoices.insert_one(dict(invoice))
+            await server.apply_invoice_rollups(None, invoice)
+            try:
+                await server.sweep_overdue_invoices()
+                await server.sweep_overdue_invoices()
+                return (
+                    await server.db.invoices.find_one({"id": invoice["id"]}, {"_id": 0}),
+                    await server.db.invoice_rollups.find_one({"id": f"{user_id}:tenant:all"}, {"_id": 0}),
+                    await server.db.invoice_events.count_documents({"invoice_id": invoice["id"]})
+                )
+            finally:
+                await remove_sweep_fixtures(server, user_id)
+
+        swept, balance, events = run_in_server(scenario)
+        assert swept["status"] == "overdue"
+        assert "overdue_pending" not in swept
+        assert balance["outstanding"] == 80 and balance["overdue"] == 80
+        assert events == 1
+        print(f"✓ Overdue sweep recorded once")
+
+    def test_unrecorded_sweep_claimed_by_edit(self):
+        """An invoice flipped by a sweep that died before recording is counted once, even if edited first"""
+        async def scenario(server):
+            user_id = f"test-sweep-{uuid.uuid4()}"
+            invoice = past_due_invoice(user_id)
+            await server.apply_invoice_rollups(None, invoice)
+            # State left behind by a sweep that crashed after its update_many
+            await server.db.invoices.insert_one({**invoice, "status": "overdue", "overdue_at": datetime.utcnow().isoformat() + "+00:00", "overdue_pending": True})
+            try:
+                await server.update_invoice(invoice["id"], server.InvoiceUpdate(status="paid"), server.TenantContext(user_id))
+                await server.sweep_overdue_invoices()
+                return (
+                    await server.db.invoice_rollups.find_one({"id": f"{user_id}:tenant:all"}, {"_id": 0}),
+                    await server.db.invoice_events.find({"invoice_id": invoice["id"]}, {"_id": 0}).to_list(None)
+                )
+            finally:
+                await remove_sweep_fixtures(server, user_id)
+
+        balance, events = run_in_server(scenario)
+        assert balance["outstanding"] == 0 and balance["overdue"] == 0
+        assert balance["paid"] == 80
+        assert [e["status"] for e in events] == ["skipped"], "Paid before the sweep recorded it, so no overdue reminder"
+        print(f"✓ Unrecorded sweep counted once after an edit")
+
+    def test_sweep_skipped_while_another_worker_holds_lease(self):
+        """Only the worker holding the sweep lease runs a tick"""
+        async def scenario(server):
+            user_id = f"test-sweep-{uuid.uuid4()}"
+            invoice = past_due_invoice(user_id)
+            await server.db.invoices.insert_one(dict(invoice))
+            lease = await server.db.counters.find_one({"id": "lease:overdue_sweep"}, {"_id": 0})
+            await server.db.counters.update_one(
+                {"id": "lease:overdue_sweep"},
+                {"$set": {"claimed_by": "other-worker", "lease_until": (datetime.utcnow() + timedelta(minutes=5)).isoformat() + "+00:00"}},
+                upsert=True
+            )
+            try:
+                await server.sweep_overdue_invoices()
+                return await server.db.invoices.find_one({"id": invoice["id"]}, {"_id": 0})
+            finally:
+                if lease:
+                    await server.db.counters.replace_one({"id": "lease:overdue_sweep"}, lease)
+                else:
+                    await server.db.counters.delete_one({"id": "lease:overdue_sweep"})
+                await remove_sweep_fixtures(server, user_id)
+
+        unswept = run_in_server(scenario)
+        assert unswept["status"] == "sent"
+        print(f"✓ Sweep skipped without the lease")
+
+    def test_failed_event_retried_with_backoff(self):
+        """A failing event is retried after a delay and only marked failed after the last attempt"""
+        async def scenario(server):
+            user_id = f"test-sweep-{uuid.uuid4()}"
+            event_id = f"test-event-{uuid.uuid4()}"
+            send = server.send_invoice_overdue_sms
+            max_attempts = server.INVOICE_EVENT_MAX_ATTEMPTS
+
+            async def failing_send(event, settings):
+                if event["id"] == event_id:
+                    raise RuntimeError("SMS provider unavailable")
+                await send(event, settings)
+
+            server.send_invoice_overdue_sms = failing_send
+            server.INVOICE_EVENT_MAX_ATTEMPTS = 2
+            await server.db.invoice_events.insert_one({
+                "id": event_id, "type": "invoice_overdue", "user_id": user_id, "invoice_id": "test-invoice",
+                "status": "pending", "attempts": 0, "created_at": "2000-01-01T00:00:00+00:00"
+            })
+            try:
+                states = []
+                for _ in range(2):
+                    await server.process_invoice_events()
+                    states.append(await server.db.invoice_events.find_one({"id": event_id}, {"_id": 0}))
+                # Make the backed-off retry due
+                await server.db.invoice_events.update_one({"id": event_id}, {"$set": {"next_attempt_at": "2000-01-01T00:00:00+00:00"}})
+                await server.process_invoice_events()
+                states.append(await server.db.invoice_events.find_one({"id": event_id}, {"_id": 0}))
+                return states
+            finally:
+                server.send_invoice_overdue_sms = send
+                server.INVOICE_EVENT_MAX_ATTEMPTS = max_attempts
+                await remove_sweep_fixtures(server, user_id)
+
+        first, not_yet_due, last = run_in_server(scenario)
+        assert first["status"] == "pending" and first["attempts"] == 1
+        assert first["next_attempt_at"] > datetime.utcnow().isoformat()
+        assert not_yet_due["attempts"] == 1, "Retry should wait for next_attempt_at"
+        assert last["status"] == "failed" and last["attempts"] == 2
+        assert last["error"] == "SMS provider unavailable"
+        print(f"✓ Failed invoice event retried with backoff")
+
+
+class TestGoogleEventCancellation:
+    """Test how a cancelled Google event is applied to local appointments"""
+
+    def test_cancelled_event_removes_legacy_import(self):
+        """An import made before appointments recorded their source is deleted; an app-created one is only unlinked"""
+        async def scenario(server):
+            user_id = f"test-google-{uuid.uuid4()}"
+            legacy_import = {
+                "id": f"test-appt-{uuid.uuid4()}", "user_id": user_id, "client_id": "", "client_name": "Imported",
+                "date_time": "2030-01-01T10:00:00+00:00", "google_event_id": "legacy-event"
+            }
+            app_created = {
+                "id": f"test-appt-{uuid.uuid4()}", "user_id": user_id, "client_id": "test-client", "client_name": "Booked",
+                "date_time": "2030-01-01T12:00:00+00:00", "google_event_id": "app-event"
+            }
+            await server.db.appointments.insert_many([dict(legacy_import), dict(app_created)])
+            counts = {"total_events": 0, "imported": 0, "updated": 0, "deleted": 0, "skipped": 0}
+            try:
+                await server.apply_google_event_page(user_id, [
+                    {"id": "legacy-event", "status": "cancelled"},
+                    {"id": "app-event", "status": "cancelled"}
+                ], counts)
+                return (
+                    await server.db.appointments.find({"user_id": user_id}, {"_id": 0}).to_list(None),
+                    await server.db.backup_tombstones.find({"user_id": user_id}, {"_id": 0}).to_list(None)
+                )
+            finally:
+                await server.db.appointments.delete_many({"user_id": user_id})
+                await server.db.backup_tombstones.delete_many({"user_id": user_id})
+
+        remaining, tombstones = run_in_server(scenario)
+        assert len(remaining) == 1 and remaining[0]["client_id"] == "test-client"
+        assert "google_event_id" not in remaining[0], "App-created appointment should be unlinked"
+        assert len(tombstones) == 1 and tombstones[0]["doc_id"] != remaining[0]["id"]
+        print(f"✓ Cancelled event removed a legacy import and unlinked an app appointment")
 
 
 if __name__ == "__main__":
@@ -58,6 +58,7 @@ export function AuthProvider({ children }) {
       // Try to save token
       try {
         localStorage.setItem('maya_token', response.data.access_token);
+        localStorage.setItem('maya_refresh_token', response.data.refresh_token);
         console.log('✅ Token saved to localStorage');
       } catch (storageError) {
         console.error('❌ Failed to save token:', storageError);
@@ -81,12 +82,18 @@ export function AuthProvider({ children }) {
       business_name: businessName 
     });
     localStorage.setItem('maya_token', response.data.access_token);
+    localStorage.setItem('maya_refresh_token', response.data.refresh_token);
     await checkAuth();
     return response.data;
   };
 
   const logout = () => {
+    const refreshToken = localStorage.getItem('maya_refresh_token');
+    if (refreshToken) {
+      authAPI.logout(refreshToken).catch(() => {});
+    }
     localStorage.removeItem('maya_token');
+    localStorage.removeItem('maya_refresh_token');
     setUser(null);
     setSettings(null);
     setIsAuthenticated(false);
@@ -19,12 +19,47 @@ api.interceptors.request.use((config) => {
   return config;
 });
 
-// Handle 401 responses
+// Requests whose 401 means bad credentials rather than an expired access token
+const NO_REFRESH_URLS = ['/auth/login', '/auth/register', '/auth/logout'];
+
+// Share one refresh call between requests that fail with 401 at the same time
+let refreshPromise = null;
+
+const refreshAccessToken = () => {
+  if (!refreshPromise) {
+    const refreshToken = localStorage.getItem('maya_refresh_token');
+    refreshPromise = (refreshToken
+      ? axios.post(`${API_URL}/auth/refresh`, { refresh_token: refreshToken }).then((response) => {
+          localStorage.setItem('maya_token', response.data.access_token);
+          localStorage.setItem('maya_refresh_token', response.data.refresh_token);
+          return response.data.access_token;
+        })
+      : Promise.reject(new Error('No refresh token'))
+    ).finally(() => {
+      refreshPromise = null;
+    });
+  }
+  return refreshPromise;
+};
+
+// Handle 401 responses: try a token refresh once, then send the user to login
 api.interceptors.response.use(
   (response) => response,
-  (error) => {
+  async (error) => {
+    const original = error.config;
+    if (error.response?.status === 401 && original && !original._retried && !NO_REFRESH_URLS.includes(original.url)) {
+      original._retried = true;
+      try {
+        const token = await refreshAccessToken();
+        original.headers.Authorization = `Bearer ${token}`;
+        return api(original);
+      } catch (refreshError) {
+        // Fall through to logout
+      }
+    }
     if (error.response?.status === 401) {
       localStorage.removeItem('maya_token');
+      localStorage.removeItem('maya_refresh_token');
       window.location.href = '/login';
     }
     return Promise.reject(error);
@@ -35,6 +70,7 @@ api.interceptors.response.use(
 export const authAPI = {
   register: (data) => api.post('/auth/register', data),
   login: (data) => api.post('/auth/login', data),
+  logout: (refreshToken) => api.post('/auth/logout', { refresh_token: refreshToken }),
   getMe: () => api.get('/auth/me'),
 };
 
@@ -35,6 +35,9 @@ export default function Invoices() {
   const [selectedInvoice, setSelectedInvoice] = useState(null);
   const [editingInvoice, setEditingInvoice] = useState(null);
   const [statusFilter, setStatusFilter] = useState('');
+  const [invoiceTotals, setInvoiceTotals] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   
   // Form state
   const [formData, setFormData] = useState({
@@ -52,12 +55,14 @@ export default function Invoices() {
     setLoading(true);
     try {
       const [invoicesRes, clientsRes, servicesRes, itemsRes] = await Promise.all([
-        axios.get(`${API_URL}/invoices?status=${statusFilter}`, getAuthHeaders()),
+        axios.get(`${API_URL}/invoices/page?status=${statusFilter}`, getAuthHeaders()),
         axios.get(`${API_URL}/clients`, getAuthHeaders()),
         axios.get(`${API_URL}/services`, getAuthHeaders()),
         axios.get(`${API_URL}/items`, getAuthHeaders())
       ]);
-      setInvoices(invoicesRes.data);
+      setInvoices(invoicesRes.data.invoices);
+      setInvoiceTotals(invoicesRes.data.totals);
+      setNextCursor(invoicesRes.data.next_cursor);
       setClients(clientsRes.data);
       setServices(servicesRes.data);
       setItems(itemsRes.data);
@@ -68,6 +73,23 @@ export default function Invoices() {
     }
   };
 
+  const loadMoreInvoices = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const res = await axios.get(`${API_URL}/invoices/page`, {
+        ...getAuthHeaders(),
+        params: { status: statusFilter, cursor: nextCursor }
+      });
+      setInvoices(prev => [...prev, ...res.data.invoices]);
+      setNextCursor(res.data.next_cursor);
+    } catch (error) {
+      toast.error('Failed to load more invoices');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const openNewInvoice = () => {
     setEditingInvoice(null);
     setFormData({
@@ -444,17 +466,43 @@ export default function Invoices() {
     return doc;
   };
 
+  // Server-rendered PDF (cached, revalidated by ETag); falls back to rendering it here
+  const getInvoicePDFBlob = async (client) => {
+    try {
+      const res = await axios.get(`${API_URL}/invoices/${selectedInvoice.invoice.id}/pdf`, {
+        ...getAuthHeaders(),
+        responseType: 'blob'
+      });
+      return res.data;
+    } catch (error) {
+      const doc = generateInvoicePDF(client);
+      return doc ? doc.output('blob') : null;
+    }
+  };
+
+  const downloadPDF = (pdfBlob, fileName) => {
+    const url = URL.createObjectURL(pdfBlob);
+    const link = document.createElement('a');
+    link.href = url;
+    link.download = fileName;
+    link.click();
+    URL.revokeObjectURL(url);
+  };
+
   // Share invoice PDF via Web Share API (allows attaching to SMS/Email)
   const shareInvoicePDF = async () => {
     try {
-      const client = clients.find(c => c.id === selectedInvoice?.invoice?.client_id);
-      const doc = generateInvoicePDF(client);
-      if (!doc) {
+      if (!selectedInvoice) {
+        toast.error('No invoice selected');
+        return;
+      }
+      const client = clients.find(c => c.id === selectedInvoice.invoice.client_id);
+      const pdfBlob = await getInvoicePDFBlob(client);
+      if (!pdfBlob) {
         toast.error('No invoice selected');
         return;
       }
       
-      const pdfBlob = doc.output('blob');
       const fileName = `Invoice_${selectedInvoice.invoice.invoice_number}.pdf`;
       const file = new File([pdfBlob], fileName, { type: 'application/pdf' });
       
@@ -469,7 +517,7 @@ export default function Invoices() {
         setShowSendInvoiceDialog(false);
       } else {
         // Fallback: just download the PDF
-        doc.save(fileName);
+        downloadPDF(pdfBlob, fileName);
         toast.success('PDF downloaded');
         setShowSendInvoiceDialog(false);
       }
@@ -523,7 +571,7 @@ export default function Invoices() {
       <div className="p-4 md:p-6">
         <PageHeader 
           title="Invoices" 
-          subtitle={`${invoices.length} invoices`}
+          subtitle={`${invoiceTotals?.count ?? invoices.length} invoices`}
           action={
             <Button onClick={openNewInvoice} className="btn-maya-primary" data-testid="new-invoice-btn">
               <Plus size={18} className="mr-2" />
@@ -600,6 +648,18 @@ export default function Invoices() {
             </div>
           ))}
 
+          {nextCursor && (
+            <Button
+              variant="outline"
+              className="w-full"
+              onClick={loadMoreInvoices}
+              disabled={loadingMore}
+              data-testid="load-more-invoices"
+            >
+              {loadingMore ? 'Loading...' : 'Load more'}
+            </Button>
+          )}
+
           {invoices.length === 0 && !loading && (
             <div className="empty-state">
               <FileText className="empty-state-icon mx-auto" />
@@ -199,10 +199,20 @@ export default function Settings() {
     setSyncLoading(true);
     try {
       const token = localStorage.getItem('maya_token');
-      const response = await axios.post(`${API_URL}/calendar/sync-all`, {}, {
-        headers: { Authorization: `Bearer ${token}` }
-      });
-      toast.success(`Synced ${response.data.synced} appointments to Google Calendar`);
+      const headers = { Authorization: `Bearer ${token}` };
+      const response = await axios.post(`${API_URL}/calendar/sync-all`, {}, { headers });
+      // Sync runs as a background job - poll until it finishes
+      let job = response.data;
+      while (job.status === 'queued' || job.status === 'running') {
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+        const jobRes = await axios.get(`${API_URL}/calendar/sync-jobs/${job.job_id || job.id}`, { headers });
+        job = { ...jobRes.data, job_id: jobRes.data.id };
+      }
+      if (job.status === 'failed') {
+        toast.error(job.error || 'Failed to sync');
+      } else {
+        toast.success(`Synced ${job.synced} appointments to Google Calendar`);
+      }
     } catch (error) {
       toast.error(error.response?.data?.detail || 'Failed to sync');
     } finally {
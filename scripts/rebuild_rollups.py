@@ -0,0 +1,30 @@
+"""Rebuild the invoice report rollups from the invoices collection.
+
+Run from the repository root with the backend environment configured:
+
+    python scripts/rebuild_rollups.py [--user <user_id>]
+
+Without --user every tenant's rollups are recomputed.
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+
+async def main(args):
+    started = time.perf_counter()
+    written = await server.rebuild_invoice_rollups(args.user)
+    print(f"Wrote {written} rollups in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild invoice report rollups")
+    parser.add_argument("--user", help="Only rebuild this user's rollups")
+    sys.exit(asyncio.run(main(parser.parse_args())))
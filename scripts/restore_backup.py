@@ -0,0 +1,50 @@
+"""Restore a user's data from the latest backups and report timings.
+
+Run from the repository root with the backend environment configured:
+
+    python scripts/restore_backup.py <user_id> [--collections clients pets] [--backup-first]
+
+Set BACKUP_STORAGE=local (and optionally BACKUP_LOCAL_DIR) to benchmark the
+backup/restore round trip against the local filesystem instead of Supabase.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+
+async def main(args):
+    if not server.backup_storage:
+        print("Backup storage is not configured (set SUPABASE_URL/SUPABASE_KEY or BACKUP_STORAGE=local)")
+        return 1
+    collections = args.collections or server.BACKUP_COLLECTIONS
+    await server.ensure_backup_indexes()
+
+    if args.backup_first:
+        started = time.perf_counter()
+        await server.backup_user_data(args.user_id, full=True)
+        print(f"Full backup took {time.perf_counter() - started:.2f}s")
+
+    report = await server.restore_user_data(args.user_id, collections)
+    await server.backup_coordinator.drain()
+    print(json.dumps(report, indent=2))
+
+    documents = sum(r.get("documents", 0) for r in report["collections"])
+    seconds = report["elapsed_ms"] / 1000
+    print(f"Restored {documents} documents in {seconds:.2f}s ({documents / seconds if seconds else 0:.0f} docs/s)")
+    server.backup_storage.close()
+    return 0 if report["status"] == "completed" else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Restore a user's data from backups")
+    parser.add_argument("user_id")
+    parser.add_argument("--collections", nargs="+", choices=server.BACKUP_COLLECTIONS)
+    parser.add_argument("--backup-first", action="store_true", help="Take a full backup before restoring")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -13,10 +13,23 @@ CREATE TABLE IF NOT EXISTS maya_backups (
     created_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- Incremental backups: "full" snapshots plus "incremental" rows holding changed
+-- documents and the ids of deleted ones (tombstones)
+ALTER TABLE maya_backups ADD COLUMN IF NOT EXISTS kind TEXT NOT NULL DEFAULT 'full';
+ALTER TABLE maya_backups ADD COLUMN IF NOT EXISTS deleted JSONB NOT NULL DEFAULT '[]'::jsonb;
+
+-- Chunked backups: documents live as gzip NDJSON chunks in the maya-backups
+-- storage bucket; each row holds the manifest describing its chunks
+ALTER TABLE maya_backups ADD COLUMN IF NOT EXISTS manifest JSONB;
+INSERT INTO storage.buckets (id, name, public)
+VALUES ('maya-backups', 'maya-backups', false)
+ON CONFLICT (id) DO NOTHING;
+
 -- Create indexes for faster queries
 CREATE INDEX IF NOT EXISTS idx_maya_backups_user_id ON maya_backups(user_id);
 CREATE INDEX IF NOT EXISTS idx_maya_backups_collection ON maya_backups(collection);
 CREATE INDEX IF NOT EXISTS idx_maya_backups_backup_at ON maya_backups(backup_at DESC);
+CREATE INDEX IF NOT EXISTS idx_maya_backups_user_collection ON maya_backups(user_id, collection, backup_at DESC);
 
 -- Enable Row Level Security (RLS)
 ALTER TABLE maya_backups ENABLE ROW LEVEL SECURITY;